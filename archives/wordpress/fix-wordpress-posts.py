@@ -3,26 +3,59 @@
 Fix WordPress posts that are displaying HTML tags as plain text
 """
 
-import json
-import subprocess
+import argparse
+import difflib
+import hashlib
+import os
 import sys
 import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-WP_URL = "https://wp.stringbits.com"
-WP_API_URL = f"{WP_URL}/wp-json/wp/v2"
+# Shared helpers live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from wptools.client import BATCH_LIMIT, WordPressClient, WordPressError
+from wptools.jobqueue import DEFAULT_PATH as QUEUE_PATH, JobQueue, run_jobs
+from wptools.postindex import DEFAULT_PATH, PostIndex
+from wptools.scan import fetch_all, scan_posts
+
+# WP_URL points the script at another site, such as a local wptools.fakewp
+WP_URL = os.environ.get("WP_URL", "https://wp.stringbits.com")
 USERNAME = "itservice"
 PASSWORD = "LV78 2PAJ XXOi YLzt AlMg SizX"
 
-def get_all_posts():
-    """Get all posts from WordPress"""
-    cmd = [
-        'curl', '-s',
-        f'{WP_API_URL}/posts?per_page=100',
-        '-u', f'{USERNAME}:{PASSWORD}'
-    ]
+# One keep-alive connection pool for every request in the run
+client = WordPressClient(WP_URL, USERNAME, PASSWORD)
+
+# Only what the check, the report and the fix read
+SCAN_FIELDS = ('id', 'title.rendered', 'link', 'content.rendered', 'content.raw')
+
+# Name under which verdicts are kept in the post index
+CHECK_NAME = 'visible-html'
+
+def find_problematic_posts(concurrency=4, checkpoint=None):
+    """Scan every page of posts, yielding those with visible HTML tags"""
+    return scan_posts(client, check_post_has_html_tags, fields=SCAN_FIELDS,
+                      params={'context': 'edit'}, concurrency=concurrency,
+                      checkpoint_path=checkpoint)
+
+def find_changed_problematic_posts(index, concurrency=4):
+    """Check only posts changed since the last check, or flagged by it
     
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    return json.loads(result.stdout)
+    The index is synced first, which fetches just the posts modified
+    since the previous sync.  Verdicts are stored in the index.
+    """
+    changed = {post['id']: post for post in index.sync(fields=SCAN_FIELDS, concurrency=concurrency)}
+    pending = index.pending(CHECK_NAME)
+    posts = [changed[post_id] for post_id in pending if post_id in changed]
+    missing = [post_id for post_id in pending if post_id not in changed]
+    for start in range(0, len(missing), 100):
+        ids = ','.join(str(post_id) for post_id in missing[start:start + 100])
+        posts.extend(fetch_all(client, '/posts', fields=SCAN_FIELDS, concurrency=concurrency,
+                               params={'context': 'edit', 'status': 'any', 'include': ids}))
+    verdicts = {post['id']: check_post_has_html_tags(post) for post in posts}
+    index.record_checks(CHECK_NAME, verdicts)
+    return [post for post in posts if verdicts[post['id']]]
 
 def check_post_has_html_tags(post):
     """Check if post content has visible HTML tags"""
@@ -30,90 +63,175 @@ def check_post_has_html_tags(post):
     # Check if content has HTML tags that should be rendered
     return '&lt;h' in content or '&lt;p&gt;' in content or '&amp;lt;' in content
 
-def fix_post_content(post_id):
-    """Fix post by re-saving it with proper HTML"""
-    # Get the post
-    cmd = [
-        'curl', '-s',
-        f'{WP_API_URL}/posts/{post_id}',
-        '-u', f'{USERNAME}:{PASSWORD}'
-    ]
-    
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    post = json.loads(result.stdout)
-    
-    # Get the raw content
-    content = post['content']['raw']
-    
-    # If content has escaped HTML, unescape it
+def unescape_content(content):
+    """Undo the HTML escaping that makes tags show up as text"""
     if '&lt;' in content or '&amp;' in content:
         content = content.replace('&lt;', '<')
         content = content.replace('&gt;', '>')
         content = content.replace('&amp;', '&')
         content = content.replace('&quot;', '"')
+    return content
+
+def update_post_content(post_id, content):
+    """Save new content for one post"""
+    try:
+        response = client.post(f'/posts/{post_id}', {'content': content}, fields=('id',))
+    except WordPressError:
+        return False
+    return 'id' in response
+
+def print_diff(post, fixed):
+    """Show what fixing a post would change"""
+    diff = difflib.unified_diff(post['content']['raw'].splitlines(), fixed.splitlines(),
+                                f"{post['id']} (current)", f"{post['id']} (fixed)", lineterm='')
+    for line in diff:
+        print(f"   {line}")
+
+def fix_posts(posts, concurrency=4):
+    """Save unescaped content for posts whose raw content was scanned
+
+    Updates go out BATCH_LIMIT at a time through the batch endpoint; if the
+    site has none, they are sent one per request on a bounded pool.
+    Returns {post id: fixed}.
+    """
+    updates = [(post['id'], unescape_content(post['content']['raw'])) for post in posts]
+    results = {}
+    use_batch = True
+    for start in range(0, len(updates), BATCH_LIMIT):
+        group = updates[start:start + BATCH_LIMIT]
+        if use_batch:
+            try:
+                responses = client.batch([('POST', f'/posts/{post_id}', {'content': content})
+                                          for post_id, content in group])
+            except WordPressError as e:
+                if e.status not in (404, 405):
+                    # Retries are used up (or the site is down): count these as not fixed
+                    print(f"   ❌ Batch of {len(group)} updates failed: {e}")
+                    results.update((post_id, False) for post_id, _ in group)
+                    continue
+                print("   ⚠️  Batch endpoint not available, updating posts one by one")
+                use_batch = False
+            else:
+                for (post_id, _), (status, _) in zip(group, responses):
+                    results[post_id] = status is not None and 200 <= status < 300
+                continue
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            saved = pool.map(lambda update: update_post_content(*update), group)
+            for (post_id, _), ok in zip(group, saved):
+                results[post_id] = ok
+    return results
+
+def fix_queued(posts, queue_path=QUEUE_PATH, concurrency=4):
+    """Save unescaped content for posts as jobs of the durable queue
+    
+    Each fix is keyed by the post and the hash of its raw content, so a
+    run that is interrupted and started again does not save a post twice.
+    Returns {post id: fixed}.
+    """
+    queue = JobQueue(queue_path, site=WP_URL)
+    try:
+        queue.recover()
+        results = {}
+        for post in posts:
+            raw = post['content']['raw']
+            key = f"post:{post['id']}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+            if not queue.enqueue('fix', key, {'post_id': post['id'],
+                                              'content': unescape_content(raw)}):
+                # Saved by an earlier run (or queued by one still going)
+                results[post['id']] = True
         
-        # Update the post
-        update_data = {
-            'content': content
-        }
-        
-        with open('/tmp/fix-post.json', 'w') as f:
-            json.dump(update_data, f)
-        
-        cmd = [
-            'curl', '-X', 'POST',
-            f'{WP_API_URL}/posts/{post_id}',
-            '-u', f'{USERNAME}:{PASSWORD}',
-            '-H', 'Content-Type: application/json',
-            '-d', '@/tmp/fix-post.json',
-            '-s'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        response = json.loads(result.stdout)
+        def fix(job):
+            if not update_post_content(job['payload']['post_id'], job['payload']['content']):
+                raise WordPressError(f"could not save post {job['payload']['post_id']}")
+            return {'id': job['payload']['post_id']}
         
-        if 'id' in response:
-            return True
-    return False
+        finished, stopped = run_jobs(queue, {'fix': fix}, workers=concurrency)
+    finally:
+        queue.close()
+    if stopped:
+        print(f"   ⏸️  Stopped early ({stopped}): run again to fix the rest")
+    results.update((job['payload']['post_id'], job['state'] == 'done') for job in finished)
+    return results
 
 def main():
+    parser = argparse.ArgumentParser(description='Fix posts showing HTML tags as text')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='pages fetched (and single updates sent) in parallel (default: 4)')
+    parser.add_argument('--checkpoint', default='.fix-wordpress-posts.scan',
+                        help='full scan progress file, resumed if present')
+    parser.add_argument('--index', default=DEFAULT_PATH,
+                        help='local post index; only posts changed since the last run are '
+                             f'checked (default: {DEFAULT_PATH})')
+    parser.add_argument('--full-scan', action='store_true',
+                        help='check every post on the site instead of using the index')
+    parser.add_argument('--yes', '-y', action='store_true',
+                        help='fix without asking for confirmation')
+    parser.add_argument('--queue', nargs='?', const=QUEUE_PATH, metavar='PATH',
+                        help='save the fixes as jobs of a durable queue (default: '
+                             f'{QUEUE_PATH}), so an interrupted run resumes without saving '
+                             'a post twice')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print a diff of each fix instead of saving it')
+    args = parser.parse_args()
+    
     print("🔍 Checking WordPress posts for HTML display issues...")
     
-    posts = get_all_posts()
     problematic_posts = []
-    
-    for post in posts:
-        if check_post_has_html_tags(post):
-            problematic_posts.append({
-                'id': post['id'],
-                'title': post['title']['rendered'],
-                'link': post['link']
-            })
+    try:
+        if args.full_scan:
+            found = find_problematic_posts(args.concurrency, args.checkpoint)
+        else:
+            index = PostIndex(client, args.index, site=WP_URL)
+            print(f"   {'Updating' if index.state() else 'Building'} the post index {args.index}")
+            found = find_changed_problematic_posts(index, args.concurrency)
+        for post in found:
+            problematic_posts.append(post)
+            print(f"   - {post['title']['rendered']} (ID: {post['id']})")
+    except WordPressError as e:
+        print(f"❌ Scan stopped: {e}")
+        print("   Run again to resume from the pages already scanned")
+        sys.exit(1)
     
     if not problematic_posts:
         print("✅ No posts with HTML display issues found!")
         return
     
-    print(f"\n⚠️  Found {len(problematic_posts)} posts with HTML display issues:")
-    for post in problematic_posts:
-        print(f"   - {post['title']} (ID: {post['id']})")
+    print(f"\n⚠️  Found {len(problematic_posts)} posts with HTML display issues")
+    
+    # Posts whose raw content is already clean only look broken when rendered
+    fixable = [post for post in problematic_posts
+               if unescape_content(post['content']['raw']) != post['content']['raw']]
+    if len(fixable) < len(problematic_posts):
+        print(f"   {len(problematic_posts) - len(fixable)} have no escaped HTML "
+              f"in their raw content")
+    if not fixable:
+        return
     
-    response = input("\nFix these posts? (y/n): ")
-    if response.lower() != 'y':
-        print("Cancelled.")
+    if args.dry_run:
+        print("\n🔎 Dry run, nothing is saved:")
+        for post in fixable:
+            print(f"\n📄 {post['title']['rendered']} (ID: {post['id']})")
+            print_diff(post, unescape_content(post['content']['raw']))
         return
     
+    if not args.yes:
+        response = input("\nFix these posts? (y/n): ")
+        if response.lower() != 'y':
+            print("Cancelled.")
+            return
+    
     print("\n🔧 Fixing posts...")
-    fixed = 0
-    for post in problematic_posts:
-        print(f"   Fixing: {post['title']}...", end='')
-        if fix_post_content(post['id']):
-            print(" ✅")
-            fixed += 1
-        else:
-            print(" ❌")
+    if args.queue:
+        results = fix_queued(fixable, args.queue, args.concurrency)
+    else:
+        results = fix_posts(fixable, args.concurrency)
+    for post in fixable:
+        print(f"   {'✅' if results.get(post['id']) else '❌'} {post['title']['rendered']}")
     
-    print(f"\n✅ Fixed {fixed} out of {len(problematic_posts)} posts!")
+    fixed = sum(1 for ok in results.values() if ok)
+    print(f"\n✅ Fixed {fixed} out of {len(fixable)} posts!")
+    if fixed < len(fixable):
+        sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
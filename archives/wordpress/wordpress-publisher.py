@@ -4,46 +4,153 @@ WordPress Documentation Publisher
 Publishes markdown documentation to WordPress
 """
 
-import requests
-import json
-import base64
+import os
 import re
 import sys
-import time
 from pathlib import Path
 
+# Shared helpers live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from wptools import media
+from wptools.bulk import print_summary
+from wptools.cache import RenderCache, markdown_hash, render_key
+from wptools.client import CircuitOpen, WordPressClient, WordPressError
+from wptools.jobqueue import JobQueue, run_jobs
+from wptools.manifest import Manifest, fingerprint
+from wptools.markdown import table_alignments
+from wptools.taxonomy import TaxonomyResolver
+
 # WordPress configuration
-WP_URL = "https://wp.stringbits.com"
-WP_API_URL = f"{WP_URL}/wp-json/wp/v2"
+# WP_URL points the script at another site, such as a local wptools.fakewp
+WP_URL = os.environ.get("WP_URL", "https://wp.stringbits.com")
+
+# Bump when markdown_to_html output changes, so cached renders are not reused
+CONVERTER_VERSION = "archive-3"
+
+TABLE_SEPARATOR = re.compile(r'^\|[-:\s|]+\|$')
+FENCE_LANG = re.compile(r'\w*\n')
+
+# The helpers below replace regexes that rescanned the rest of the document
+# from every unclosed '```', '[' or '<' (quadratic time on broken input).
+# Each one makes the same replacements in a single pass.
+
+def replace_code_blocks(content, render):
+    """Replace each fenced code block with render(lang, code)"""
+    out = []
+    done = 0
+    start = content.find('```')
+    while start >= 0:
+        opening = FENCE_LANG.match(content, start + 3)
+        if opening:
+            close = content.find('\n```', opening.end())
+            if close < 0:
+                # Nothing left can close a block
+                break
+            out.append(content[done:start])
+            out.append(render(content[start + 3:opening.end() - 1], content[opening.end():close]))
+            done = close + 4
+            start = content.find('```', done)
+        else:
+            start = content.find('```', start + 1)
+    out.append(content[done:])
+    return ''.join(out)
+
+def replace_links(content, opener, render, min_label=1):
+    """Replace each opener + '[label](url)' span with render(label, url)
+
+    opener is '[' for links and '![' for images (whose label may be empty,
+    min_label=0).
+    """
+    out = []
+    done = 0
+    # Closing characters are searched from non-decreasing positions, so a
+    # search that found one answers every later search up to it
+    found = {}
+    
+    def find(char, start):
+        searched, at = found.get(char, (len(content) + 1, -1))
+        if not (searched <= start and (at < 0 or at >= start)):
+            at = content.find(char, start)
+            found[char] = (start, at)
+        return at
+    
+    start = content.find(opener)
+    while start >= 0:
+        label = start + len(opener)
+        close = find(']', label)
+        if close < 0:
+            break
+        if close >= label + min_label and content.startswith('(', close + 1):
+            end = find(')', close + 2)
+            if end > close + 2:
+                out.append(content[done:start])
+                out.append(render(content[label:close], content[close + 2:end]))
+                done = end + 1
+                start = content.find(opener, done)
+                continue
+        start = content.find(opener, start + 1)
+    out.append(content[done:])
+    return ''.join(out)
+
+def join_split_tags(content):
+    """Join a tag and the 'text</tag>' after it when a blank line separates them"""
+    out = []
+    done = 0
+    resume = 0
+    gap = content.find('>\n\n')
+    while gap >= 0:
+        # The tag before the gap opens after the previous '>'
+        bound = max(resume, content.rfind('>', resume, gap) + 1)
+        tag = content.find('<', bound, max(gap - 1, 0))
+        if tag >= 0:
+            text = gap + 3
+            closing = content.find('<', text)
+            if closing > text and content.startswith('</', closing):
+                end = content.find('>', closing + 2)
+                if end > closing + 2:
+                    out.append(content[done:gap + 1])
+                    done = text
+                    resume = end + 1
+                    gap = content.find('>\n\n', resume)
+                    continue
+        gap = content.find('>\n\n', gap + 1)
+    out.append(content[done:])
+    return ''.join(out)
 
 class WordPressPublisher:
     def __init__(self, username, password):
         self.username = username
         self.password = password
-        self.auth_header = self._create_auth_header()
         self.category_id = None
+        self.render_cache = RenderCache()
+        # Which file became which post, so edited files update their post
+        self.manifest = Manifest(site=WP_URL)
+        # Shared by every API call: retries, adaptive concurrency and the
+        # circuit breaker apply across the whole run
+        self.client = WordPressClient(WP_URL, username, password)
+        self.taxonomy = TaxonomyResolver(self.client, site=WP_URL)
+        # Local images go to the media library, each content once
+        self.media = media.MediaUploader(self.client, media.MediaIndex(site=WP_URL))
         
-    def _create_auth_header(self):
-        """Create basic auth header"""
-        credentials = f"{self.username}:{self.password}"
-        encoded = base64.b64encode(credentials.encode()).decode()
-        return {"Authorization": f"Basic {encoded}"}
-    
     def markdown_to_html(self, content):
+        """Convert markdown to HTML, reusing a cached render when possible"""
+        key = render_key(markdown_hash(content), CONVERTER_VERSION)
+        return self.render_cache.render(key, lambda: self._convert_markdown(content))
+    
+    def _convert_markdown(self, content):
         """Convert markdown to HTML with improved formatting"""
         import html
         
         # Escape HTML entities in code blocks first
-        def escape_code_content(match):
-            lang = match.group(1) or ''
-            code = html.escape(match.group(2))
+        def escape_code_content(lang, code):
+            code = html.escape(code)
             if lang:
                 return f'<pre class="wp-block-code"><code class="language-{lang}">{code}</code></pre>'
             else:
                 return f'<pre class="wp-block-code"><code>{code}</code></pre>'
         
         # Code blocks with syntax highlighting (handle before other conversions)
-        content = re.sub(r'```(\w*)\n(.*?)\n```', escape_code_content, content, flags=re.DOTALL)
+        content = replace_code_blocks(content, escape_code_content)
         
         # Inline code (escape HTML)
         content = re.sub(r'`([^`]+)`', lambda m: f'<code>{html.escape(m.group(1))}</code>', content)
@@ -54,11 +161,12 @@ class WordPressPublisher:
         content = re.sub(r'^## (.+)$', r'<h2>\1</h2>', content, flags=re.MULTILINE)
         content = re.sub(r'^# (.+)$', r'<h1>\1</h1>', content, flags=re.MULTILINE)
         
-        # Links [text](url)
-        content = re.sub(r'\[([^\]]+)\]\(([^\)]+)\)', r'<a href="\2">\1</a>', content)
+        # Images ![alt](url), before links so their [alt](url) is not taken for one
+        content = replace_links(content, '![', lambda alt, url: f'<img src="{url}" alt="{alt}" />',
+                                min_label=0)
         
-        # Images ![alt](url)
-        content = re.sub(r'!\[([^\]]*)\]\(([^\)]+)\)', r'<img src="\2" alt="\1" />', content)
+        # Links [text](url)
+        content = replace_links(content, '[', lambda text, url: f'<a href="{url}">{text}</a>')
         
         # Bold (handle before italic to avoid conflicts)
         content = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', content)
@@ -135,40 +243,50 @@ class WordPressPublisher:
         
         content = '\n'.join(new_lines)
         
-        # Tables (basic support)
-        def convert_table(match):
-            table_text = match.group(0)
-            rows = table_text.strip().split('\n')
-            if len(rows) < 2:
-                return table_text
-            
-            html_table = '<table class="wp-block-table">\n'
-            
-            # Header row
-            headers = [cell.strip() for cell in rows[0].split('|') if cell.strip()]
-            html_table += '<thead>\n<tr>\n'
-            for header in headers:
-                html_table += f'<th>{header}</th>\n'
-            html_table += '</tr>\n</thead>\n'
-            
-            # Body rows (skip separator row)
+        # Tables, one pass over the lines: a header row, a separator row
+        # (whose colons set the column alignment), then body rows
+        def is_row(line):
+            return len(line) > 2 and line.startswith('|') and line.endswith('|')
+        
+        def row_cells(row, tag, alignments):
+            cells = [cell.strip() for cell in row.split('|') if cell.strip()]
+            parts = []
+            for i, cell in enumerate(cells):
+                align = alignments[i] if i < len(alignments) else None
+                attrs = f' class="has-text-align-{align}" data-align="{align}"' if align else ''
+                parts.append(f'<{tag}{attrs}>{cell}</{tag}>')
+            return cells, parts
+        
+        def convert_table(rows):
+            alignments = table_alignments(rows[1]) or []
+            _, headers = row_cells(rows[0], 'th', alignments)
+            parts = ['<table class="wp-block-table">', '<thead>', '<tr>', *headers,
+                     '</tr>', '</thead>']
             if len(rows) > 2:
-                html_table += '<tbody>\n'
+                parts.append('<tbody>')
                 for row in rows[2:]:
-                    cells = [cell.strip() for cell in row.split('|') if cell.strip()]
+                    cells, tags = row_cells(row, 'td', alignments)
                     if cells:
-                        html_table += '<tr>\n'
-                        for cell in cells:
-                            html_table += f'<td>{cell}</td>\n'
-                        html_table += '</tr>\n'
-                html_table += '</tbody>\n'
-            
-            html_table += '</table>'
-            return html_table
+                        parts.extend(('<tr>', *tags, '</tr>'))
+                parts.append('</tbody>')
+            parts.append('</table>')
+            return '\n'.join(parts)
         
-        # Match tables (lines with | separators)
-        content = re.sub(r'^\|[^\n]+\|$\n^\|[-:\s|]+\|$(\n^\|[^\n]+\|$)*', 
-                        convert_table, content, flags=re.MULTILINE)
+        lines = content.split('\n')
+        new_lines = []
+        i = 0
+        while i < len(lines):
+            if is_row(lines[i]) and i + 1 < len(lines) and is_row(lines[i + 1]) \
+                    and TABLE_SEPARATOR.match(lines[i + 1]):
+                end = i + 2
+                while end < len(lines) and is_row(lines[end]):
+                    end += 1
+                new_lines.append(convert_table(lines[i:end]))
+                i = end
+            else:
+                new_lines.append(lines[i])
+                i += 1
+        content = '\n'.join(new_lines)
         
         # Wrap paragraphs (but not elements that are already wrapped)
         paragraphs = content.split('\n\n')
@@ -187,87 +305,111 @@ class WordPressPublisher:
         content = '\n\n'.join(wrapped_paragraphs)
         
         # Clean up any double line breaks within HTML tags
-        content = re.sub(r'(<[^>]+>)\n\n([^<]+</[^>]+>)', r'\1\2', content)
+        content = join_split_tags(content)
         
         return content
     
     def check_wordpress_ready(self):
         """Check if WordPress is installed and ready"""
         try:
-            response = requests.get(WP_URL, timeout=5)
-            if 'wp-admin/install.php' in response.text:
-                print("❌ WordPress needs initial setup!")
-                print(f"Please visit {WP_URL} to complete installation")
-                print("\nAfter setup:")
-                print("1. Login to WordPress admin")
-                print("2. Go to Users -> Your Profile")
-                print("3. Create an Application Password")
-                print("4. Run this script with: python3 wordpress-publisher.py <username> <app-password>")
-                return False
+            self.client.get("/posts", params={"per_page": 1}, fields=("id",))
             return True
-        except requests.exceptions.RequestException:
-            print("❌ Cannot connect to WordPress. Is it running?")
+        except WordPressError as e:
+            # A site that is not installed yet redirects everything to
+            # wp-admin/install.php
+            if e.status not in (301, 302) and "install.php" not in str(e):
+                print(f"❌ Cannot connect to WordPress. Is it running? ({e})")
+                return False
+            print("❌ WordPress needs initial setup!")
+            print(f"Please visit {WP_URL} to complete installation")
+            print("\nAfter setup:")
+            print("1. Login to WordPress admin")
+            print("2. Go to Users -> Your Profile")
+            print("3. Create an Application Password")
+            print("4. Run this script with: python3 wordpress-publisher.py <username> <app-password>")
             return False
     
     def create_category(self):
         """Create or get documentation category"""
-        # Try to create new category
-        data = {
+        category = {
             "name": "Infrastructure Documentation",
             "slug": "infrastructure-docs",
             "description": "Technical documentation for Docker infrastructure"
         }
         
-        response = requests.post(
-            f"{WP_API_URL}/categories",
-            headers={**self.auth_header, "Content-Type": "application/json"},
-            data=json.dumps(data)
-        )
-        
-        if response.status_code == 201:
-            self.category_id = response.json()['id']
-            print(f"✅ Created category with ID: {self.category_id}")
-        else:
-            # Try to get existing category
-            response = requests.get(f"{WP_API_URL}/categories?slug=infrastructure-docs")
-            if response.json():
-                self.category_id = response.json()[0]['id']
-                print(f"✅ Using existing category ID: {self.category_id}")
-            else:
-                self.category_id = 1  # Default uncategorized
-                print("⚠️  Using default category")
+        try:
+            self.category_id = self.taxonomy.resolve("categories", [category])[0]
+            print(f"✅ Using category ID: {self.category_id}")
+        except WordPressError as e:
+            self.category_id = 1  # Default uncategorized
+            print(f"⚠️  Using default category ({e})")
     
-    def create_post(self, title, content, tags=[]):
-        """Create a WordPress post"""
-        html_content = self.markdown_to_html(content)
-        
-        data = {
+    def post_fields(self, title, tags):
+        """The post fields besides the content"""
+        return {
             "title": title,
-            "content": html_content,
             "status": "publish",
             "categories": [self.category_id] if self.category_id else [],
             "tags": tags,
             "format": "standard"
         }
+    
+    def image_fields(self, source):
+        """{"images": {src: content hash}} for the local images of a file, or {}
         
-        response = requests.post(
-            f"{WP_API_URL}/posts",
-            headers={**self.auth_header, "Content-Type": "application/json"},
-            data=json.dumps(data)
-        )
+        Kept in the manifest like a post field, so replacing an image
+        republishes the documents showing it.
+        """
+        hashes = media.image_hashes(source)
+        return {"images": hashes} if hashes else {}
+    
+    def create_post(self, title, content, tags=[], post_id=None, images=None, fields=None):
+        """Create a WordPress post, or update post_id in place
         
-        if response.status_code == 201:
-            post_data = response.json()
-            print(f"✅ Created: {title}")
-            print(f"   URL: {post_data['link']}")
-            return True
-        else:
-            print(f"❌ Failed to create: {title}")
-            print(f"   Error: {response.text}")
+        images ({src: url}) points local <img> sources at their uploads.
+        fields limits an update to the named fields ("content" included);
+        content is not converted when it is left out.  Returns the post's
+        id and link, or False.  A post_id that was deleted on the site is
+        created again, with every field.
+        """
+        data = self.post_fields(title, tags)
+        
+        def body(names=None):
+            sent = {name: value for name, value in data.items() if names is None or name in names}
+            if names is None or "content" in names:
+                sent["content"] = media.rewrite_sources(self.markdown_to_html(content), images)
+            return sent
+        
+        try:
+            if post_id:
+                try:
+                    post_data = self.client.post(f"/posts/{post_id}", body(fields),
+                                                 fields=("id", "link"))
+                except WordPressError as e:
+                    if e.status != 404:
+                        raise
+                    post_id = None
+            if not post_id:
+                post_data = self.client.post("/posts", body(), fields=("id", "link"))
+        except CircuitOpen:
+            raise
+        except WordPressError as e:
+            print(f"❌ Failed to publish: {title}")
+            print(f"   Error: {e}")
             return False
+        
+        print(f"{'🔄 Updated' if post_id else '✅ Created'}: {title}")
+        print(f"   URL: {post_data['link']}")
+        return post_data
     
-    def publish_documentation(self):
-        """Publish all documentation files"""
+    def publish_documentation(self, concurrency=4, rate=2.0):
+        """Publish all documentation files through a rate-limited worker pool
+        
+        Files unchanged since they were last published (as recorded in
+        the manifest) are skipped, and changed ones update their post.
+        Each file is a job in the durable queue, keyed by its path, so an
+        interrupted run resumes with the files it had not done.
+        """
         docs = [
             {
                 "file": "SECURITY-REVIEW.md",
@@ -296,18 +438,95 @@ class WordPressPublisher:
             }
         ]
         
-        published = 0
+        available = []
         for doc in docs:
             if Path(doc["file"]).exists():
-                print(f"\n📄 Publishing {doc['file']}...")
-                content = Path(doc["file"]).read_text()
-                if self.create_post(doc["title"], content, doc["tags"]):
-                    published += 1
-                time.sleep(1)  # Be nice to the API
+                available.append(doc)
             else:
                 print(f"⚠️  File not found: {doc['file']}")
         
-        print(f"\n✅ Published {published} documents successfully!")
+        # Resolve every tag name to an id up front (missing tags are
+        # created together), so posts need no taxonomy lookups
+        names = sorted({tag for doc in available for tag in doc["tags"]})
+        try:
+            tag_ids = dict(zip(names, self.taxonomy.resolve("tags", names)))
+        except WordPressError as e:
+            print(f"⚠️  Publishing without tags ({e})")
+            tag_ids = {}
+        for doc in available:
+            doc["tags"] = [tag_ids[tag] for tag in doc["tags"] if tag in tag_ids]
+        
+        queue = JobQueue(site=WP_URL)
+        queue.recover()
+        tags = {}
+        for doc in available:
+            source = str(Path(doc["file"]).resolve())
+            tags[source] = doc["tags"]
+            changed, content_hash, _ = self.manifest.check(source, CONVERTER_VERSION)
+            entry = self.manifest.lookup(source)
+            fields = dict(self.post_fields(doc["title"], doc["tags"]), **self.image_fields(source))
+            if not changed and not self.manifest.changed_fields(entry, fields):
+                print(f"⏭️  Unchanged since last publish: {doc['file']}")
+                continue
+            payload = {"file": source, "title": doc["title"],
+                       "hash": content_hash or entry["content_hash"]}
+            # The manifest decides what is left to do, even for done jobs
+            if not queue.enqueue("publish", source, payload, force=True):
+                print(f"⏭️  Already queued: {doc['file']}")
+        
+        def publish(job):
+            doc = job["payload"]
+            print(f"\n📄 Publishing {doc['file']}...")
+            stat = os.stat(doc["file"])
+            images = self.image_fields(doc["file"])
+            content = Path(doc["file"]).read_text()
+            content_hash = markdown_hash(content)
+            fields = self.post_fields(doc["title"], tags.get(doc["file"], []))
+            # The content follows from the source, the converter and the
+            # images uploaded for it
+            fingerprints = {"content": fingerprint([content_hash, CONVERTER_VERSION]
+                                                   + list(images.values()))}
+            entry = self.manifest.lookup(doc["file"])
+            # Only the fields that changed since the last publish are sent
+            changed = None
+            if entry and entry["post_id"]:
+                changed = self.manifest.changed_fields(entry, dict(fields, **images), fingerprints)
+                if not changed:
+                    print(f"⏭️  Unchanged since last publish: {doc['file']}")
+                    return {"id": entry["post_id"], "link": None, "action": "unchanged"}
+            # Images upload while the document is converted (already
+            # uploaded ones are looked up in the media index)
+            uploads = self.media.submit(doc["file"])
+            post = self.create_post(doc["title"], content, fields["tags"],
+                                    entry["post_id"] if entry else None,
+                                    images=self.media.urls(uploads), fields=changed)
+            if not post:
+                raise WordPressError(f"could not publish {doc['title']}")
+            self.manifest.record(doc["file"], content_hash, CONVERTER_VERSION, post["id"],
+                                 dict(fields, **images), fingerprints, stat=stat)
+            updated = entry is not None and entry["post_id"] == post["id"]
+            return dict(post, action="updated" if updated else "created")
+        
+        # Be nice to the API: the workers share a token bucket that paces
+        # requests instead of sleeping between posts
+        try:
+            finished, stopped = run_jobs(queue, {"publish": publish}, concurrency, rate)
+        finally:
+            queue.close()
+            self.manifest.close()
+            self.media.close()
+        results = [{"path": os.path.relpath(job["payload"]["file"]),
+                    "title": job["payload"]["title"], "ok": job["state"] == "done",
+                    "link": (job["result"] or {}).get("link"), "error": job["error"],
+                    "action": (job["result"] or {}).get("action", "created"),
+                    "seconds": job["seconds"]} for job in finished]
+        
+        print_summary(results)
+        if stopped:
+            print(f"⏸️  Stopped early ({stopped}): run again to publish the rest")
+        print(f"🗃️  Render cache: {self.render_cache.summary()}")
+        if self.media.uploaded + self.media.reused:
+            print(f"🖼️  Images: {self.media.summary()}")
         print(f"🌐 Visit your WordPress site at: {WP_URL}")
 
 def main():
@@ -0,0 +1,86 @@
+"""
+Shared fixtures: a local fake WordPress site and the publisher pointed at it
+
+The publisher runs as a subprocess, as it would from the command line,
+with HOME under the test's temporary directory so that its manifest, job
+queue, post index and caches start empty.
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from wptools import fakewp  # noqa: E402
+
+PUBLISHER = ROOT / 'wp-publisher.py'
+
+# Settings that would point the publisher at the developer's own files
+ENVIRONMENT = ('WP_MANIFEST', 'WP_QUEUE', 'WP_POST_INDEX', 'WP_MEDIA_INDEX', 'WP_RENDER_CACHE',
+               'WP_TARGETS', 'WP_HIGHLIGHT', 'WP_GZIP_REQUESTS', 'WP_RETRIES')
+
+
+class Publisher:
+    """Runs wp-publisher.py against one site, from directory cwd"""
+
+    def __init__(self, url, home, cwd):
+        self.cwd = cwd
+        self.env = {name: value for name, value in os.environ.items() if name not in ENVIRONMENT}
+        self.env.update(HOME=str(home), WP_URL=url)
+
+    def command(self, *args):
+        return [sys.executable, str(PUBLISHER), *map(str, args)]
+
+    def run(self, *args):
+        """Run to completion; returns the CompletedProcess, output as text"""
+        return subprocess.run(self.command(*args), cwd=self.cwd, env=self.env,
+                              capture_output=True, text=True, timeout=120)
+
+    def start(self, *args):
+        """Start in the background; returns the Popen"""
+        return subprocess.Popen(self.command(*args), cwd=self.cwd, env=self.env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def posts(site):
+    """The site's posts that are not in the trash, in id order"""
+    with site.site.lock:
+        return [dict(post) for post in sorted(site.site.items['posts'].values(),
+                                              key=lambda post: post['id'])
+                if post['status'] != 'trash']
+
+
+def by_title(site):
+    return {post['title']: post for post in posts(site)}
+
+
+@pytest.fixture
+def site():
+    """A fresh fake site served from this process"""
+    server = fakewp.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def docs(tmp_path):
+    """A directory of markdown documents"""
+    directory = tmp_path / 'docs'
+    directory.mkdir()
+    for number in range(1, 4):
+        (directory / f'guide-{number}.md').write_text(
+            f'# Guide {number}\n\nIntro to guide {number}.\n\n## Steps\n\n- one\n- two\n')
+    return directory
+
+
+@pytest.fixture
+def publisher(site, tmp_path):
+    home = tmp_path / 'home'
+    home.mkdir()
+    return Publisher(site.url, home, tmp_path)
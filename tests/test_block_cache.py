@@ -0,0 +1,55 @@
+"""
+Block-by-block re-rendering (BlockCache in wptools.markdown)
+"""
+
+import pytest
+
+from wptools.bench import load_corpus
+from wptools.markdown import BlockCache, iter_blocks, markdown_to_html
+
+CORPUS = load_corpus(synthetic=False)
+
+
+@pytest.mark.parametrize('name', sorted(CORPUS))
+def test_cached_render_matches_whole_document(name):
+    markdown = CORPUS[name]
+    expected = markdown_to_html(markdown)
+    cache = BlockCache()
+    assert markdown_to_html(markdown, block_cache=cache) == expected
+    # The second time every block comes from the cache
+    misses = cache.misses
+    assert markdown_to_html(markdown, block_cache=cache) == expected
+    assert cache.misses == misses
+
+
+def test_edit_reconverts_only_the_changed_block():
+    sections = [f'## Part {number}\n\nText {number}.\n\n- a\n- b\n' for number in range(10)]
+    cache = BlockCache()
+    markdown_to_html('\n'.join(sections), block_cache=cache)
+    sections[5] = sections[5].replace('Text 5.', 'Edited text.')
+    misses = cache.misses
+    edited = '\n'.join(sections)
+    assert markdown_to_html(edited, block_cache=cache) == markdown_to_html(edited)
+    assert cache.misses == misses + 1
+
+
+def test_state_carried_into_a_block_is_part_of_its_key():
+    # The same list item renders differently when it continues a list
+    cache = BlockCache()
+    for markdown in ('- a\n\n- b\n', 'x\n\n- b\n', '- a\n\n- b\n'):
+        assert markdown_to_html(markdown, block_cache=cache) == markdown_to_html(markdown)
+
+
+def test_fenced_code_is_one_block():
+    lines = 'text\n```\none\n\n# two\n```\nafter'.split('\n')
+    assert list(iter_blocks(lines)) == [['text'], ['```', 'one', '', '# two', '```'], ['after']]
+
+
+def test_least_recently_used_blocks_are_evicted():
+    cache = BlockCache(max_entries=2)
+    cache.put('a', 'A', '{}')
+    cache.put('b', 'B', '{}')
+    assert cache.get('a') == ('A', '{}')
+    cache.put('c', 'C', '{}')
+    assert cache.get('b') is None
+    assert sorted(cache.entries) == ['a', 'c']
@@ -0,0 +1,142 @@
+"""
+Bulk publishing: parallel conversion and a rate-limited upload pool (wptools.bulk)
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import by_title
+from wptools import bulk
+from wptools.client import CircuitOpen
+
+
+def test_publish_creates_one_post_per_document(site, docs, publisher):
+    result = publisher.run(docs)
+    assert result.returncode == 0, result.stdout + result.stderr
+    published = by_title(site)
+    assert sorted(published) == ['Guide 1', 'Guide 2', 'Guide 3']
+    content = published['Guide 1']['content']
+    assert '<h2>Steps</h2>' in content
+    assert '<li>one</li>' in content
+    # The heading that became the title is not repeated in the body
+    assert '<h1>' not in content
+    assert '3 of 3 documents' in result.stdout
+
+
+def test_targets_expand_to_markdown_files(docs):
+    (docs / 'notes.txt').write_text('not markdown')
+    (docs / 'more').mkdir()
+    (docs / 'more' / 'extra.md').write_text('# Extra\n')
+    names = [f'guide-{number}.md' for number in range(1, 4)]
+    assert bulk.find_markdown(str(docs)) == sorted(
+        [str(docs / 'more' / 'extra.md')] + [str(docs / name) for name in names])
+    assert bulk.find_markdown(str(docs / 'guide-*.md')) == [str(docs / name) for name in names]
+    assert bulk.find_markdown(str(docs / 'guide-1.md')) == [str(docs / 'guide-1.md')]
+    assert bulk.find_markdown(str(docs / 'missing.md')) == []
+    assert bulk.is_bulk_target(str(docs)) and bulk.is_bulk_target('*.md')
+    assert not bulk.is_bulk_target(str(docs / 'guide-1.md'))
+
+
+def test_token_bucket_spaces_calls_after_the_burst():
+    bucket = bulk.TokenBucket(rate=20, burst=2)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # Two calls from the burst, then four at 20 per second
+    assert 0.18 <= time.monotonic() - started < 1
+
+
+class Recorder:
+    """A publish callable that records how many calls overlap"""
+
+    def __init__(self, fail=(), delay=0.05):
+        self.fail = fail
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, path, title, html):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.calls.append(title)
+        try:
+            time.sleep(self.delay)
+            for name, error in self.fail:
+                if path.endswith(name):
+                    raise error
+            return {'id': len(self.calls), 'link': f'https://example.test/{title}'}
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def write_docs(directory, count):
+    for number in range(count):
+        (directory / f'doc-{number:02}.md').write_text(f'# Doc {number}\n\nBody.\n')
+    return bulk.find_markdown(str(directory))
+
+
+def test_uploads_stay_within_the_concurrency(tmp_path):
+    paths = write_docs(tmp_path, 12)
+    publish = Recorder()
+    results = bulk.publish_files(paths, publish, concurrency=3, rate=0)
+    assert [result['path'] for result in results] == paths
+    assert all(result['ok'] for result in results)
+    assert sorted(publish.calls) == sorted(f'Doc {number}' for number in range(12))
+    assert publish.peak <= 3
+
+
+def test_conversions_run_in_the_given_executor(tmp_path):
+    paths = write_docs(tmp_path, 4)
+    with ThreadPoolExecutor(max_workers=2) as converters:
+        results = bulk.publish_files(paths, Recorder(), rate=0, converters=converters)
+        # The run leaves an executor it was given running
+        assert converters.submit(len, 'abc').result() == 3
+    assert [result['title'] for result in results] == [f'Doc {number}' for number in range(4)]
+    assert all(result['ok'] for result in results)
+
+
+def test_one_failed_upload_does_not_stop_the_others(tmp_path):
+    paths = write_docs(tmp_path, 5)
+    publish = Recorder(fail=[('doc-02.md', RuntimeError('HTTP 500'))])
+    results = bulk.publish_files(paths, publish, concurrency=2, rate=0,
+                                 skip=lambda path: path.endswith('doc-04.md'))
+    assert [(result['ok'], result.get('action'), result.get('error')) for result in results] == [
+        (True, 'created', None), (True, 'created', None), (False, None, 'HTTP 500'),
+        (True, 'created', None), (True, 'unchanged', None)]
+    assert len(publish.calls) == 4
+
+
+def test_an_open_circuit_stops_the_run(tmp_path):
+    paths = write_docs(tmp_path, 8)
+    publish = Recorder(fail=[('.md', CircuitOpen('site is unavailable'))])
+    results = bulk.publish_files(paths, publish, concurrency=1, rate=0)
+    assert not any(result['ok'] for result in results)
+    assert len(publish.calls) == 1
+    assert sum('skipped, site is unavailable' in result['error'] for result in results) == 7
+
+
+def test_summary_counts_actions(capsys):
+    bulk.print_summary([
+        {'path': 'a.md', 'ok': True, 'action': 'created', 'link': 'https://x/a', 'seconds': 0.1},
+        {'path': 'b.md', 'ok': True, 'action': 'unchanged', 'seconds': 0.0},
+        {'path': 'c.md', 'ok': False, 'error': 'HTTP 500', 'seconds': 0.2},
+    ])
+    out = capsys.readouterr().out
+    assert '❌ c.md: HTTP 500' in out
+    assert 'Published 2 of 3 documents (1 created, 1 unchanged)' in out
+
+
+@pytest.mark.parametrize('rate', [0, -1])
+def test_rate_of_zero_disables_the_limit(rate):
+    bucket = bulk.TokenBucket(rate)
+    started = time.monotonic()
+    for _ in range(100):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.1
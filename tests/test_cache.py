@@ -0,0 +1,81 @@
+"""
+On-disk render cache (wptools.cache)
+"""
+
+import hashlib
+import time
+
+from wptools.cache import RenderCache, markdown_hash, render_key
+
+
+def test_keys_cover_content_options_and_converter_version(tmp_path):
+    path = tmp_path / 'doc.md'
+    path.write_text('# Ünïcode\n', encoding='utf-8')
+    content_hash = markdown_hash('# Ünïcode\n')
+    assert content_hash == hashlib.sha256(path.read_bytes()).hexdigest()
+    keys = {render_key(content_hash, '4', skip_first_h1=True),
+            render_key(content_hash, '4', skip_first_h1=False),
+            render_key(content_hash, '5', skip_first_h1=True),
+            render_key(markdown_hash('# Other\n'), '4', skip_first_h1=True)}
+    assert len(keys) == 4
+    assert render_key(content_hash, '4', a=1, b=2) == render_key(content_hash, '4', b=2, a=1)
+
+
+def test_entries_survive_the_process_and_count_hits(tmp_path):
+    path = str(tmp_path / 'render.sqlite')
+    cache = RenderCache(path)
+    calls = []
+
+    def convert():
+        calls.append(1)
+        return '<p>x</p>'
+
+    assert cache.render('key', convert) == '<p>x</p>'
+    assert cache.render('key', convert) == '<p>x</p>'
+    assert len(calls) == 1
+    assert cache.summary() == '1 hits, 1 misses'
+    cache.close()
+    reopened = RenderCache(path)
+    assert reopened.get('key') == '<p>x</p>'
+    assert reopened.get('other') is None
+    assert (reopened.hits, reopened.misses) == (1, 1)
+
+
+def test_least_recently_used_entries_are_evicted_by_size(tmp_path):
+    cache = RenderCache(str(tmp_path / 'render.sqlite'), max_bytes=250)
+    for key in ('a', 'b'):
+        cache.put(key, key * 100)
+        time.sleep(0.01)
+    assert cache.get('a') is not None
+    time.sleep(0.01)
+    cache.put('c', 'c' * 100)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'a' * 100 and cache.get('c') == 'c' * 100
+    # An entry larger than the whole cache is not stored
+    cache.put('d', 'd' * 300)
+    assert cache.get('d') is None
+
+
+def test_tee_caches_small_documents_once_complete(tmp_path):
+    cache = RenderCache(str(tmp_path / 'render.sqlite'))
+    chunks = ['<p>a</p>', '<p>b</p>']
+    streamed = cache.tee('small', iter(chunks))
+    assert next(streamed) == '<p>a</p>'
+    # Nothing is cached until the whole document went through
+    assert cache.get('small') is None
+    assert list(streamed) == ['<p>b</p>']
+    assert cache.get('small') == '<p>a</p><p>b</p>'
+
+
+def test_tee_streams_large_documents_without_keeping_them(tmp_path):
+    cache = RenderCache(str(tmp_path / 'render.sqlite'))
+    chunks = ['x' * 400 for _ in range(5)]
+    assert list(cache.tee('large', iter(chunks), max_bytes=1000)) == chunks
+    assert cache.get('large') is None
+
+
+def test_bulk_rerun_is_served_from_the_cache(site, docs, publisher):
+    assert publisher.run(docs).returncode == 0
+    result = publisher.run(docs, '--force')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'Render cache: 3 hits, 0 misses' in result.stdout
@@ -0,0 +1,137 @@
+"""
+The local WordPress REST stand-in (wptools.fakewp) and the load driver
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import ROOT
+from wptools import fakewp
+from wptools.client import WordPressClient, WordPressError
+from wptools.retry import RetryPolicy
+
+
+@pytest.fixture
+def client(site):
+    return WordPressClient(site.url, 'admin', 'secret', retry=RetryPolicy(attempts=1))
+
+
+def test_posts_are_created_read_updated_and_trashed(client):
+    post = client.post('/posts', {'title': 'Hello', 'content': '<p>x</p>', 'status': 'publish'})
+    assert (post['title']['raw'], post['slug'], post['status']) == ('Hello', 'hello', 'publish')
+    client.post(f"/posts/{post['id']}", {'content': '<p>y</p>'})
+    assert client.get(f"/posts/{post['id']}")['content']['rendered'] == '<p>y</p>'
+    client.request('DELETE', f"/posts/{post['id']}")
+    assert client.get('/posts') == []
+    with pytest.raises(WordPressError) as error:
+        client.get('/posts/999')
+    assert error.value.status == 404
+
+
+def test_lists_are_paged_like_wordpress(site, client):
+    site.site.seed_posts(25)
+    status, headers, posts = client.request('GET', '/posts', params={'per_page': 10, 'page': 3})
+    assert (headers['X-WP-Total'], headers['X-WP-TotalPages'], len(posts)) == ('25', '3', 5)
+    with pytest.raises(WordPressError) as error:
+        client.get('/posts', params={'per_page': 101})
+    assert error.value.status == 400
+    with pytest.raises(WordPressError) as error:
+        client.get('/posts', params={'per_page': 10, 'page': 4})
+    assert error.value.data['code'] == 'rest_post_invalid_page_number'
+
+
+def test_modified_after_returns_only_later_edits(site, client):
+    site.site.seed_posts(3)
+    with site.site.lock:
+        for post in site.site.items['posts'].values():
+            post['modified'] = '2020-01-01T00:00:00'
+        second = sorted(site.site.items['posts'])[1]
+    client.post(f'/posts/{second}', {'title': 'Edited'})
+    edited = client.get('/posts', params={'modified_after': '2020-01-01T00:00:00'})
+    assert [post['id'] for post in edited] == [second]
+
+
+def test_batch_runs_each_request_and_reports_each_status(site, client):
+    responses = client.batch([('POST', '/posts', {'title': 'One'}),
+                              ('POST', '/posts', {'title': 'Two', 'status': 'bogus'}),
+                              ('POST', '/tags', {'name': 'Docker'})])
+    assert [status for status, _ in responses] == [201, 400, 201]
+    assert sorted(post['title'] for post in site.site.items['posts'].values()) == ['One']
+
+
+def test_writes_need_the_credentials():
+    server = fakewp.start(username='admin', password='secret')
+    try:
+        anonymous = WordPressClient(server.url, retry=RetryPolicy(attempts=1))
+        assert anonymous.get('/posts') == []
+        with pytest.raises(WordPressError) as error:
+            anonymous.post('/posts', {'title': 'Nope'})
+        assert error.value.status == 401
+        assert WordPressClient(server.url, 'admin', 'secret').post('/posts', {'title': 'Yes'})
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_uploads_get_unique_file_names(client):
+    first = client.upload('shot.png', b'\x89PNG one', 'image/png')
+    second = client.upload('shot.png', b'\x89PNG two', 'image/png')
+    assert first['source_url'].endswith('/shot.png')
+    assert second['source_url'].endswith('/shot-1.png')
+
+
+def test_faults_throttle_and_fail_requests(site, client):
+    site.faults = fakewp.Faults(throttle_rate=1.0)
+    with pytest.raises(WordPressError) as error:
+        client.get('/posts')
+    assert error.value.status == 429
+    site.faults = fakewp.Faults(error_rate=1.0)
+    with pytest.raises(WordPressError) as error:
+        client.get('/posts')
+    assert error.value.status == 500
+    site.faults = fakewp.Faults(unavailable_rate=1.0)
+    with pytest.raises(WordPressError) as error:
+        client.get('/posts')
+    assert error.value.status == 503
+    assert site.stats.snapshot()['statuses'] == {'posts 429': 1, 'posts 500': 1, 'posts 503': 1}
+
+
+def test_requests_beyond_max_concurrency_are_throttled(site, client):
+    site.faults = fakewp.Faults(latency=0.3, max_concurrency=1)
+    statuses = []
+
+    def get():
+        try:
+            client.get('/posts')
+            statuses.append(200)
+        except WordPressError as e:
+            statuses.append(e.status)
+
+    threads = [threading.Thread(target=get) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+    assert sorted(statuses) == [200, 429]
+    assert site.stats.snapshot()['peak_in_flight'] == 2
+
+
+def test_load_driver_reports_every_level(tmp_path):
+    output = tmp_path / 'levels.json'
+    env = dict(os.environ, HOME=str(tmp_path))
+    result = subprocess.run(
+        [sys.executable, '-m', 'wptools.loadtest', '--documents', '6', '--size', '300',
+         '--concurrency', '1,3', '--latency', '0', '--output', str(output)],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stdout + result.stderr
+    levels = json.loads(output.read_text())['levels']
+    assert [(level['concurrency'], level['documents'], level['failed']) for level in levels] == [
+        (1, 6, 0), (3, 6, 0)]
+    assert all(level['server']['statuses']['posts 201'] == 6 for level in levels)
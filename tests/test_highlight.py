@@ -0,0 +1,62 @@
+"""
+Build-time syntax highlighting of fenced code (wptools.highlight)
+"""
+
+import html
+import re
+
+import pytest
+
+from wptools import highlight
+from wptools.bench import ROOT, load_corpus
+from wptools.markdown import (CONVERTER_VERSION, BlockCache, converter_version,
+                              iter_markdown_file, markdown_to_html)
+
+pytest.importorskip('pygments')
+
+CORPUS = load_corpus(synthetic=False)
+
+
+@pytest.mark.parametrize('name', sorted(CORPUS))
+def test_highlighted_render_matches_across_converters(name):
+    markdown = CORPUS[name]
+    expected = markdown_to_html(markdown, highlight=True)
+    assert ''.join(iter_markdown_file(ROOT / name, highlight=True)) == expected
+    cache = BlockCache()
+    assert markdown_to_html(markdown, block_cache=cache, highlight=True) == expected
+    assert markdown_to_html(markdown, block_cache=cache, highlight=True) == expected
+
+
+def test_known_language_gets_token_spans_and_keeps_the_code():
+    code = 'def f(x):\n    return x < 1 and "&"\n'
+    rendered = markdown_to_html(f'```python\n{code}```', highlight=True)
+    assert '<span class="k">def</span>' in rendered
+    body = re.search(r'<code class="language-python">(.*)</code>', rendered, re.S).group(1)
+    assert html.unescape(re.sub(r'</?span[^>]*>', '', body)) == code.rstrip('\n')
+
+
+def test_unknown_language_and_plain_render_are_unchanged():
+    markdown = '```nosuchlanguage\na < b\n```\n\n```python\nx = 1\n```'
+    plain = markdown_to_html(markdown)
+    assert '<span' not in plain
+    rendered = markdown_to_html(markdown, highlight=True)
+    assert '<code class="language-nosuchlanguage">a &lt; b</code>' in rendered
+
+
+def test_snippets_are_memoized():
+    highlighter = highlight.Highlighter()
+    first = highlighter.highlight('python', 'x = 1')
+    assert highlighter.highlight('python', 'x = 1') == first
+    assert (highlighter.hits, highlighter.misses) == (1, 1)
+    assert highlighter.highlight('nosuchlanguage', 'x = 1') is None
+
+
+def test_highlighting_is_part_of_the_converter_version():
+    assert converter_version() == CONVERTER_VERSION
+    assert converter_version(highlight=True) == f'{CONVERTER_VERSION}+{highlight.version()}'
+
+
+def test_stylesheet_is_scoped_to_code_blocks():
+    rules = [line for line in highlight.stylesheet().splitlines() if line.strip()]
+    assert rules
+    assert all(line.startswith(highlight.CSS_SCOPE) for line in rules)
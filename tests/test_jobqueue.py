@@ -0,0 +1,129 @@
+"""
+Durable publish jobs (wptools.jobqueue)
+"""
+
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import posts
+from wptools import fakewp
+from wptools.client import CircuitOpen
+from wptools.jobqueue import JobQueue, run_jobs, worker_name
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite'), site='https://example.test')
+    yield queue
+    queue.close()
+
+
+def states(queue):
+    """{key: state} of every job in the queue"""
+    with queue.lock:
+        return dict(queue.db.execute('SELECT key, state FROM jobs ORDER BY id').fetchall())
+
+
+def test_queue_resumes_after_a_crash_without_duplicates(site, docs, publisher):
+    for number in range(4, 9):
+        (docs / f'guide-{number}.md').write_text(f'# Guide {number}\n\nBody {number}.\n')
+    site.faults = fakewp.Faults(latency=0.1)
+    run = publisher.start('--queue', docs, '--concurrency', 1, '--rate', 0)
+    deadline = time.monotonic() + 60
+    while len(posts(site)) < 3 and run.poll() is None and time.monotonic() < deadline:
+        time.sleep(0.02)
+    run.kill()
+    run.wait()
+    assert 0 < len(posts(site)) < 8, 'the run was not killed part way'
+
+    site.faults = fakewp.Faults()
+    result = publisher.run('--queue')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'Jobs: 8 done' in result.stdout
+    titles = [post['title'] for post in posts(site)]
+    assert sorted(titles) == sorted(f'Guide {number}' for number in range(1, 9))
+
+    # Everything is done: a new run finds nothing to queue
+    result = publisher.run('--queue', docs)
+    assert 'Queued 0 of 8 files' in result.stdout
+    assert len(posts(site)) == 8
+
+
+def test_one_job_per_key_and_payload_changes_requeue_done_jobs(queue):
+    assert queue.enqueue('publish', 'a.md', {'hash': '1'})
+    assert not queue.enqueue('publish', 'a.md', {'hash': '2'})
+    job = queue.claim()
+    # The queued job took the newer payload
+    assert (job['key'], job['payload'], job['attempts']) == ('a.md', {'hash': '2'}, 1)
+    assert not queue.enqueue('publish', 'a.md', {'hash': '3'})
+    queue.complete(job, {'id': 7})
+    assert not queue.enqueue('publish', 'a.md', {'hash': '2'})
+    assert queue.enqueue('publish', 'a.md', {'hash': '2'}, force=True)
+    queue.complete(queue.claim(), {'id': 7})
+    assert queue.enqueue('publish', 'a.md', {'hash': '3'})
+    assert queue.counts() == {'queued': 1}
+
+
+def test_claims_skip_leased_jobs_until_the_lease_expires(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite')
+    first, second = JobQueue(path, lease=0.2), JobQueue(path, lease=0.2)
+    second.worker = 'elsewhere:1'
+    for key in ('a.md', 'b.md'):
+        first.enqueue('publish', key, {})
+    job = first.claim()
+    assert second.claim()['key'] == 'b.md'
+    assert second.claim() is None
+    time.sleep(0.3)
+    taken = second.claim()
+    assert taken['key'] == job['key'] and taken['attempts'] == 2
+    # The first worker lost its lease: finishing the job is not up to it
+    assert first.complete(job)['state'] == 'running'
+    assert second.complete(taken)['state'] == 'done'
+    first.close()
+    second.close()
+
+
+def test_running_jobs_of_dead_processes_are_recovered(queue):
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    queue.enqueue('publish', 'a.md', {})
+    queue.enqueue('publish', 'b.md', {})
+    queue.claim()
+    queue.worker = worker_name().rpartition(':')[0] + f':{dead.pid}'
+    queue.claim()
+    queue.worker = worker_name()
+    assert queue.recover() == 1
+    assert states(queue) == {'a.md': 'running', 'b.md': 'queued'}
+
+
+def test_failed_jobs_are_retried_a_few_times(queue):
+    queue.enqueue('publish', 'a.md', {})
+    for attempt in range(3):
+        queue.fail(queue.claim(), 'HTTP 500')
+        assert queue.retry_failed(max_attempts=3) == (1 if attempt < 2 else 0)
+    assert queue.counts() == {'failed': 1}
+    assert queue.summary() == '1 failed'
+
+
+def test_run_jobs_isolates_failures_and_stops_when_the_site_is_down(queue):
+    for key in ('a.md', 'b.md', 'c.md', 'd.md'):
+        queue.enqueue('publish', key, {})
+
+    def publish(job):
+        if job['key'] == 'b.md':
+            raise RuntimeError('HTTP 500')
+        if job['key'] == 'c.md':
+            raise CircuitOpen('site is unavailable')
+        return {'id': job['id']}
+
+    finished, stopped = run_jobs(queue, {'publish': publish}, workers=1)
+    assert stopped == 'site is unavailable'
+    assert [(job['key'], job['state']) for job in finished] == [('a.md', 'done'),
+                                                                ('b.md', 'failed')]
+    assert states(queue) == {'a.md': 'done', 'b.md': 'failed', 'c.md': 'queued',
+                             'd.md': 'queued'}
+    # The job the run stopped at was put back untried
+    assert queue.claim()['attempts'] == 1
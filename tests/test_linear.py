@@ -0,0 +1,54 @@
+"""
+Linear worst case on adversarial markdown, and the per-document budget
+"""
+
+import pytest
+
+from wptools.bench import ADVERSARIAL_PATTERNS, adversarial_documents, check_linearity
+from wptools.markdown import Budget, BudgetExceeded, iter_html, markdown_to_html
+
+# Quadratic work grows 16 times over these sizes; linear work 4 times,
+# and the check allows up to 10
+SIZES = (20000, 80000)
+SLACK = 2.5
+
+
+def streamed(text):
+    return ''.join(iter_html(text.split('\n')))
+
+
+@pytest.mark.parametrize('convert', [markdown_to_html, streamed], ids=['whole', 'streamed'])
+def test_adversarial_inputs_convert_in_linear_time(convert):
+    results = check_linearity(convert, sizes=SIZES, slack=SLACK)
+    assert sorted(results) == sorted(name for name, _ in ADVERSARIAL_PATTERNS)
+    slow = {name: f'{small:.4f}s -> {large:.4f}s'
+            for name, (small, large, ok) in results.items() if not ok}
+    assert not slow
+
+
+@pytest.mark.parametrize('name', sorted(adversarial_documents(100)))
+def test_adversarial_inputs_stream_like_whole_documents(name):
+    text = adversarial_documents(2000)[name]
+    assert markdown_to_html(text) == streamed(text)
+
+
+def test_oversized_document_is_refused_before_converting():
+    with pytest.raises(BudgetExceeded, match='larger than 100 characters'):
+        markdown_to_html('x' * 101, budget=Budget(max_size=100))
+    assert markdown_to_html('x' * 90, budget=Budget(max_size=100)) == '<p>' + 'x' * 90 + '</p>'
+
+
+def test_streamed_conversion_stops_at_the_first_line_over_budget():
+    lines = (f'line {number}' for number in range(100000))
+    pieces = iter_html(lines, budget=Budget(max_size=1000))
+    with pytest.raises(BudgetExceeded):
+        for _ in pieces:
+            pass
+
+
+def test_time_budget_stops_a_slow_conversion():
+    text = '\n\n'.join(f'Paragraph *{number}* with `code` and [a link](#{number}).'
+                       for number in range(20000))
+    with pytest.raises(BudgetExceeded, match='took longer than'):
+        markdown_to_html(text, budget=Budget(max_seconds=1e-6))
+    assert markdown_to_html(text, budget=Budget(max_seconds=0))
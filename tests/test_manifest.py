@@ -0,0 +1,74 @@
+"""
+Incremental publishing through the publish manifest (wptools.manifest)
+"""
+
+import os
+
+from conftest import by_title, posts
+from wptools.manifest import Manifest, file_hash, fingerprint
+
+
+def test_rerun_skips_unchanged_documents(site, docs, publisher):
+    assert publisher.run(docs).returncode == 0
+    before = posts(site)
+    result = publisher.run(docs)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert '3 unchanged' in result.stdout
+    assert posts(site) == before
+
+
+def test_edited_document_updates_its_post_in_place(site, docs, publisher):
+    assert publisher.run(docs).returncode == 0
+    ids = {title: post['id'] for title, post in by_title(site).items()}
+    (docs / 'guide-2.md').write_text('# Guide 2\n\nRewritten intro.\n')
+    result = publisher.run(docs)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert '2 unchanged, 1 updated' in result.stdout
+    published = by_title(site)
+    assert {title: post['id'] for title, post in published.items()} == ids
+    assert 'Rewritten intro.' in published['Guide 2']['content']
+    assert len(posts(site)) == 3
+
+
+def test_update_sends_only_the_changed_fields(site, docs, publisher):
+    assert publisher.run(docs).returncode == 0
+    post_id = by_title(site)['Guide 2']['id']
+    with site.site.lock:
+        site.site.items['posts'][post_id]['title'] = 'Renamed in wp-admin'
+    (docs / 'guide-2.md').write_text('# Guide 2\n\nRewritten intro.\n')
+    result = publisher.run(docs)
+    assert result.returncode == 0, result.stdout + result.stderr
+    # Only the content changed locally, so the remote title is left alone
+    post = by_title(site)['Renamed in wp-admin']
+    assert post['id'] == post_id
+    assert 'Rewritten intro.' in post['content']
+
+
+def test_check_hashes_only_files_whose_stat_changed(tmp_path):
+    source = tmp_path / 'doc.md'
+    source.write_text('# Doc\n')
+    manifest = Manifest(str(tmp_path / 'manifest.sqlite'), site='https://example.test')
+    changed, content_hash, stat = manifest.check(str(source), '4')
+    assert changed and content_hash == file_hash(source)
+    manifest.record(str(source), content_hash, '4', 7, {'title': 'Doc'}, stat=stat)
+    assert manifest.check(str(source), '4') == (False, None, os.stat(source))
+    # A new timestamp with the same bytes refreshes the entry without a change
+    os.utime(source, (1, 1))
+    assert manifest.check(str(source), '4')[:2] == (False, content_hash)
+    assert manifest.check(str(source), '4')[1] is None
+    # A new converter version republishes
+    assert manifest.check(str(source), '5')[0]
+    source.write_text('# Doc\n\nMore.\n')
+    assert manifest.check(str(source), '4')[0]
+    assert manifest.source_for(7) == str(source)
+    assert Manifest(str(tmp_path / 'manifest.sqlite'), site='other').lookup(str(source)) is None
+
+
+def test_changed_fields_compares_fingerprints():
+    entry = {'fields': {'title': fingerprint('Doc'), 'tags': fingerprint([1, 2]),
+                        'content': 'abc'}}
+    post_data = {'title': 'Doc', 'tags': [1, 3], 'status': 'publish'}
+    assert Manifest.changed_fields(entry, post_data, {'content': 'abc'}) == ['status', 'tags']
+    assert Manifest.changed_fields(entry, post_data, {'content': 'def'}) == [
+        'content', 'status', 'tags']
+    assert Manifest.changed_fields(None, {'title': 'Doc'}) == ['title']
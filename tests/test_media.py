@@ -0,0 +1,125 @@
+"""
+Local images uploaded to the media library once per content (wptools.media)
+"""
+
+import hashlib
+
+import pytest
+
+from conftest import by_title
+from wptools import fakewp
+from wptools.client import WordPressClient, WordPressError
+from wptools.media import MediaIndex, MediaUploader, find_images, image_hashes, rewrite_sources
+from wptools.retry import RetryPolicy
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+
+@pytest.fixture
+def client(site):
+    return WordPressClient(site.url, 'admin', 'secret', retry=RetryPolicy(attempts=1))
+
+
+def media(site):
+    with site.site.lock:
+        return list(site.site.items['media'].values())
+
+
+def write_doc(directory, name, *sources):
+    path = directory / name
+    path.write_text(f'# {name}\n\n' + ''.join(f'![shot]({src})\n\n' for src in sources))
+    return str(path)
+
+
+def test_find_images_lists_existing_local_files(tmp_path):
+    (tmp_path / 'img').mkdir()
+    (tmp_path / 'img' / 'a b.png').write_bytes(PNG)
+    (tmp_path / 'c.png').write_bytes(PNG)
+    doc = tmp_path / 'doc.md'
+    doc.write_text('![a](img/a%20b.png) ![remote](https://example.com/x.png)\n'
+                   '![missing](nope.png) ![data](data:image/png;base64,AAAA)\n'
+                   '```\n![in code](c.png)\n```\n'
+                   '![c](./c.png)\n')
+    assert find_images(str(doc)) == {'img/a%20b.png': str(tmp_path / 'img' / 'a b.png'),
+                                     './c.png': str(tmp_path / 'c.png')}
+
+
+def test_image_hashes_follow_the_file_content(tmp_path):
+    image = tmp_path / 'shot.png'
+    image.write_bytes(PNG)
+    doc = write_doc(tmp_path, 'doc.md', 'shot.png')
+    before = image_hashes(doc)
+    image.write_bytes(PNG + b'changed')
+    assert image_hashes(doc) != before
+    assert list(image_hashes(doc)) == ['shot.png']
+
+
+def test_rewrite_sources_replaces_only_known_images():
+    html = '<p><img src="a.png" alt="a"> <img src="b.png" alt="b"></p>'
+    assert rewrite_sources(html, {'a.png': 'https://x/a.png'}) == \
+        '<p><img src="https://x/a.png" alt="a"> <img src="b.png" alt="b"></p>'
+    assert rewrite_sources(html, {}) is html
+
+
+def test_same_content_is_uploaded_once(site, client, tmp_path):
+    (tmp_path / 'shot.png').write_bytes(PNG)
+    (tmp_path / 'copy.png').write_bytes(PNG)
+    docs = [write_doc(tmp_path, f'doc-{number}.md', 'shot.png', 'copy.png')
+            for number in range(5)]
+    uploader = MediaUploader(client, concurrency=4)
+    try:
+        urls = [uploader.urls(uploader.submit(doc)) for doc in docs]
+    finally:
+        uploader.close()
+    assert len(media(site)) == 1
+    url = media(site)[0]['source_url']
+    assert urls == [{'shot.png': url, 'copy.png': url}] * 5
+    assert uploader.summary() == '1 uploaded, 0 already on the site'
+
+
+def test_media_index_reuses_uploads_from_earlier_runs(site, client, tmp_path):
+    (tmp_path / 'shot.png').write_bytes(PNG)
+    doc = write_doc(tmp_path, 'doc.md', 'shot.png')
+    index = MediaIndex(str(tmp_path / 'media.sqlite'), site=site.url)
+    for _ in range(2):
+        uploader = MediaUploader(client, index)
+        urls = uploader.urls(uploader.submit(doc))
+        uploader.close()
+    assert len(media(site)) == 1
+    assert urls == {'shot.png': media(site)[0]['source_url']}
+    assert (uploader.uploaded, uploader.reused) == (0, 1)
+    # Keyed by content (and resize settings, none here); another site has its own
+    key = f'{hashlib.sha256(PNG).hexdigest()}:'
+    assert index.get(key)[1] == urls['shot.png']
+    assert MediaIndex(str(tmp_path / 'media.sqlite'), site='other').get(key) is None
+
+
+def test_failed_upload_is_tried_again(site, client, tmp_path):
+    (tmp_path / 'shot.png').write_bytes(PNG)
+    doc = write_doc(tmp_path, 'doc.md', 'shot.png')
+    uploader = MediaUploader(client)
+    try:
+        site.faults = fakewp.Faults(error_rate=1.0)
+        with pytest.raises(WordPressError):
+            uploader.urls(uploader.submit(doc))
+        site.faults = fakewp.Faults()
+        assert uploader.urls(uploader.submit(doc)) == {'shot.png': media(site)[0]['source_url']}
+    finally:
+        uploader.close()
+
+
+def test_published_post_points_at_the_uploaded_image(site, docs, publisher):
+    (docs / 'shot.png').write_bytes(PNG)
+    (docs / 'guide-1.md').write_text('# Guide 1\n\n![shot](shot.png)\n')
+    result = publisher.run(docs)
+    assert result.returncode == 0, result.stdout + result.stderr
+    url = media(site)[0]['source_url']
+    assert f'<img src="{url}"' in by_title(site)['Guide 1']['content']
+
+    # Replacing the image republishes the post with the new upload
+    (docs / 'shot.png').write_bytes(PNG + b'new')
+    result = publisher.run(docs)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert '1 updated' in result.stdout
+    new_url = media(site)[1]['source_url']
+    assert f'<img src="{new_url}"' in by_title(site)['Guide 1']['content']
@@ -0,0 +1,79 @@
+"""
+Pagination at <h2> boundaries (wptools.paginate)
+"""
+
+import re
+
+import pytest
+
+from wptools import paginate
+from wptools.markdown import markdown_to_html
+
+
+def balanced(page):
+    """True when every block element opened on page is closed on it"""
+    depth = {}
+    for closing, tag in paginate.TAG_RE.findall(page):
+        depth[tag] = depth.get(tag, 0) + (-1 if closing else 1)
+        if depth[tag] < 0:
+            return False
+    return not any(depth.values())
+
+
+def test_document_within_budget_is_one_page():
+    html = '<h2>A</h2>\n<p>a</p>\n<h2>B</h2>\n<p>b</p>'
+    assert paginate.paginate(html) == [html]
+    assert paginate.paginate(html, max_bytes=10000) == [html]
+
+
+def test_pages_start_at_h2_and_keep_the_lead_in():
+    html = '<p>intro</p>\n<h2>A</h2>\n<p>a</p>\n<h2>B</h2>\n<p>b</p>\n<h2>C</h2>\n<p>c</p>'
+    pages = paginate.paginate(html, max_blocks=3)
+    assert pages == ['<p>intro</p>\n<h2>A</h2>\n<p>a</p>\n', '<h2>B</h2>\n<p>b</p>\n',
+                     '<h2>C</h2>\n<p>c</p>']
+    assert ''.join(pages) == html
+
+
+def test_byte_budget_packs_sections_greedily():
+    sections = [f'<h2>S{number}</h2>\n<p>{"x" * 100}</p>\n' for number in range(6)]
+    pages = paginate.paginate(''.join(sections), max_bytes=300)
+    assert [len(page.encode('utf-8')) <= 300 for page in pages] == [True] * len(pages)
+    assert len(pages) == 3
+    assert ''.join(pages) == ''.join(sections)
+
+
+@pytest.mark.parametrize('opening, closing', [
+    ('<pre><code>', '</code></pre>'),
+    ('<table><tbody><tr><td>', '</td></tr></tbody></table>'),
+    ('<ul><li>', '</li></ul>'),
+    ('<ol><li>', '</li></ol>'),
+    ('<blockquote>', '</blockquote>'),
+    ('<p>text\n', '</p>'),
+], ids=['pre', 'table', 'ul', 'ol', 'blockquote', 'p'])
+def test_no_page_starts_inside_a_container(opening, closing):
+    html = (f'<h2>A</h2>\n<p>a</p>\n{opening}<h2>Inside</h2>{closing}\n'
+            f'<h2>B</h2>\n<p>b</p>')
+    pages = paginate.paginate(html, max_blocks=1)
+    assert len(pages) == 2
+    assert all(balanced(page) for page in pages)
+    assert pages[1].startswith('<h2>B</h2>')
+
+
+def test_heading_after_a_text_line_stays_in_its_paragraph():
+    # The converter puts a heading right after a line of text inside the <p>
+    html = markdown_to_html('## One\n\nbody one\n\nSome text\n## Two\n\nbody two\n\n'
+                            '## Three\n\nx\n')
+    assert re.search(r'<p>Some text\n<h2>Two</h2></p>', html)
+    pages = paginate.paginate(html, max_blocks=1)
+    assert all(balanced(page) for page in pages)
+    assert paginate.join_pages(pages).count(paginate.NEXTPAGE) == len(pages) - 1
+    assert [page.split('\n', 1)[0] for page in pages] == ['<h2>One</h2>', '<h2>Three</h2>']
+
+
+def test_converted_corpus_pages_are_balanced():
+    body = '\n\n'.join(f'## Part {number}\n\nText {number}.\n\n- a\n- b\n\n> quote\n\n'
+                       f'```\n## not a heading\n```\n\n| a | b |\n|---|---|\n| 1 | 2 |'
+                       for number in range(20))
+    pages = paginate.paginate(markdown_to_html(body), max_bytes=600)
+    assert len(pages) > 1
+    assert all(balanced(page) for page in pages)
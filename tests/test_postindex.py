@@ -0,0 +1,97 @@
+"""
+Local index of a site's posts, synced incrementally (wptools.postindex)
+"""
+
+import pytest
+
+from wptools.client import WordPressClient
+from wptools.postindex import PostIndex, title_key
+
+
+@pytest.fixture
+def client(site):
+    # 150 posts saved a second apart, long ago
+    site.site.seed_posts(150)
+    with site.site.lock:
+        for number, post in enumerate(sorted(site.site.items['posts'].values(),
+                                             key=lambda post: post['id'])):
+            post['modified'] = f'2020-01-01T00:{number // 60:02}:{number % 60:02}'
+    return WordPressClient(site.url, 'admin', 'secret')
+
+
+@pytest.fixture
+def index(client, tmp_path):
+    index = PostIndex(client, str(tmp_path / 'posts.sqlite'), site='test')
+    yield index
+    index.close()
+
+
+def post_ids(site):
+    with site.site.lock:
+        return sorted(site.site.items['posts'])
+
+
+def page_requests(site):
+    return site.stats.snapshot()['statuses'].get('posts 200', 0)
+
+
+def test_first_sync_indexes_every_post(site, index):
+    assert len(index.sync()) == 150
+    assert len(index) == 150
+    assert page_requests(site) == 2
+    first = post_ids(site)[0]
+    assert index.find(title='  seeded   POST 1 ') == [index.get(first)]
+    assert index.find(slug='seeded-post-1')[0]['id'] == first
+    assert index.get(first)['modified'] == '2020-01-01T00:00:00'
+
+
+def test_incremental_sync_fetches_only_what_changed(site, client, index):
+    index.sync()
+    edited = post_ids(site)[10]
+    client.post(f'/posts/{edited}', {'content': '<p>Edited.</p>'})
+    created = client.post('/posts', {'title': 'New post', 'status': 'publish'})['id']
+    site.stats.reset()
+    assert sorted(post['id'] for post in index.sync()) == [edited, created]
+    # One short page instead of a sweep of the whole site
+    assert page_requests(site) == 1
+    assert index.find(title='New post')[0]['id'] == created
+    assert index.sync() == []
+
+
+def test_sync_is_skipped_while_fresh_and_full_sweeps_drop_deleted_posts(site, client, index):
+    index.sync()
+    site.stats.reset()
+    assert index.sync(max_age=3600) == []
+    assert page_requests(site) == 0
+    gone = post_ids(site)[0]
+    client.request('DELETE', f'/posts/{gone}', params={'force': 'true'})
+    index.sync()
+    assert index.get(gone) is not None
+    index.sync(full=True)
+    assert index.get(gone) is None
+    assert len(index) == 149
+
+
+def test_remembered_post_is_found_before_the_next_sync(index):
+    index.sync()
+    index.remember(9999, title='Just Created', slug='just-created', link='https://x/?p=9999')
+    assert index.find(title='just created')[0]['id'] == 9999
+    assert title_key(' Just\tCreated ') == 'just created'
+
+
+def test_pending_lists_unchecked_changed_and_flagged_posts(site, client, index):
+    index.sync()
+    ids = post_ids(site)
+    assert index.pending('escaped-html') == ids
+    flagged = ids[3]
+    index.record_checks('escaped-html', {post_id: post_id == flagged for post_id in ids})
+    assert index.pending('escaped-html') == [flagged]
+    # Another check has its own verdicts
+    assert index.pending('other') == ids
+
+    edited = ids[7]
+    client.post(f'/posts/{edited}', {'content': '<p>Changed.</p>'})
+    index.sync()
+    assert index.pending('escaped-html') == [flagged, edited]
+    index.record_checks('escaped-html', {flagged: False, edited: False})
+    assert index.pending('escaped-html') == []
@@ -0,0 +1,166 @@
+"""
+Retries, adaptive concurrency and the circuit breaker (wptools.retry)
+against the fake site
+"""
+
+import threading
+import time
+
+import pytest
+
+from wptools import fakewp
+from wptools.client import CircuitOpen, WordPressClient, WordPressError
+from wptools.retry import AdaptiveLimiter, CircuitBreaker, RetryPolicy
+
+
+class Scripted(fakewp.Faults):
+    """Faults that answer the first requests with the given faults, in order"""
+
+    def __init__(self, *faults, **settings):
+        super().__init__(**settings)
+        self.script = list(faults)
+
+    def roll(self):
+        with self.lock:
+            return self.script.pop(0) if self.script else None
+
+
+def client_for(site, **settings):
+    settings.setdefault('retry', RetryPolicy(attempts=3, base=0.01, seed=1))
+    return WordPressClient(site.url, 'admin', 'secret', **settings)
+
+
+def statuses(site, route):
+    """Status codes answered on route, in the fake site's counts"""
+    return {key.split()[1]: count for key, count in site.stats.snapshot()['statuses'].items()
+            if key.split()[0] == route}
+
+
+@pytest.mark.parametrize('fault, status', [('throttle', '429'), ('unavailable', '503')])
+def test_refused_post_is_retried_after_retry_after(site, fault, status):
+    site.faults = Scripted(fault, retry_after=1)
+    started = time.monotonic()
+    post = client_for(site).post('/posts', {'title': 'Once', 'status': 'publish'})
+    assert time.monotonic() - started >= 1
+    assert statuses(site, 'posts') == {status: 1, '201': 1}
+    with site.site.lock:
+        assert [item['title'] for item in site.site.items['posts'].values()] == ['Once']
+    assert post['title']['rendered'] == 'Once'
+
+
+def test_retry_after_beyond_max_wait_gives_up(site):
+    site.faults = Scripted('throttle', retry_after=60)
+    client = client_for(site, retry=RetryPolicy(attempts=3, base=0.01, max_wait=5))
+    with pytest.raises(WordPressError) as error:
+        client.get('/posts')
+    assert error.value.status == 429
+    assert statuses(site, 'posts') == {'429': 1}
+
+
+def test_timed_out_post_is_not_sent_again(site):
+    site.faults = fakewp.Faults(latency=0.5)
+    client = client_for(site, timeout=0.2)
+    with pytest.raises(WordPressError):
+        client.post('/posts', {'title': 'Maybe', 'status': 'publish'})
+    time.sleep(0.6)
+    with site.site.lock:
+        assert len(site.site.items['posts']) == 1
+    assert sum(statuses(site, 'posts').values()) == 1
+
+
+def test_timed_out_get_is_retried(site):
+    site.faults = fakewp.Faults(latency=0.5)
+    client = client_for(site, timeout=0.2, retry=RetryPolicy(attempts=2, base=0.01))
+    with pytest.raises(WordPressError):
+        client.get('/posts')
+    time.sleep(0.6)
+    assert sum(statuses(site, 'posts').values()) == 2
+
+
+def test_limit_is_cut_when_throttled_and_grows_back(site):
+    limiter = AdaptiveLimiter(initial=8, tolerance=1000)
+    client = client_for(site, retry=RetryPolicy(attempts=1), limiter=limiter)
+    site.faults = Scripted('throttle')
+    with pytest.raises(WordPressError):
+        client.get('/posts')
+    assert limiter.limit == 4
+    for _ in range(20):
+        client.get('/posts')
+    assert limiter.limit > 6
+    assert limiter.in_flight == 0
+
+
+def test_one_burst_of_throttling_cuts_the_limit_once(site):
+    limiter = AdaptiveLimiter(initial=8)
+    site.faults = fakewp.Faults(latency=0.2, throttle_rate=1.0)
+    client = client_for(site, retry=RetryPolicy(attempts=1), limiter=limiter)
+
+    def get():
+        with pytest.raises(WordPressError):
+            client.get('/posts')
+
+    threads = [threading.Thread(target=get) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert limiter.limit == 4
+
+
+def test_breaker_opens_probes_once_and_closes(site):
+    breaker = CircuitBreaker(threshold=2, cooldown=0.3)
+    client = client_for(site, retry=RetryPolicy(attempts=1), breaker=breaker)
+    site.faults = fakewp.Faults(error_rate=1.0)
+    for _ in range(2):
+        with pytest.raises(WordPressError):
+            client.get('/posts')
+    assert breaker.is_open
+    with pytest.raises(CircuitOpen):
+        client.get('/posts')
+    assert statuses(site, 'posts') == {'500': 2}
+
+    time.sleep(0.3)
+    site.faults = fakewp.Faults(latency=0.3)
+    probe = threading.Thread(target=client.get, args=('/posts',))
+    probe.start()
+    time.sleep(0.1)
+    # Only the probe goes out while it is in flight
+    with pytest.raises(CircuitOpen):
+        client.get('/posts')
+    probe.join()
+    assert not breaker.is_open
+    assert statuses(site, 'posts') == {'200': 1, '500': 2}
+    client.get('/posts')
+
+
+def test_failed_probe_reopens_the_breaker(site):
+    breaker = CircuitBreaker(threshold=1, cooldown=0.2)
+    client = client_for(site, retry=RetryPolicy(attempts=1), breaker=breaker)
+    site.faults = fakewp.Faults(error_rate=1.0)
+    with pytest.raises(WordPressError):
+        client.get('/posts')
+    time.sleep(0.2)
+    with pytest.raises(WordPressError) as error:
+        client.get('/posts')
+    assert not isinstance(error.value, CircuitOpen)
+    with pytest.raises(CircuitOpen):
+        client.get('/posts')
+    assert statuses(site, 'posts') == {'500': 2}
+
+
+def test_only_the_probe_closes_the_breaker():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    assert breaker.before() == (None, False)
+    # A failure opens the circuit while an earlier request is still in flight
+    breaker.record(False)
+    assert breaker.is_open
+    assert breaker.before() == (None, True)
+    # The earlier request's late answer neither closes it nor ends the probe
+    breaker.record(True)
+    assert breaker.is_open
+    assert breaker.before()[0] is not None
+    breaker.record(False)
+    assert breaker.before()[0] is not None
+    breaker.record(True, probe=True)
+    assert not breaker.is_open
+    assert breaker.before() == (None, False)
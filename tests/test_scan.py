@@ -0,0 +1,98 @@
+"""
+Paginated post scanning with checkpoints (wptools.scan)
+"""
+
+import json
+
+import pytest
+
+from wptools.client import WordPressClient
+from wptools.scan import ScanCheckpoint, fetch_all, fetch_page, scan_posts
+
+
+@pytest.fixture
+def client(site):
+    site.site.seed_posts(95, escaped_every=10)
+    return WordPressClient(site.url, 'admin', 'secret')
+
+
+def escaped(post):
+    return '&lt;' in post['content']['rendered']
+
+
+def ids(site, every=1):
+    """Ids of the seeded posts, or of every n-th one"""
+    with site.site.lock:
+        posts = sorted(site.site.items['posts'])
+    return posts[every - 1::every]
+
+
+def page_requests(site):
+    return site.stats.snapshot()['statuses'].get('posts 200', 0)
+
+
+def test_fetch_all_reads_every_page(site, client):
+    items, total_pages = fetch_page(client, 1, per_page=20, fields=['id'])
+    assert (len(items), total_pages) == (20, 5)
+    posts = fetch_all(client, '/posts', fields=['id'], per_page=20)
+    assert [post['id'] for post in posts] == ids(site)
+
+
+def test_scan_yields_every_match_and_removes_its_checkpoint(site, client, tmp_path):
+    checkpoint = tmp_path / 'scan.jsonl'
+    matches = scan_posts(client, escaped, fields=['id', 'content'], per_page=20,
+                         checkpoint_path=str(checkpoint))
+    assert sorted(post['id'] for post in matches) == ids(site, 10)
+    assert not checkpoint.exists()
+
+
+def test_interrupted_scan_resumes_with_the_pages_it_has_not_seen(site, client, tmp_path):
+    checkpoint = tmp_path / 'scan.jsonl'
+    first_on_page_3 = ids(site)[40]
+
+    def crash_on_page_3(post):
+        if post['id'] == first_on_page_3:
+            raise RuntimeError('interrupted')
+        return escaped(post)
+
+    found = []
+    with pytest.raises(RuntimeError):
+        for post in scan_posts(client, crash_on_page_3, fields=['id', 'content'], per_page=20,
+                               concurrency=1, checkpoint_path=str(checkpoint)):
+            found.append(post['id'])
+    assert found == ids(site, 10)[:4]
+    records = [json.loads(line) for line in checkpoint.read_text().splitlines()]
+    assert [record.get('page') for record in records] == [None, 1, 2]
+
+    site.stats.reset()
+    resumed = [post['id'] for post in scan_posts(client, escaped, fields=['id', 'content'],
+                                                 per_page=20, concurrency=1,
+                                                 checkpoint_path=str(checkpoint))]
+    assert sorted(resumed) == ids(site, 10)
+    assert page_requests(site) == 3
+    assert not checkpoint.exists()
+
+
+def test_checkpoint_for_other_settings_is_discarded(tmp_path):
+    path = str(tmp_path / 'scan.jsonl')
+    checkpoint = ScanCheckpoint(path, {'per_page': 20})
+    checkpoint.add(1, 5, [{'id': 1}])
+    checkpoint.close()
+    assert ScanCheckpoint(path, {'per_page': 20}).pages == {1: [{'id': 1}]}
+    assert ScanCheckpoint(path, {'per_page': 50}).pages == {}
+
+
+def test_resume_after_a_line_cut_short(tmp_path):
+    path = tmp_path / 'scan.jsonl'
+    checkpoint = ScanCheckpoint(str(path), {'per_page': 20})
+    checkpoint.add(1, 3, [{'id': 1}])
+    checkpoint.close()
+    with open(path, 'a') as f:
+        f.write('{"page": 2, "total_pa')
+
+    checkpoint = ScanCheckpoint(str(path), {'per_page': 20})
+    assert checkpoint.pages == {1: [{'id': 1}]}
+    checkpoint.add(2, 3, [])
+    checkpoint.close()
+    assert ScanCheckpoint(str(path), {'per_page': 20}).pages == {1: [{'id': 1}], 2: []}
+    assert all(json.loads(line) for line in path.read_text().splitlines())
@@ -0,0 +1,67 @@
+"""
+Streamed markdown-to-HTML conversion and streamed post bodies
+
+Whole-document and streamed conversion must give the same HTML for every
+document the publisher is used on (see wptools.bench for the corpus).
+"""
+
+import itertools
+import json
+
+import pytest
+
+from wptools.bench import ROOT, load_corpus
+from wptools.client import WordPressClient, iter_post_json
+from wptools.markdown import iter_html, iter_lines, iter_markdown_file, markdown_to_html
+
+CORPUS = load_corpus(synthetic=False)
+
+
+def test_corpus_is_not_empty():
+    assert CORPUS
+
+
+@pytest.mark.parametrize('name', sorted(CORPUS))
+def test_streamed_matches_whole_document(name):
+    assert ''.join(iter_markdown_file(ROOT / name)) == markdown_to_html(CORPUS[name])
+
+
+@pytest.mark.parametrize('text', ['', 'a', 'a\n', 'a\n\nb', 'a\nb\n\n'])
+def test_lines_split_like_str_split(text, tmp_path):
+    path = tmp_path / 'doc.md'
+    path.write_text(text)
+    with open(path) as f:
+        assert list(iter_lines(f)) == text.split('\n')
+
+
+def test_html_is_yielded_before_the_input_is_read():
+    read = []
+
+    def lines():
+        for number in itertools.count():
+            read.append(number)
+            yield f'Paragraph {number}.' if number % 2 == 0 else ''
+
+    pieces = iter_html(lines())
+    first = ''.join(itertools.islice(pieces, 3))
+    assert '<p>Paragraph 0.</p>' in first
+    assert len(read) < 10
+
+
+def test_post_json_streams_content_as_a_json_string():
+    chunks = ['<p>"quoted" \\ back</p>\n', '<p>ünïcode\t</p>']
+    text = ''.join(iter_post_json({'title': 'T', 'status': 'draft'}, chunks))
+    assert json.loads(text) == {'title': 'T', 'status': 'draft', 'content': ''.join(chunks)}
+    assert json.loads(''.join(iter_post_json({}, chunks))) == {'content': ''.join(chunks)}
+
+
+@pytest.mark.parametrize('gzip_requests', [False, True], ids=['plain', 'gzip'])
+def test_streamed_post_reaches_the_site_intact(site, gzip_requests):
+    name = max(CORPUS, key=lambda name: len(CORPUS[name]))
+    client = WordPressClient(site.url, 'admin', 'secret', gzip_requests=gzip_requests)
+    body = iter_post_json({'title': 'Streamed', 'status': 'publish'},
+                          iter_markdown_file(ROOT / name))
+    post = client.post('/posts', body)
+    with site.site.lock:
+        content = site.site.items['posts'][post['id']]['content']
+    assert content == markdown_to_html(CORPUS[name])
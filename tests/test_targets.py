@@ -0,0 +1,116 @@
+"""
+Publishing to several sites at once (wptools.targets)
+"""
+
+import json
+import threading
+import time
+
+import pytest
+
+from conftest import by_title, posts
+from wptools import fakewp
+from wptools.client import CircuitOpen
+from wptools.targets import Fanout, Target, load_targets
+
+
+@pytest.fixture
+def second_site():
+    server = fakewp.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def write_targets(path, config):
+    path.write_text(json.dumps(config))
+    return str(path)
+
+
+def test_targets_load_with_defaults_and_password_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('WP_STAGING_PASSWORD', 'from-env')
+    path = write_targets(tmp_path / 'targets.json', {
+        'staging': {'url': 'https://staging.test/', 'user': 'editor',
+                    'password_env': 'WP_STAGING_PASSWORD', 'rate': 5},
+        'production': {'url': 'https://prod.test', 'password': 'secret', 'concurrency': 2},
+    })
+    staging, production = load_targets(path, rate=1, concurrency=3)
+    assert (staging.url, staging.password, staging.rate, staging.concurrency) == (
+        'https://staging.test', 'from-env', 5.0, 3)
+    assert (production.rate, production.concurrency) == (1.0, 2)
+    chosen = load_targets(path, ['production', 'staging', 'production'])
+    assert [target.name for target in chosen] == ['production', 'staging']
+    with pytest.raises(ValueError, match='unknown target: nope'):
+        load_targets(path, ['nope'])
+    monkeypatch.delenv('WP_STAGING_PASSWORD')
+    with pytest.raises(ValueError, match='WP_STAGING_PASSWORD is not set'):
+        load_targets(path)
+    with pytest.raises(ValueError, match='needs a url'):
+        load_targets(write_targets(tmp_path / 'bad.json', {'x': {}}))
+
+
+def test_a_failing_target_does_not_affect_the_others():
+    fast, failing, down = (Target(name, f'https://{name}.test', rate=0)
+                           for name in ('fast', 'failing', 'down'))
+    fanout = Fanout([fast, failing, down])
+    calls = {name: 0 for name in ('fast', 'failing', 'down')}
+    lock = threading.Lock()
+
+    def send(target):
+        with lock:
+            calls[target.name] += 1
+        if target.name == 'failing':
+            raise RuntimeError('HTTP 500')
+        if target.name == 'down':
+            raise CircuitOpen('down.test is unavailable')
+        return {'action': 'created', 'id': 1}
+
+    for item in ('a.md', 'b.md', 'c.md'):
+        fanout.send(item, send)
+    fanout.close()
+    assert [outcome['ok'] for outcome in fanout.outcomes['fast']] == [True] * 3
+    assert [outcome['error'] for outcome in fanout.outcomes['failing']] == ['HTTP 500'] * 3
+    # The site that is down is sent one document, not all of them
+    assert calls == {'fast': 3, 'failing': 3, 'down': 1}
+    assert sum(bool(outcome.get('skipped')) for outcome in fanout.outcomes['down']) == 2
+
+
+def test_a_slow_target_does_not_hold_the_others_back():
+    fanout = Fanout([Target('fast', 'https://fast.test', rate=0),
+                     Target('slow', 'https://slow.test', rate=0, concurrency=1)])
+    release = threading.Event()
+
+    def send(target):
+        if target.name == 'slow':
+            release.wait(5)
+        return {'action': 'created'}
+
+    futures = [fanout.send(item, send) for item in ('a.md', 'b.md', 'c.md')]
+    started = time.monotonic()
+    assert all(future['fast'].result(timeout=5)['ok'] for future in futures)
+    assert time.monotonic() - started < 1
+    assert not fanout.outcomes['slow']
+    release.set()
+    fanout.close()
+    assert len(fanout.outcomes['slow']) == 3
+
+
+def test_publisher_sends_each_document_to_every_target(site, second_site, docs, publisher,
+                                                       tmp_path):
+    path = write_targets(tmp_path / 'targets.json', {
+        'one': {'url': site.url, 'user': 'admin', 'password': 'secret'},
+        'two': {'url': second_site.url, 'user': 'admin', 'password': 'secret'},
+    })
+    second_site.faults = fakewp.Faults(error_rate=1.0)
+    result = publisher.run(docs, '--targets', 'all', '--targets-file', path, '--retries', 0)
+    assert result.returncode != 0
+    assert 'Published to 1 of 2 targets' in result.stdout
+    assert sorted(by_title(site)) == ['Guide 1', 'Guide 2', 'Guide 3']
+    assert posts(second_site) == []
+
+    # The healthy site is left alone; the other one catches up
+    second_site.faults = fakewp.Faults()
+    result = publisher.run(docs, '--targets', 'all', '--targets-file', path)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert len(posts(site)) == 3
+    assert sorted(by_title(second_site)) == ['Guide 1', 'Guide 2', 'Guide 3']
@@ -0,0 +1,74 @@
+"""
+Category and tag resolution (wptools.taxonomy)
+"""
+
+import pytest
+
+from wptools.client import WordPressClient
+from wptools.taxonomy import TaxonomyResolver, slugify
+
+
+@pytest.fixture
+def client(site):
+    return WordPressClient(site.url, 'admin', 'secret')
+
+
+def terms(site, taxonomy):
+    with site.site.lock:
+        return {term['name']: term['id'] for term in site.site.items[taxonomy].values()}
+
+
+def requests(site):
+    """Requests the site answered, by route"""
+    counts = {}
+    for key, count in site.stats.snapshot()['statuses'].items():
+        route = key.split()[0]
+        counts[route] = counts.get(route, 0) + count
+    return counts
+
+
+def test_slugify_follows_wordpress_for_plain_names():
+    assert slugify('How-To Guides') == 'how-to-guides'
+    assert slugify('  Docker & Swarm!  ') == 'docker-swarm'
+
+
+def test_existing_terms_resolve_by_name_slug_or_id(site, client, tmp_path):
+    resolver = TaxonomyResolver(client, site.url, str(tmp_path / 'taxonomy.json'))
+    uncategorized = terms(site, 'categories')['Uncategorized']
+    assert resolver.resolve('categories', ['Uncategorized', 'uncategorized', 'UNCATEGORIZED',
+                                           uncategorized]) == [uncategorized] * 4
+    assert requests(site) == {'categories': 1}
+
+
+def test_missing_terms_are_created_together_once(site, client, tmp_path):
+    resolver = TaxonomyResolver(client, site.url, str(tmp_path / 'taxonomy.json'))
+    ids = resolver.resolve('tags', ['Docker', 'docker', {'name': 'How-To Guides'}, 'Swarm'])
+    created = terms(site, 'tags')
+    assert sorted(created) == ['Docker', 'How-To Guides', 'Swarm']
+    assert ids == [created['Docker'], created['Docker'], created['How-To Guides'],
+                   created['Swarm']]
+    # One sweep of the existing terms and one batch for the new ones
+    assert requests(site) == {'tags': 1, 'batch': 1}
+    assert resolver.resolve('tags', ['how-to-guides']) == [created['How-To Guides']]
+    assert requests(site) == {'tags': 1, 'batch': 1}
+
+
+def test_terms_are_cached_on_disk_for_ttl(site, client, tmp_path):
+    path = str(tmp_path / 'taxonomy.json')
+    TaxonomyResolver(client, site.url, path).resolve('tags', ['Docker'])
+    site.stats.reset()
+    docker = terms(site, 'tags')['Docker']
+    assert TaxonomyResolver(client, site.url, path).resolve('tags', ['Docker']) == [docker]
+    assert requests(site) == {}
+    # Another site, or an expired cache, fetches the terms again
+    TaxonomyResolver(client, 'https://other.test', path).prefetch('tags')
+    TaxonomyResolver(client, site.url, path, ttl=0).prefetch('tags')
+    assert requests(site) == {'tags': 2}
+
+
+def test_term_created_elsewhere_since_the_prefetch_is_reused(site, client, tmp_path):
+    resolver = TaxonomyResolver(client, site.url, str(tmp_path / 'taxonomy.json'))
+    resolver.prefetch('categories')
+    client.post('/categories', {'name': 'Guides'})
+    assert resolver.resolve('categories', ['Guides']) == [terms(site, 'categories')['Guides']]
+    assert list(terms(site, 'categories')).count('Guides') == 1
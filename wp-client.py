@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+WordPress Publisher client - Sends work to a running `wp-publisher.py --serve`
+
+Imports nothing beyond the standard library basics, so a call costs the
+interpreter start-up plus one local round trip instead of a full publisher
+start.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+
+# Same default as wptools.service (not imported: it would load the converter)
+DEFAULT_SOCKET = os.environ.get('WP_PUBLISHER_SOCKET',
+                                os.path.expanduser('~/.cache/wp-publisher/publisher.sock'))
+
+def call(address, action, params=None, timeout=600):
+    """Send one request to the service and return (status, decoded JSON)"""
+
+    host, _, port = address.rpartition(':')
+    if port.isdigit() and '/' not in address:
+        sock = socket.create_connection((host or '127.0.0.1', int(port)), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    else:
+        sock = socket.socket(socket.AF_UNIX)
+        sock.settimeout(timeout)
+        sock.connect(address)
+
+    body = json.dumps(params).encode('utf-8') if params is not None else b''
+    method = 'POST' if params is not None else 'GET'
+    head = (f'{method} /{action} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+            f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n')
+    with sock:
+        sock.sendall(head.encode('ascii') + body)
+        parts = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            parts.append(data)
+
+    response = b''.join(parts)
+    header, _, payload = response.partition(b'\r\n\r\n')
+    status = int(header.split(b' ', 2)[1])
+    return status, json.loads(payload)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Send publish, render and status requests to wp-publisher.py --serve',
+        epilog="Example: wp-client.py publish TMUX-SETUP.md 'TMUX Guide'\n"
+               "         wp-client.py render README.md > readme.html",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--address', default=DEFAULT_SOCKET,
+                        help=f'service socket or host:port (default: $WP_PUBLISHER_SOCKET or '
+                             f'{DEFAULT_SOCKET})')
+    parser.add_argument('--timing', action='store_true',
+                        help='print the round-trip time to stderr')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    publish = commands.add_parser('publish', help='publish a file, directory or glob')
+    publish.add_argument('target')
+    publish.add_argument('title', nargs='?')
+    publish.add_argument('--force', action='store_true',
+                         help='publish even if unchanged since the last run')
+    publish.add_argument('--category', help='category name, slug or id')
+    publish.add_argument('--tags', help='comma-separated tag names, slugs or ids')
+
+    render = commands.add_parser('render', help='print the HTML for a markdown file (- for stdin)')
+    render.add_argument('source')
+    render.add_argument('--title', help='title used to decide whether the first heading is dropped')
+
+    commands.add_parser('status', help='show what the service is doing')
+    args = parser.parse_args()
+
+    if args.command == 'publish':
+        # The service runs in its own directory: anchor relative paths and
+        # globs at ours (abspath would also normalise the pattern)
+        params = {'path': os.path.join(os.getcwd(), args.target) if any(
+                      c in args.target for c in '*?[') else os.path.abspath(args.target),
+                  'force': args.force}
+        if args.title:
+            params['title'] = args.title
+        if args.category:
+            params['category'] = args.category
+        if args.tags:
+            params['tags'] = [tag.strip() for tag in args.tags.split(',') if tag.strip()]
+    elif args.command == 'render':
+        params = {'markdown': sys.stdin.read()} if args.source == '-' else \
+            {'path': os.path.abspath(args.source)}
+        if args.title:
+            params['title'] = args.title
+    else:
+        params = None
+
+    started = time.perf_counter()
+    try:
+        status, result = call(args.address, args.command, params)
+    except (OSError, ValueError) as e:
+        print(f"❌ No publisher service at {args.address}: {e}", file=sys.stderr)
+        print("   Start one with: wp-publisher.py --serve", file=sys.stderr)
+        sys.exit(2)
+    if args.timing:
+        print(f"⏱️  {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+
+    if not result.get('ok'):
+        print(f"❌ {result.get('error') or f'HTTP {status}'}", file=sys.stderr)
+        for item in result.get('results', []):
+            if not item['ok']:
+                print(f"   ❌ {item['path']}: {item.get('error', 'failed')}", file=sys.stderr)
+        sys.exit(1)
+    if args.command == 'render':
+        sys.stdout.write(result['html'])
+    elif args.command == 'publish':
+        if 'results' in result:
+            print(f"✅ Published {len(result['results'])} documents")
+        elif result['action'] == 'unchanged':
+            print(f"⏭️  Unchanged since last publish: {result['title']}")
+        else:
+            print(f'{"🔄 Updated" if result["action"] == "updated" else "✅ Created"}: '
+                  f'{result["title"]}')
+            print(f"   URL: {result['link']}")
+    else:
+        print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
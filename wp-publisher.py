@@ -3,232 +3,1201 @@
 WordPress Publisher - Posts markdown files to WordPress with proper formatting
 """
 
-import json
-import subprocess
-import re
+import argparse
+import contextlib
+import contextvars
 import sys
 import os
-from pathlib import Path
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from wptools import cache, highlight, jobqueue, media, paginate, postindex, static, targets
+from wptools.bulk import find_markdown, is_bulk_target, print_summary, publish_files
+from wptools.client import WordPressClient, WordPressError, iter_post_json
+from wptools.manifest import DEFAULT_PATH, Manifest, file_hash, fingerprint
+from wptools.markdown import (MAX_CONVERT_SECONDS, MAX_DOCUMENT_SIZE, BlockCache, Budget,
+                              BudgetExceeded, converter_version, document_title,
+                              iter_markdown_file, markdown_to_html)
+from wptools.metrics import METRICS, profiling
+from wptools.retry import RetryPolicy
+from wptools.service import DEFAULT_SOCKET, RequestError, describe, make_server
+from wptools.taxonomy import TaxonomyResolver, slugify
+from wptools.watch import is_markdown, watch_changes
 
 # WordPress configuration
-WP_URL = "https://wp.stringbits.com"
+# WP_URL points the script at another site, such as a local wptools.fakewp
+WP_URL = os.environ.get("WP_URL", "https://wp.stringbits.com")
 WP_API_URL = f"{WP_URL}/wp-json/wp/v2"
 DEFAULT_USER = "itservice"
 DEFAULT_PASS = "LV78 2PAJ XXOi YLzt AlMg SizX"
 
-def markdown_to_html(content, skip_first_h1=False):
-    """Convert markdown to HTML with proper formatting"""
-    
-    # IMPORTANT: Process code blocks FIRST to prevent header conversion inside them
-    # Convert code blocks with proper escaping
-    def escape_code(match):
-        lang = match.group(1) or ''
-        code = match.group(2)
-        # Escape HTML entities in code
-        code = code.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-        if lang:
-            return f'<pre class="wp-block-code"><code class="language-{lang}">{code}</code></pre>'
-        return f'<pre class="wp-block-code"><code>{code}</code></pre>'
-    
-    content = re.sub(r'```(\w*)\n(.*?)\n```', escape_code, content, flags=re.DOTALL)
-    
-    # NOW convert headers (after code blocks are protected)
-    content = re.sub(r'^### (.+)$', r'<h3>\1</h3>', content, flags=re.MULTILINE)
-    content = re.sub(r'^## (.+)$', r'<h2>\1</h2>', content, flags=re.MULTILINE)
-    
-    if skip_first_h1:
-        # Skip the first H1 heading
-        content = re.sub(r'^# .+\n', '', content, count=1)
-    
-    content = re.sub(r'^# (.+)$', r'<h1>\1</h1>', content, flags=re.MULTILINE)
-    
-    # Convert inline code
-    content = re.sub(r'`([^`]+)`', r'<code>\1</code>', content)
-    
-    # Convert bold and italic
-    content = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', content)
-    content = re.sub(r'(?<!\*)\*([^*]+)\*(?!\*)', r'<em>\1</em>', content)
-    
-    # Convert links
-    content = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'<a href="\2">\1</a>', content)
-    
-    # Convert lists
-    lines = content.split('\n')
-    in_list = False
-    list_type = None
-    new_lines = []
-    
-    for i, line in enumerate(lines):
-        # Unordered list
-        if line.strip().startswith('- '):
-            if not in_list or list_type != 'ul':
-                if in_list and list_type == 'ol':
-                    new_lines.append('</ol>')
-                new_lines.append('<ul>')
-                in_list = True
-                list_type = 'ul'
-            new_lines.append(f'<li>{line.strip()[2:]}</li>')
-        # Ordered list
-        elif re.match(r'^\d+\.\s+', line.strip()):
-            if not in_list or list_type != 'ol':
-                if in_list and list_type == 'ul':
-                    new_lines.append('</ul>')
-                new_lines.append('<ol>')
-                in_list = True
-                list_type = 'ol'
-            content_start = line.find('.') + 2
-            new_lines.append(f'<li>{line.strip()[content_start:]}</li>')
+# The site published to unless --targets picks sites from a target file
+# (see wptools.targets)
+DEFAULT_TARGET = targets.Target('default', WP_URL, DEFAULT_USER, DEFAULT_PASS)
+TARGETS_PATH = os.environ.get('WP_TARGETS', targets.DEFAULT_PATH)
+
+# Compress request bodies (the server must inflate them, see wptools.client)
+GZIP_REQUESTS = os.environ.get('WP_GZIP_REQUESTS') == '1'
+
+# Highlight fenced code when converting (needs Pygments, see
+# wptools.highlight)
+HIGHLIGHT = os.environ.get('WP_HIGHLIGHT') == '1'
+
+# Transient failures (429, 503, timeouts) are retried this many times
+RETRIES = int(os.environ.get('WP_RETRIES', 4))
+
+# Records which file became which post, so re-runs skip or update in place
+MANIFEST_PATH = os.environ.get('WP_MANIFEST', DEFAULT_PATH)
+
+# --queue runs bulk publishes as durable jobs kept here, so an interrupted
+# run resumes where it stopped
+QUEUE_PATH = os.environ.get('WP_QUEUE', jobqueue.DEFAULT_PATH)
+
+# Remote posts are indexed here to find the post a new file belongs to
+# ('' disables the index, so files missing from the manifest always
+# become new posts)
+POST_INDEX_PATH = os.environ.get('WP_POST_INDEX', postindex.DEFAULT_PATH)
+
+# The index is synced at most this often (seconds)
+POST_INDEX_MAX_AGE = 60
+
+# Post meta key set on every post this tool creates: only posts carrying it
+# are adopted by a file they were not published from.  The site has to
+# register it with show_in_rest, or WordPress drops it
+MARKER_META = 'wp_publisher'
+
+# Local images referenced by documents are uploaded to the media library
+# (unless --no-images) once per content, as recorded here ('' remembers
+# uploads for this run only); with Pillow installed, images wider than
+# MAX_IMAGE_WIDTH pixels are scaled down first (0 keeps them as they are)
+UPLOAD_IMAGES = True
+MEDIA_INDEX_PATH = os.environ.get('WP_MEDIA_INDEX', media.DEFAULT_PATH)
+MAX_IMAGE_WIDTH = 0
+IMAGE_QUALITY = 85
+
+# Posts whose HTML is over PAGE_BYTES or PAGE_BLOCKS top-level blocks are
+# split at H2 headings (0 disables a limit): into <!--nextpage--> pages of
+# one post, or with SERIES into a series of linked posts
+PAGE_BYTES = 0
+PAGE_BLOCKS = 0
+SERIES = False
+
+# Converted HTML is cached here between runs ('' disables the cache)
+RENDER_CACHE_PATH = os.environ.get('WP_RENDER_CACHE', cache.DEFAULT_PATH)
+
+# Documents larger or slower to convert than this are refused
+# ($WP_MAX_DOCUMENT_SIZE characters, $WP_CONVERT_TIMEOUT seconds)
+BUDGET = Budget()
+
+_clients = {}
+_clients_lock = threading.Lock()
+_render_cache = None
+# Per site, by URL
+_taxonomies = {}
+_post_indexes = {}
+_media = {}
+# (site, post id) of posts adopted by a file in this run, so no second
+# file takes them
+_adopted = set()
+# The target being published to in this thread, when not DEFAULT_TARGET
+_target = contextvars.ContextVar('target', default=None)
+# Blocks of documents rendered by this process, reused when they are
+# rendered again after an edit
+_block_cache = BlockCache()
+
+def current_target():
+    """The target this thread publishes to"""
+    return _target.get() or DEFAULT_TARGET
+
+@contextlib.contextmanager
+def publishing_to(target):
+    """Direct the clients, indexes and uploads of this thread to target"""
+    token = _target.set(target)
+    try:
+        yield target
+    finally:
+        _target.reset(token)
+
+def get_client(username=None, password=None):
+    """Return the current target's shared keep-alive API client
+    
+    username and password default to the target's credentials.
+    """
+    target = current_target()
+    key = (target.url, username or target.username, password or target.password)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = WordPressClient(*key, gzip_requests=GZIP_REQUESTS,
+                                            retry=RetryPolicy(RETRIES + 1))
+        return _clients[key]
+
+def get_taxonomy():
+    """Return the current target's shared category and tag resolver"""
+    client = get_client()
+    site = current_target().url
+    with _clients_lock:
+        if site not in _taxonomies:
+            _taxonomies[site] = TaxonomyResolver(client, site=site)
+        return _taxonomies[site]
+
+def get_post_index():
+    """Return the current target's index of remote posts, or None when disabled"""
+    client = get_client()
+    site = current_target().url
+    with _clients_lock:
+        if site not in _post_indexes and POST_INDEX_PATH:
+            _post_indexes[site] = postindex.PostIndex(client, POST_INDEX_PATH, site=site)
+        return _post_indexes.get(site)
+
+def get_media():
+    """Return the current target's image uploader, or None when images are not uploaded"""
+    client = get_client()
+    site = current_target().url
+    with _clients_lock:
+        if site not in _media and UPLOAD_IMAGES:
+            index = media.MediaIndex(MEDIA_INDEX_PATH, site=site) if MEDIA_INDEX_PATH else None
+            _media[site] = media.MediaUploader(client, index, max_width=MAX_IMAGE_WIDTH,
+                                               quality=IMAGE_QUALITY)
+        return _media.get(site)
+
+def with_images(chunks, uploads):
+    """Point the images in HTML chunks at their uploads ({src: future})"""
+    if not uploads:
+        return chunks
+    urls = get_media().urls(uploads)
+    if isinstance(chunks, list):
+        return [media.rewrite_sources(chunk, urls) for chunk in chunks]
+    return (media.rewrite_sources(chunk, urls) for chunk in chunks)
+
+def print_media_summary():
+    """Print how many images were uploaded, per site, if any were looked at"""
+    for site, uploader in _media.items():
+        if uploader.uploaded + uploader.reused:
+            label = '' if len(_media) == 1 else f' ({site})'
+            print(f'🖼️  Images{label}: {uploader.summary()}')
+
+def get_render_cache():
+    """Return the shared render cache, or None when it is disabled"""
+    global _render_cache
+    with _clients_lock:
+        if _render_cache is None and RENDER_CACHE_PATH:
+            _render_cache = cache.RenderCache(RENDER_CACHE_PATH)
+        return _render_cache
+
+def render_markdown(content, skip_first_h1=False):
+    """markdown_to_html() through the render cache"""
+    def convert():
+        with METRICS.timer('convert'):
+            return markdown_to_html(content, skip_first_h1=skip_first_h1, block_cache=_block_cache,
+                                    budget=BUDGET, highlight=HIGHLIGHT)
+    
+    render_cache = get_render_cache()
+    if render_cache is None:
+        return convert()
+    key = cache.render_key(cache.markdown_hash(content), converter_version(HIGHLIGHT),
+                           skip_first_h1=skip_first_h1)
+    return render_cache.render(key, convert)
+
+def post_fields(title, category_id=1, tags=None):
+    """Post fields sent alongside the content"""
+    fields = {
+        'title': title,
+        'status': 'publish',
+        'categories': [category_id],
+        'format': 'standard'  # Ensure WordPress treats as standard post
+    }
+    if tags:
+        fields['tags'] = list(tags)
+    return fields
+
+def publish_post(title, html_chunks, username=None, password=None, category_id=1,
+                 post_id=None, fields=None, tags=None):
+    """Send converted HTML to WordPress and return the post
+
+    Creates a new post, or updates post_id in place.  fields limits an
+    update to the named fields ('content' included); html_chunks is not
+    read when content is left out.
+    """
+    
+    post_data = post_fields(title, category_id, tags)
+    if fields is not None:
+        post_data = {name: value for name, value in post_data.items() if name in fields}
+    if not post_id:
+        post_data['meta'] = {MARKER_META: True}
+    
+    if fields is not None and 'content' not in fields:
+        body = post_data
+    elif isinstance(html_chunks, (list, tuple)):
+        body = dict(post_data, content=''.join(html_chunks))
+    else:
+        # Stream generated HTML straight into the request body
+        body = iter_post_json(post_data, html_chunks)
+    
+    # Only id and link are read back
+    path = f'/posts/{post_id}' if post_id else '/posts'
+    with METRICS.timer('publish', action='update' if post_id else 'create'):
+        return get_client(username, password).post(path, body, fields=('id', 'link'))
+
+def source_state(md_file, manifest=None, force=False, fields=None):
+    """Return (changed, content_hash, stat) for a markdown file
+    
+    fields are post fields that do not come from the file (such as the
+    category); a file counts as changed when they differ from last time,
+    or when one of its images was replaced (see image_fields()).
+    """
+    if manifest is None or force:
+        return True, file_hash(md_file), os.stat(md_file)
+    fields = dict(fields or {}, **image_fields(md_file))
+    changed, content_hash, stat = manifest.check(md_file, published_version())
+    if not changed and fields and manifest.changed_fields(manifest.lookup(md_file), fields):
+        return True, content_hash or manifest.lookup(md_file)['content_hash'], stat
+    return changed, content_hash, stat
+
+def image_fields(md_file):
+    """{'images': {src: content hash}} for the local images of a file, or {}
+    
+    Kept in the manifest like a post field, so replacing an image
+    republishes the documents showing it.  Empty when images are not
+    uploaded.
+    """
+    hashes = media.image_hashes(md_file) if UPLOAD_IMAGES else {}
+    return {'images': hashes} if hashes else {}
+
+def term_fields(category_id=1, tags=None):
+    """The post fields that come from the category and tags"""
+    fields = post_fields(None, category_id, tags)
+    del fields['title']
+    return fields
+
+def pagination():
+    """The pagination settings when paginating, part of the content fingerprint"""
+    return [PAGE_BYTES, PAGE_BLOCKS, SERIES] if PAGE_BYTES or PAGE_BLOCKS else []
+
+def published_version():
+    """converter_version() with the pagination settings, as the manifest keeps it
+    
+    Changing the page budget then republishes files that did not change.
+    """
+    version = converter_version(HIGHLIGHT)
+    return f'{version}:pages-{PAGE_BYTES}-{PAGE_BLOCKS}-{int(SERIES)}' if pagination() else version
+
+def post_link(post_id):
+    """A link to a post that WordPress redirects to its permalink"""
+    return f'{current_target().url}/?p={post_id}'
+
+def part_key(md_file, number):
+    """Manifest key of part number of a series (part 1 is the file itself)"""
+    return f'{md_file}#part{number}'
+
+def part_title(title, number, count):
+    return f'{title} (part {number} of {count})'
+
+def start_series(md_file, title, later_pages, manifest=None, username=None,
+                 password=None, category_id=1, tags=None):
+    """Find or create the posts for parts 2 and up; returns [(post id, html)]
+    
+    New parts are created without navigation; finish_series() adds it
+    once part 1 has an id.
+    """
+    
+    parts = []
+    count = len(later_pages) + 1
+    for number, page in enumerate(later_pages, 2):
+        entry = manifest.lookup(part_key(md_file, number)) if manifest else None
+        if entry and entry['post_id']:
+            post_id = entry['post_id']
         else:
-            if in_list and line.strip() == '':
-                if list_type == 'ol':
-                    new_lines.append('</ol>')
-                else:
-                    new_lines.append('</ul>')
-                in_list = False
-                list_type = None
-            new_lines.append(line)
-    
-    if in_list:
-        if list_type == 'ol':
-            new_lines.append('</ol>')
+            post_id = publish_post(part_title(title, number, count), [page], username, password,
+                                   category_id, tags=tags)['id']
+        parts.append((post_id, page))
+    return parts
+
+def finish_series(md_file, title, first_id, parts, content_hash, manifest=None, stat=None,
+                  username=None, password=None, category_id=1, tags=None):
+    """Send parts 2 and up with links between all parts of the series"""
+    
+    links = [post_link(first_id)] + [post_link(post_id) for post_id, _ in parts]
+    count = len(parts) + 1
+    for number, (post_id, page) in enumerate(parts, 2):
+        part = part_title(title, number, count)
+        html = [paginate.series_page(page, links, number)]
+        try:
+            post = publish_post(part, html, username, password, category_id, post_id=post_id,
+                                tags=tags)
+        except WordPressError as e:
+            if e.status != 404:
+                raise
+            post = publish_post(part, html, username, password, category_id, tags=tags)
+        if manifest:
+            manifest.record(part_key(md_file, number), content_hash, published_version(),
+                            post['id'], post_fields(part, category_id, tags),
+                            stat=stat or os.stat(md_file))
+
+def drop_parts(md_file, keep, manifest, username=None, password=None):
+    """Trash the posts of series parts beyond keep, left from a longer version"""
+    
+    number = keep + 1
+    while True:
+        entry = manifest.lookup(part_key(md_file, number))
+        if entry is None:
+            return
+        try:
+            get_client(username, password).request('DELETE', f'/posts/{entry["post_id"]}')
+        except WordPressError as e:
+            if e.status not in (404, 410):
+                raise
+        manifest.forget(part_key(md_file, number))
+        number += 1
+
+def sync_post(md_file, title, render, content_hash, manifest=None, stat=None, force=False,
+              username=None, password=None, category_id=1, tags=None):
+    """Create or update the post for a markdown file
+    
+    render() returns the HTML chunks and is called at most twice.  Fields
+    whose fingerprint matches the manifest are not sent unless force is
+    set.  Oversized documents are paginated (see PAGE_BYTES); post then
+    has 'pages', the size of each page.  Returns (action, post) with
+    action 'created', 'updated' or 'unchanged'.
+    """
+    
+    post_data = post_fields(title, category_id, tags)
+    # The content follows from the source, the converter, the title (which
+    # decides whether the first heading is dropped), the page budget and
+    # the images uploaded for it
+    images = image_fields(md_file)
+    fingerprints = {'content': fingerprint([content_hash, converter_version(HIGHLIGHT), title]
+                                           + pagination() + list(images.values()))}
+    fingerprints.update((name, fingerprint(value)) for name, value in images.items())
+    entry = manifest.lookup(md_file) if manifest else None
+    pages = []  # page sizes, once paginated
+    parts = []  # (post id, html) of parts 2 and up of a series
+    rendered = []
+    
+    def content():
+        rendered.append(True)
+        chunks = render()
+        if not pagination():
+            return chunks
+        html_pages = paginate.paginate(''.join(chunks), PAGE_BYTES, PAGE_BLOCKS)
+        pages[:] = paginate.page_sizes(html_pages)
+        if len(html_pages) == 1:
+            return html_pages
+        if not SERIES:
+            return [paginate.join_pages(html_pages)]
+        if not parts:
+            parts.extend(start_series(md_file, title, html_pages[1:], manifest, username, password,
+                                      category_id, tags))
+        links = [None] + [post_link(post_id) for post_id, _ in parts]
+        return [paginate.series_page(html_pages[0], links, 1)]
+    
+    action, post = 'created', None
+    if entry and entry['post_id']:
+        changed = None if force else manifest.changed_fields(entry, post_data, fingerprints)
+        if changed == []:
+            action, post = 'unchanged', {'id': entry['post_id']}
         else:
-            new_lines.append('</ul>')
+            try:
+                html = content() if changed is None or 'content' in changed else []
+                post = publish_post(title, html, username, password, category_id,
+                                    post_id=entry['post_id'], fields=changed, tags=tags)
+                action = 'updated'
+            except WordPressError as e:
+                if e.status != 404:
+                    raise
+                # The post was deleted on the site: publish it again
+    if post is None and manifest:
+        # A post with this title may exist already (published from another
+        # machine, or before the manifest existed): update it instead, if
+        # this tool created it
+        post_id = find_existing_post(title, manifest, username, password)
+        if post_id is not None:
+            post = publish_post(title, content(), username, password, category_id,
+                                post_id=post_id, tags=tags)
+            action = 'updated'
+    if post is None:
+        post = publish_post(title, content(), username, password, category_id, tags=tags)
+        index = get_post_index()
+        if index is not None:
+            index.remember(post['id'], title, slugify(title), post.get('link'))
     
-    content = '\n'.join(new_lines)
+    if parts:
+        finish_series(md_file, title, post['id'], parts, content_hash, manifest, stat, username,
+                      password, category_id, tags)
+    if manifest and rendered:
+        drop_parts(md_file, len(parts) + 1, manifest, username, password)
     
-    # Convert blockquotes
-    content = re.sub(r'^> (.+)$', r'<blockquote>\1</blockquote>', content, flags=re.MULTILINE)
+    if manifest and action != 'unchanged':
+        manifest.record(md_file, content_hash, published_version(), post['id'], post_data,
+                        fingerprints, stat)
+    if len(pages) > 1:
+        post = dict(post, pages=pages)
+    return action, post
+
+def find_existing_post(title, manifest, username=None, password=None):
+    """Return the id of the one post titled title that no file owns yet
     
-    # Convert tables
-    def convert_table(match):
-        table_text = match.group(0)
-        lines = table_text.strip().split('\n')
-        
-        if len(lines) < 3:  # Need at least header, separator, and one row
-            return table_text
-            
-        html = '<table class="wp-block-table"><thead><tr>'
-        
-        # Header
-        headers = [cell.strip() for cell in lines[0].split('|')[1:-1]]
-        for header in headers:
-            html += f'<th>{header}</th>'
-        html += '</tr></thead><tbody>'
-        
-        # Rows
-        for line in lines[2:]:
-            if line.strip():
-                html += '<tr>'
-                cells = [cell.strip() for cell in line.split('|')[1:-1]]
-                for cell in cells:
-                    html += f'<td>{cell}</td>'
-                html += '</tr>'
+    Looked up in the local post index, synced first if it is more than
+    POST_INDEX_MAX_AGE seconds old.  None if there is no such post, if
+    there are several, or if the index cannot be synced.  Only posts this
+    tool created (see MARKER_META) are taken over: for any other post
+    WordPressError is raised, so a hand-written post is never replaced.
+    """
+    
+    index = get_post_index()
+    if index is None:
+        return None
+    try:
+        index.sync(max_age=POST_INDEX_MAX_AGE)
+    except WordPressError as e:
+        METRICS.log('post_index_unavailable', error=str(e))
+        return None
+    matches = {post['id'] for post in index.find(title=title) + index.find(slug=slugify(title))}
+    site = current_target().url
+    with _clients_lock:
+        candidates = [post_id for post_id in matches
+                      if (site, post_id) not in _adopted and manifest.source_for(post_id) is None]
+        if len(candidates) != 1:
+            return None
+        _adopted.add((site, candidates[0]))
+    post = get_client(username, password).get(f'/posts/{candidates[0]}',
+                                              params={'context': 'edit'}, fields=('meta', 'link'))
+    if not (post.get('meta') or {}).get(MARKER_META):
+        raise WordPressError(f"post {candidates[0]} ({post.get('link')}) has the same title but "
+                             f"was not published by wp-publisher.py; rename the document or "
+                             f"the post", 409)
+    return candidates[0]
+
+def create_post(title, content, username=None, password=None, category_id=1):
+    """Create a WordPress post via REST API
+
+    content is either a markdown string or an iterable of HTML chunks, such
+    as the generator returned by iter_markdown_file() for large documents.
+    Oversized documents are split into <!--nextpage--> pages.
+    """
+    
+    if isinstance(content, str):
+        # Check if content starts with same title as post title
+        first_line = content.split('\n', 1)[0]
+        _, skip_first_h1 = document_title('', first_line, title)
         
-        html += '</tbody></table>'
-        return html
+        # Convert markdown to HTML
+        html_chunks = [render_markdown(content, skip_first_h1=skip_first_h1)]
+    else:
+        html_chunks = content
+    if pagination():
+        html_chunks = [paginate.join_pages(paginate.paginate(''.join(html_chunks), PAGE_BYTES,
+                                                             PAGE_BLOCKS))]
     
-    # Simple table detection (lines with pipes)
-    content = re.sub(r'(\|.+\|[\n\r]+\|[-:\s|]+\|[\n\r]+(?:\|.+\|[\n\r]*)+)', convert_table, content)
+    try:
+        response = publish_post(title, html_chunks, username, password, category_id)
+    except WordPressError as e:
+        print(f'❌ Failed to create: {title}')
+        print(f'   Error: {e}')
+        return False
     
-    # Convert paragraphs (but not inside HTML tags)
-    paragraphs = content.split('\n\n')
-    formatted_paragraphs = []
+    print(f'✅ Created: {title}')
+    print(f'   URL: {response["link"]}')
+    return True
+
+def render_file(md_file, content_hash, skip_first_h1=False, incremental=False):
+    """Convert a markdown file through the render cache; returns HTML chunks
     
-    for p in paragraphs:
-        p = p.strip()
-        if p and not p.startswith('<') and not p.startswith('|'):
-            formatted_paragraphs.append(f'<p>{p}</p>')
-        else:
-            formatted_paragraphs.append(p)
+    Incremental conversions are done in memory, reusing the blocks that
+    did not change since this process last rendered the file, and come
+    back as a list; otherwise the file is streamed through the converter.
+    """
     
-    return '\n'.join(formatted_paragraphs)
+    render_cache = get_render_cache()
+    key = cache.render_key(content_hash, converter_version(HIGHLIGHT), skip_first_h1=skip_first_h1)
+    if render_cache is not None:
+        html = render_cache.get(key)
+        if html is not None:
+            return [html]
+    if incremental:
+        with open(md_file, 'r') as f, METRICS.timer('convert'):
+            html = markdown_to_html(f.read(), skip_first_h1=skip_first_h1,
+                                    block_cache=_block_cache, budget=BUDGET,
+                                    highlight=HIGHLIGHT)
+        if render_cache is not None:
+            render_cache.put(key, html)
+        return [html]
+    # Stream the file through the converter so large documents are never
+    # held in memory as a whole
+    chunks = METRICS.timed_iter('convert', iter_markdown_file(md_file, skip_first_h1=skip_first_h1,
+                                                              budget=BUDGET, highlight=HIGHLIGHT))
+    return chunks if render_cache is None else render_cache.tee(key, chunks)
 
-def create_post(title, content, username=DEFAULT_USER, password=DEFAULT_PASS, category_id=1):
-    """Create a WordPress post via REST API"""
+def publish_document(md_file, title=None, manifest=None, force=False, incremental=False,
+                     category_id=1, tags=None):
+    """Publish one markdown file, skipping it if unchanged since last time
     
-    # Check if content starts with same title as post title
-    first_line = content.split('\n')[0].strip()
-    skip_first_h1 = first_line.startswith('#') and first_line.lstrip('#').strip() == title
+    With incremental set the file is converted in memory, reusing the
+    blocks that did not change since this process last rendered it.
+    Returns {'title', 'action', 'id', 'link'} without printing anything;
+    raises WordPressError or BudgetExceeded when it cannot be published.
+    """
     
-    # Convert markdown to HTML
-    html_content = markdown_to_html(content, skip_first_h1=skip_first_h1)
+    changed, content_hash, stat = source_state(md_file, manifest, force,
+                                               term_fields(category_id, tags))
+    # Upload the images while the text is converted
+    uploader = get_media() if changed else None
+    uploads = uploader.submit(md_file) if uploader is not None else {}
     
-    # Create post data
-    post_data = {
-        'title': title,
-        'content': html_content,
-        'status': 'publish',
-        'categories': [category_id],
-        'format': 'standard'  # Ensure WordPress treats as standard post
-    }
+    # Get title from argument, first heading or file name
+    with open(md_file, 'r') as f:
+        first_line = f.readline()
+    title, skip_first_h1 = document_title(md_file, first_line, title)
+    
+    if content_hash is None:
+        # Not read at all: the manifest still holds its hash
+        content_hash = manifest.lookup(md_file)['content_hash']
     
-    # Write to temp file
-    with open('/tmp/wp-post.json', 'w') as f:
-        json.dump(post_data, f)
+    def render():
+        return with_images(render_file(md_file, content_hash, skip_first_h1, incremental), uploads)
     
-    # Post using curl
-    cmd = [
-        'curl', '-X', 'POST',
-        f'{WP_API_URL}/posts',
-        '-u', f'{username}:{password}',
-        '-H', 'Content-Type: application/json',
-        '-d', '@/tmp/wp-post.json',
-        '-s'
-    ]
+    action, post = sync_post(md_file, title, render, content_hash, manifest, stat, force,
+                             category_id=category_id, tags=tags)
+    METRICS.log('published', source=md_file, title=title, action=action, post_id=post['id'])
+    return {'title': title, 'action': action, 'id': post['id'], 'link': post.get('link'),
+            'pages': post.get('pages')}
+
+def publish_file(md_file, title=None, manifest=None, force=False, incremental=False,
+                 category_id=1, tags=None):
+    """Publish one markdown file, printing progress; returns whether it worked"""
     
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    with open(md_file, 'r') as f:
+        first_line = f.readline()
+    title, _ = document_title(md_file, first_line, title)
+    
+    print(f"📝 Publishing: {title}")
+    print(f"📄 From file: {md_file}")
     
     try:
-        response = json.loads(result.stdout)
-        
-        if 'id' in response:
-            print(f'✅ Created: {title}')
-            print(f'   URL: {response["link"]}')
-            return True
+        result = publish_document(md_file, title, manifest, force, incremental,
+                                  category_id=category_id, tags=tags)
+    except (WordPressError, BudgetExceeded) as e:
+        print(f'❌ Failed to publish: {title}')
+        print(f'   Error: {e}')
+        return False
+    
+    if result['action'] == 'unchanged':
+        print(f'⏭️  Unchanged since last publish: {title}')
+    else:
+        print(f'{"🔄 Updated" if result["action"] == "updated" else "✅ Created"}: {title}')
+        print(f'   URL: {result["link"]}')
+        if result['pages']:
+            print(f'📑 Split into {"a series of " if SERIES else ""}'
+                  f'{paginate.format_sizes(result["pages"])}')
+    render_cache = get_render_cache()
+    if render_cache is not None and render_cache.hits + render_cache.misses:
+        print(f'🗃️  Render cache: {render_cache.summary()}')
+    print_media_summary()
+    return True
+
+def publish_directory(target, concurrency=4, rate=2.0, manifest=None, force=False,
+                      category_id=1, tags=None, converters=None):
+    """Publish every markdown file in a directory or glob
+    
+    converters is passed on to publish_files(): an executor to convert in
+    instead of a process pool of its own.
+    """
+    
+    paths = find_markdown(target)
+    if not paths:
+        print(f"❌ No markdown files match: {target}")
+        return []
+    
+    print(f"📚 Publishing {len(paths)} files ({concurrency} workers, {rate:g} posts/s)")
+    
+    states = {}
+    uploader = get_media()
+    
+    def skip(path):
+        changed, content_hash, stat = source_state(path, manifest, force,
+                                                   term_fields(category_id, tags))
+        # Images upload while the documents are converted
+        uploads = uploader.submit(path) if changed and uploader is not None else {}
+        states[path] = (content_hash, stat, uploads)
+        return not changed
+    
+    def publish(path, title, html):
+        content_hash, stat, uploads = states[path]
+        action, post = sync_post(path, title, lambda: with_images([html], uploads), content_hash,
+                                 manifest, stat, force, category_id=category_id, tags=tags)
+        return dict(post, action=action)
+    
+    results = publish_files(paths, publish, concurrency=concurrency, rate=rate, skip=skip,
+                            cache_path=RENDER_CACHE_PATH or None, budget=BUDGET,
+                            highlight=HIGHLIGHT, converters=converters)
+    print_summary(results)
+    print_media_summary()
+    return results
+
+def enqueue_files(queue, paths, manifest=None, force=False, category_id=1, tags=None):
+    """Queue a publish (or update) job for each file changed since its last publish
+    
+    Jobs are keyed by the file's path, so each file has one job at most;
+    the payload holds its content hash, and a done job runs again only
+    once the content or settings changed.  Returns how many jobs were
+    queued.
+    """
+    
+    queued = 0
+    for path in paths:
+        changed, content_hash, _ = source_state(path, manifest, force,
+                                                term_fields(category_id, tags))
+        if not changed:
+            continue
+        entry = manifest.lookup(path) if manifest else None
+        source = os.path.abspath(path)
+        payload = {'path': source, 'content_hash': content_hash, 'category_id': category_id,
+                   'tags': tags, 'force': force, 'version': published_version()}
+        payload.update((name, fingerprint(value)) for name, value in image_fields(path).items())
+        queued += queue.enqueue('update' if entry and entry['post_id'] else 'publish', source,
+                                payload, force=force)
+    return queued
+
+def run_queue(queue, manifest=None, concurrency=4, rate=2.0):
+    """Run the queued publish and update jobs on a pool of workers
+    
+    Jobs of a run that died are picked up again first, and failed ones
+    are retried (up to jobqueue.MAX_ATTEMPTS times).  Returns whether
+    every job of this run succeeded.
+    """
+    
+    recovered = queue.recover()
+    retried = queue.retry_failed()
+    if recovered or retried:
+        print(f"♻️  Resuming {recovered} interrupted and {retried} failed jobs")
+    print(f"🗂️  Jobs: {queue.summary()} ({concurrency} workers, {rate:g} posts/s)")
+    
+    def publish(job):
+        payload = job['payload']
+        index = get_post_index()
+        if job['attempts'] > 1 and index is not None:
+            # The last attempt may have created the post without recording
+            # it: make sure the index has it, so that it is adopted
+            try:
+                index.sync()
+            except WordPressError as e:
+                METRICS.log('post_index_unavailable', error=str(e))
+        result = publish_document(payload['path'], None, manifest, payload['force'],
+                                  incremental=True, category_id=payload['category_id'],
+                                  tags=payload['tags'])
+        return {'action': result['action'], 'id': result['id'], 'link': result['link']}
+    
+    finished, stopped = jobqueue.run_jobs(queue, {'publish': publish, 'update': publish},
+                                          concurrency, rate)
+    results = [{'path': os.path.relpath(job['payload']['path']), 'ok': job['state'] == 'done',
+                'error': job['error'], 'seconds': job['seconds'], **(job['result'] or {})}
+               for job in sorted(finished, key=lambda job: job['payload']['path'])]
+    if results:
+        print_summary(results)
+    if stopped:
+        print(f"⏸️  Stopped early ({stopped}): run with --queue again to resume")
+    print(f"🗂️  Jobs: {queue.summary()}")
+    return not stopped and all(result['ok'] for result in results)
+
+def publish_queued(args, parser, manifest=None):
+    """Queue args.target's changed files (if given) and run the queue"""
+    
+    if args.watch or args.title:
+        parser.error('--queue takes a directory, glob or file, without --watch or a title')
+    queue = jobqueue.JobQueue(args.queue_file, site=WP_URL)
+    try:
+        if args.target:
+            paths = find_markdown(args.target)
+            if not paths:
+                print(f"❌ No markdown files match: {args.target}")
+                return False
+            try:
+                category_id, tag_ids = resolve_terms(args.category, args.tags)
+            except WordPressError as e:
+                print(f"❌ Could not resolve categories and tags: {e}")
+                return False
+            queued = enqueue_files(queue, paths, manifest, args.force, category_id, tag_ids)
+            print(f"📚 Queued {queued} of {len(paths)} files")
+        return run_queue(queue, manifest, args.concurrency, args.rate)
+    finally:
+        queue.close()
+
+def target_states(md_file, fanout, manifests, terms, force=False):
+    """Return {target name: (changed, content_hash, stat, uploads)} for a file
+    
+    The file's images start uploading to the targets it changed for,
+    unless they were stopped.
+    """
+    
+    states = {}
+    for target in fanout.targets:
+        with publishing_to(target):
+            changed, content_hash, stat = source_state(md_file, manifests[target.name], force,
+                                                       term_fields(**terms[target.name]))
+            uploader = get_media() if changed and not fanout.stopped[target.name] else None
+            uploads = uploader.submit(md_file) if uploader is not None else {}
+        states[target.name] = (changed, content_hash, stat, uploads)
+    return states
+
+def send_document(fanout, md_file, title, html, states, manifests, terms, force=False):
+    """Queue a converted document on the targets it changed for
+    
+    states come from target_states(); the other targets are reported as
+    unchanged.  Returns {target name: future outcome}.
+    """
+    
+    def send(target):
+        _, content_hash, stat, uploads = states[target.name]
+        with publishing_to(target):
+            action, post = sync_post(md_file, title, lambda: with_images([html], uploads),
+                                     content_hash, manifests[target.name], stat, force,
+                                     **terms[target.name])
+        METRICS.log('published', source=md_file, target=target.name, title=title, action=action,
+                    post_id=post['id'])
+        return {'action': action, 'id': post['id'], 'link': post.get('link'),
+                'pages': post.get('pages')}
+    
+    changed = []
+    for target in fanout.targets:
+        if states[target.name][0]:
+            changed.append(target)
         else:
-            print(f'❌ Failed to create: {title}')
-            print(f'   Error: {response}')
+            fanout.record(target, md_file, {'ok': True, 'action': 'unchanged', 'seconds': 0.0})
+    return fanout.send(md_file, send, changed)
+
+def publish_file_to(fanout, md_file, title=None, manifests=None, force=False, terms=None):
+    """Publish one markdown file to every target of fanout, converting it once"""
+    
+    with open(md_file, 'r') as f:
+        first_line = f.readline()
+    title, skip_first_h1 = document_title(md_file, first_line, title)
+    
+    print(f"📝 Publishing: {title}")
+    print(f"📄 From file: {md_file} → {', '.join(target.name for target in fanout.targets)}")
+    
+    states = target_states(md_file, fanout, manifests, terms, force)
+    hashes = [content_hash for changed, content_hash, _, _ in states.values() if changed]
+    html = None
+    if hashes:
+        try:
+            html = ''.join(render_file(md_file, hashes[0], skip_first_h1, incremental=True))
+        except BudgetExceeded as e:
+            print(f'❌ Failed to convert: {title}')
+            print(f'   Error: {e}')
             return False
-            
-    except json.JSONDecodeError:
-        print(f'❌ Invalid response: {result.stdout}')
+    send_document(fanout, md_file, title, html, states, manifests, terms, force)
+    return True
+
+def publish_directory_to(fanout, target, manifests=None, force=False, terms=None):
+    """Publish every markdown file in a directory or glob to every target of fanout
+    
+    Each document is converted once, and its HTML queued on all targets.
+    Returns the results of publish_files(), which only cover conversion:
+    what the targets made of the documents is in fanout.outcomes.
+    """
+    
+    paths = find_markdown(target)
+    if not paths:
+        print(f"❌ No markdown files match: {target}")
+        return []
+    
+    names = ', '.join(target.name for target in fanout.targets)
+    print(f"📚 Publishing {len(paths)} files → {names}")
+    
+    states = {}
+    
+    def skip(path):
+        states[path] = target_states(path, fanout, manifests, terms, force)
+        if any(changed for changed, _, _, _ in states[path].values()):
+            return False
+        # Unchanged everywhere: only reported
+        send_document(fanout, path, None, None, states[path], manifests, terms, force)
+        return True
+    
+    def publish(path, title, html):
+        # The targets send it from their own pools while the next
+        # documents are converted
+        send_document(fanout, path, title, html, states[path], manifests, terms, force)
+        return {'action': 'queued'}
+    
+    results = publish_files(paths, publish, concurrency=1, rate=0, skip=skip,
+                            cache_path=RENDER_CACHE_PATH or None, budget=BUDGET,
+                            highlight=HIGHLIGHT)
+    for result in results:
+        if not result['ok']:
+            print(f"   ❌ {result['path']}: {result.get('error', 'failed')}")
+    return results
+
+def fan_out(args, parser):
+    """Publish args.target to the sites named by --targets; returns whether all went well"""
+    
+    names = None
+    if args.targets != 'all':
+        names = [name.strip() for name in args.targets.split(',') if name.strip()]
+    try:
+        chosen = targets.load_targets(args.targets_file, names, args.rate, args.concurrency)
+    except (OSError, ValueError) as e:
+        print(f"❌ Cannot load targets: {e}")
+        return False
+    bulk = is_bulk_target(args.target)
+    if bulk and args.title:
+        parser.error('a title can only be given for a single file')
+    if not bulk and not os.path.exists(args.target):
+        print(f"❌ File not found: {args.target}")
         return False
+    
+    # Each target has its own post ids in the manifest, and its own terms
+    fanout = targets.Fanout(chosen)
+    started = time.perf_counter()
+    manifests = {}
+    terms = {}
+    for target in chosen:
+        manifests[target.name] = None if args.no_manifest else Manifest(args.manifest,
+                                                                         site=target.url)
+        terms[target.name] = {'category_id': 1, 'tags': None}
+        with publishing_to(target):
+            try:
+                terms[target.name]['category_id'], terms[target.name]['tags'] = resolve_terms(
+                    args.category, args.tags)
+            except WordPressError as e:
+                # Reported as failed for every document; the others go on
+                fanout.stopped[target.name].append(f'could not resolve categories and tags: {e}')
+    try:
+        if bulk:
+            results = publish_directory_to(fanout, args.target, manifests, args.force, terms)
+            ok = bool(results) and all(result['ok'] for result in results)
+        else:
+            ok = publish_file_to(fanout, args.target, args.title, manifests, args.force, terms)
+    finally:
+        fanout.close()
+    targets.print_report(fanout, time.perf_counter() - started)
+    print_media_summary()
+    return ok and all(outcome['ok'] for outcomes in fanout.outcomes.values()
+                      for outcome in outcomes)
+
+def resolve_terms(category=None, tags=None):
+    """Return (category_id, tag_ids) for category and tag names, slugs or ids
+    
+    Terms are looked up in the cached taxonomy and missing ones created.
+    """
+    
+    def term(value):
+        return int(value) if value.isdigit() else value
+    
+    resolver = get_taxonomy()
+    category_id = resolver.resolve('categories', [term(category)])[0] if category else 1
+    tag_ids = resolver.resolve('tags', [term(tag) for tag in tags]) if tags else None
+    return category_id, tag_ids
+
+def watch(target, title=None, manifest=None, debounce=0.5, category_id=1, tags=None):
+    """Republish markdown files under target whenever they are saved"""
+    
+    root = target if os.path.isdir(target) else os.path.dirname(os.path.abspath(target))
+    only = None if os.path.isdir(target) else os.path.abspath(target)
+    
+    # Without a manifest, keep one for this session so that repeated saves
+    # update the same post
+    manifest = manifest or Manifest(':memory:', site=WP_URL)
+    
+    print(f"👀 Watching {target} for changes (Ctrl-C to stop)")
+    
+    def accept(path):
+        return is_markdown(path) if only is None else os.path.abspath(path) == only
+    
+    try:
+        for paths in watch_changes(root, debounce=debounce, accept=accept):
+            for path in paths:
+                print()
+                publish_file(path, title, manifest, incremental=True,
+                             category_id=category_id, tags=tags)
+    except KeyboardInterrupt:
+        print("\n👋 Stopped watching")
+
+def build(target, output_dir, template=static.PAGE_TEMPLATE, force=False):
+    """Render the markdown files under target to static pages in output_dir"""
+    
+    print(f"🏗️  Building {target} into {output_dir}")
+    started = time.perf_counter()
+    results = static.build_site(target, output_dir, template, force=force,
+                                cache_path=RENDER_CACHE_PATH or None, budget=BUDGET,
+                                highlight=HIGHLIGHT)
+    static.print_summary(results, time.perf_counter() - started)
+    return results
+
+def serve(address, manifest=None, concurrency=4, rate=2.0):
+    """Answer publish, render and status requests until interrupted
+    
+    See wptools.service for the protocol; wp-client.py sends the requests.
+    """
+    
+    # Requests for the same file wait for each other, so a burst of them
+    # cannot create the post twice
+    path_locks = {}
+    path_locks_lock = threading.Lock()
+    # Bulk requests convert in threads: forking converter processes from
+    # the server's request threads could copy a lock another thread holds
+    converters = ThreadPoolExecutor(max_workers=os.cpu_count())
+    
+    def publish(path, title=None, force=False, category=None, tags=None):
+        if not os.path.exists(path) and not is_bulk_target(path):
+            raise RequestError(f'file not found: {path}', 404)
+        if title and is_bulk_target(path):
+            raise RequestError('a title can only be given for a single file')
+        try:
+            terms = {}
+            if category is not None or tags:
+                terms['category_id'], terms['tags'] = resolve_terms(
+                    None if category is None else str(category), [str(tag) for tag in tags or ()])
+            if is_bulk_target(path):
+                if not find_markdown(path):
+                    raise RequestError(f'no markdown files matched: {path}', 404)
+                results = publish_directory(path, concurrency, rate, manifest, force,
+                                            converters=converters, **terms)
+                return {'ok': bool(results) and all(result['ok'] for result in results),
+                        'results': results}
+            with path_locks_lock:
+                lock = path_locks.setdefault(os.path.abspath(path), threading.Lock())
+            with lock:
+                result = publish_document(path, title, manifest, force, incremental=True, **terms)
+        except (WordPressError, BudgetExceeded) as e:
+            return {'ok': False, 'error': str(e)}
+        return dict(result, ok=True)
+    
+    def render(markdown=None, path=None, title=None):
+        if (markdown is None) == (path is None):
+            raise RequestError('give either markdown or path')
+        if path is not None:
+            try:
+                with open(path, 'r') as f:
+                    markdown = f.read()
+            except OSError as e:
+                raise RequestError(str(e), 404)
+        title, skip_first_h1 = document_title(path or '', markdown.split('\n', 1)[0], title)
+        try:
+            html = render_markdown(markdown, skip_first_h1=skip_first_h1)
+        except BudgetExceeded as e:
+            return {'ok': False, 'error': str(e)}
+        return {'ok': True, 'title': title, 'html': html}
+    
+    def status():
+        client = get_client()
+        render_cache = get_render_cache()
+        return {
+            'site': WP_URL,
+            'converter': converter_version(HIGHLIGHT),
+            'concurrency_limit': round(client.limiter.limit, 2),
+            'circuit': 'open' if client.breaker.is_open else 'closed',
+            'render_cache': render_cache.summary() if render_cache else None,
+        }
+    
+    try:
+        server = make_server({'publish': publish, 'render': render, 'status': status}, address)
+    except (OSError, ValueError) as e:
+        print(f"❌ Cannot listen on {address}: {e}")
+        sys.exit(1)
+    # Warm up the converter and the connection before the first request
+    render_markdown('# Warm-up\n\n*text* `code` [link](x)')
+    print(f"🛰️  Serving on {describe(server)} for {WP_URL} (Ctrl-C to stop)")
+    # Stop the same way on SIGTERM (systemd, docker stop), removing the socket
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Stopped serving")
+    finally:
+        server.server_close()
+        converters.shutdown(cancel_futures=True)
 
 def main():
     """Main function to post markdown files"""
     
-    if len(sys.argv) < 2:
-        print("Usage: wp-publisher.py <markdown-file> [title]")
-        print("Example: wp-publisher.py TMUX-SETUP.md 'TMUX Guide'")
+    parser = argparse.ArgumentParser(
+        description='Publish markdown files to WordPress',
+        epilog="Example: wp-publisher.py TMUX-SETUP.md 'TMUX Guide'\n"
+               "         wp-publisher.py documentation/guides --concurrency 8",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('target', nargs='?',
+                        help='markdown file, directory or glob (quote globs)')
+    parser.add_argument('title', nargs='?', help='post title (single file only)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='parallel uploads in bulk mode (default: 4)')
+    parser.add_argument('--rate', type=float, default=2.0,
+                        help='maximum posts per second in bulk mode, 0 for no limit (default: 2)')
+    parser.add_argument('--retries', type=int, default=RETRIES,
+                        help='retries per request after 429/503 answers and timeouts, with '
+                             f'backoff (default: $WP_RETRIES or {RETRIES})')
+    parser.add_argument('--gzip', action='store_true',
+                        help='gzip request bodies (server must accept Content-Encoding: gzip)')
+    parser.add_argument('--manifest', default=MANIFEST_PATH,
+                        help=f'publish manifest (default: $WP_MANIFEST or {DEFAULT_PATH})')
+    parser.add_argument('--no-manifest', action='store_true',
+                        help='always create new posts and record nothing')
+    parser.add_argument('--force', action='store_true',
+                        help='publish even if a file is unchanged since the last run')
+    parser.add_argument('--highlight', action='store_true',
+                        help='syntax-highlight fenced code when converting (needs Pygments; '
+                             'print the CSS with python3 -m wptools.highlight) ($WP_HIGHLIGHT=1)')
+    parser.add_argument('--page-size', type=float, default=0,
+                        help='split posts with more than this many KB of HTML at H2 headings '
+                             '(default: 0, never)')
+    parser.add_argument('--page-blocks', type=int, default=0,
+                        help='split posts with more than this many top-level blocks at H2 '
+                             'headings (default: 0, never)')
+    parser.add_argument('--series', action='store_true',
+                        help='publish the pages of a split post as linked posts instead of '
+                             '<!--nextpage--> pages of one post')
+    parser.add_argument('--no-render-cache', action='store_true',
+                        help='always convert markdown instead of reusing cached HTML')
+    parser.add_argument('--no-images', action='store_true',
+                        help='leave local image references as they are instead of uploading '
+                             'the images to the media library')
+    parser.add_argument('--max-image-width', type=int, default=MAX_IMAGE_WIDTH,
+                        help='scale wider images down to this many pixels before uploading '
+                             '(needs Pillow; default: 0, keep them as they are)')
+    parser.add_argument('--image-quality', type=int, default=IMAGE_QUALITY,
+                        help=f'JPEG/WebP quality for scaled images (default: {IMAGE_QUALITY})')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and republish files as they are saved')
+    parser.add_argument('--debounce', type=float, default=0.5,
+                        help='seconds without further saves before publishing in watch mode')
+    parser.add_argument('--build', metavar='OUTDIR',
+                        help='render a directory to static HTML pages in OUTDIR instead of '
+                             'publishing (only changed files are rebuilt)')
+    parser.add_argument('--template',
+                        help='page template for --build, with $title and $content')
+    parser.add_argument('--serve', nargs='?', const=DEFAULT_SOCKET, metavar='ADDRESS',
+                        help='run as a resident service on a Unix socket (default: '
+                             f'{DEFAULT_SOCKET}) or a loopback host:port; see wp-client.py')
+    parser.add_argument('--queue', action='store_true',
+                        help='publish through the durable job queue: running the command again '
+                             'after a crash resumes where it stopped (without a target: only '
+                             'resume)')
+    parser.add_argument('--queue-file', default=QUEUE_PATH,
+                        help='job queue for --queue (default: $WP_QUEUE or '
+                             f'{jobqueue.DEFAULT_PATH})')
+    parser.add_argument('--targets', metavar='NAMES',
+                        help='publish to these comma-separated sites of the target file ("all" '
+                             'for every one) instead of WP_URL, converting each document once')
+    parser.add_argument('--targets-file', default=TARGETS_PATH,
+                        help=f'target file for --targets (default: $WP_TARGETS or '
+                             f'{targets.DEFAULT_PATH}); see wptools.targets')
+    parser.add_argument('--category',
+                        help='category name, slug or id, created if missing (default: 1)')
+    parser.add_argument('--tags', type=lambda value: [tag.strip() for tag in value.split(',')
+                                                      if tag.strip()],
+                        help='comma-separated tag names, slugs or ids, created if missing')
+    parser.add_argument('--max-size', type=float, default=MAX_DOCUMENT_SIZE / 2**20,
+                        help='refuse documents larger than this many MB of text, 0 for no limit '
+                             f'(default: {MAX_DOCUMENT_SIZE / 2**20:g})')
+    parser.add_argument('--time-budget', type=float, default=MAX_CONVERT_SECONDS,
+                        help='stop converting a document after this many seconds, 0 for no '
+                             f'limit (default: {MAX_CONVERT_SECONDS:g})')
+    parser.add_argument('--timings', action='store_true',
+                        help='print time spent per stage (conversion, requests, ...) at the end')
+    parser.add_argument('--metrics-textfile', default=os.environ.get('WP_METRICS_TEXTFILE'),
+                        help='write a Prometheus textfile at the end ($WP_METRICS_TEXTFILE)')
+    args = parser.parse_args()
+    
+    try:
+        # WP_PROFILE=cprofile,tracemalloc profiles the whole run
+        with profiling():
+            run(args, parser)
+    finally:
+        if args.timings:
+            print('\n⏱️  Timings')
+            for line in METRICS.summary():
+                print(f'   {line}')
+        if args.metrics_textfile:
+            METRICS.write_textfile(args.metrics_textfile)
+
+def run(args, parser):
+    """Publish according to the parsed command line"""
+    
+    global GZIP_REQUESTS, RENDER_CACHE_PATH, BUDGET, RETRIES, UPLOAD_IMAGES, MAX_IMAGE_WIDTH
+    global IMAGE_QUALITY, HIGHLIGHT, PAGE_BYTES, PAGE_BLOCKS, SERIES
+    RETRIES = max(0, args.retries)
+    if args.gzip:
+        GZIP_REQUESTS = True
+    if args.no_render_cache:
+        RENDER_CACHE_PATH = ''
+    if args.highlight:
+        HIGHLIGHT = True
+    if HIGHLIGHT and highlight.version() is None:
+        print("⚠️  Pygments is not installed: code blocks are not highlighted")
+        HIGHLIGHT = False
+    BUDGET = Budget(int(args.max_size * 2**20), args.time_budget)
+    PAGE_BYTES = max(0, int(args.page_size * 1024))
+    PAGE_BLOCKS = max(0, args.page_blocks)
+    SERIES = args.series
+    if SERIES and not (PAGE_BYTES or PAGE_BLOCKS):
+        parser.error('--series needs --page-size or --page-blocks')
+    UPLOAD_IMAGES = not args.no_images
+    MAX_IMAGE_WIDTH = max(0, args.max_image_width)
+    IMAGE_QUALITY = args.image_quality
+    if MAX_IMAGE_WIDTH and media.Image is None:
+        print("⚠️  Pillow is not installed: images are uploaded without resizing")
+    
+    if args.build:
+        if not args.target or not os.path.isdir(args.target):
+            parser.error('--build needs a directory to build')
+        template = static.PAGE_TEMPLATE
+        if args.template:
+            with open(args.template, 'r') as f:
+                template = f.read()
+        results = build(args.target, args.build, template, args.force)
+        sys.exit(0 if all(result['ok'] for result in results) else 1)
+    
+    if args.targets:
+        if args.serve or args.watch or args.queue:
+            parser.error('--targets cannot be combined with --serve, --watch or --queue')
+        if not args.target:
+            parser.error('a target is required')
+        sys.exit(0 if fan_out(args, parser) else 1)
+    
+    manifest = None if args.no_manifest else Manifest(args.manifest, site=WP_URL)
+    
+    if args.serve:
+        if args.target:
+            parser.error('--serve takes no target; send files with wp-client.py')
+        serve(args.serve, manifest, args.concurrency, args.rate)
+        return
+    if args.queue:
+        sys.exit(0 if publish_queued(args, parser, manifest) else 1)
+    if not args.target:
+        parser.error('a target is required')
+    
+    try:
+        category_id, tag_ids = resolve_terms(args.category, args.tags)
+    except WordPressError as e:
+        print(f"❌ Could not resolve categories and tags: {e}")
         sys.exit(1)
+    terms = {'category_id': category_id, 'tags': tag_ids}
+    
+    if args.watch:
+        if not os.path.exists(args.target):
+            parser.error('--watch needs an existing file or directory')
+        if args.title and os.path.isdir(args.target):
+            parser.error('a title can only be given for a single file')
+        watch(args.target, args.title, manifest, args.debounce, **terms)
+        return
     
-    md_file = sys.argv[1]
+    if is_bulk_target(args.target):
+        if args.title:
+            parser.error('a title can only be given for a single file')
+        results = publish_directory(args.target, args.concurrency, args.rate, manifest, args.force,
+                                    **terms)
+        sys.exit(0 if results and all(result['ok'] for result in results) else 1)
+    
+    md_file = args.target
     
     if not os.path.exists(md_file):
         print(f"❌ File not found: {md_file}")
         sys.exit(1)
     
-    # Get title from argument or file name
-    if len(sys.argv) > 2:
-        title = sys.argv[2]
-    else:
-        # Use first heading or filename
-        with open(md_file, 'r') as f:
-            first_line = f.readline().strip()
-            if first_line.startswith('#'):
-                title = first_line.lstrip('#').strip()
-            else:
-                title = Path(md_file).stem.replace('-', ' ').title()
-    
-    # Read content
-    with open(md_file, 'r') as f:
-        content = f.read()
-    
-    print(f"📝 Publishing: {title}")
-    print(f"📄 From file: {md_file}")
-    
-    # Create post
-    create_post(title, content)
+    if not publish_file(md_file, args.title, manifest, args.force, **terms):
+        sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
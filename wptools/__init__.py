@@ -0,0 +1,7 @@
+"""
+Shared helpers for the WordPress publishing scripts
+"""
+
+from wptools.markdown import CONVERTER_VERSION, markdown_to_html
+
+__all__ = ['CONVERTER_VERSION', 'markdown_to_html']
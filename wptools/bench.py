@@ -0,0 +1,318 @@
+"""
+Benchmark the markdown converters
+
+Runs wptools.markdown and the archived WordPressPublisher converter over
+the markdown under documentation/ and docker-stack-infrastructure/docs/,
+plus synthetic worst cases (a 10k-row table, deeply nested lists, a huge
+code fence) and an adversarial corpus of unclosed delimiters.  Reports
+throughput, per-document latency percentiles and peak memory, and compares
+the results with a saved baseline.  --adversarial checks instead that
+conversion time grows linearly with the size of each adversarial input.
+
+    python3 -m wptools.bench --output bench.json
+    python3 -m wptools.bench --compare bench.json
+    python3 -m wptools.bench --adversarial
+"""
+
+import argparse
+import importlib.util
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+from wptools.markdown import CONVERTER_VERSION, markdown_to_html
+
+ROOT = Path(__file__).resolve().parents[1]
+CORPUS_DIRS = ('documentation', 'docker-stack-infrastructure/docs')
+ARCHIVED_PUBLISHER = ROOT / 'archives' / 'wordpress' / 'wordpress-publisher.py'
+
+# A result counts as a regression when it is this much worse than baseline
+DEFAULT_TOLERANCE = 0.15
+
+# Inputs that make a backtracking converter rescan the rest of the document
+# from every unclosed delimiter, as (name, unit repeated to fill the input)
+ADVERSARIAL_PATTERNS = (
+    ('open-brackets', '['),
+    ('unclosed-links', '[a](b '),
+    ('unclosed-images', '![a](b '),
+    ('open-stars', '*a '),
+    ('italic-bold-chain', '*a**b**'),
+    ('open-underscores', '__a_'),
+    ('open-backticks', 'a`'),
+    ('inline-fences', 'a```\n'),
+    ('fence-per-line', '```\n'),
+    ('open-tags', '<'),
+    ('tags-and-blank-lines', '<a>\n\n'),
+    ('separator-rows', '|-|\n'),
+    ('table-headers', '| a |\n\n'),
+    ('deep-indentation', ' ' * 64 + '- x\n'),
+)
+
+# Input sizes for the linearity check, and the allowed growth of the time
+# taken relative to the growth of the input
+LINEARITY_SIZES = (50000, 200000)
+LINEARITY_SLACK = 2.0
+
+
+def synthetic_documents():
+    """Large generated inputs that stress one construct each"""
+    rows = '\n'.join(f'| {i} | name-{i} | **{i % 7}** | `v{i}` | [x](#{i}) |' for i in range(10000))
+    table = f'# Big table\n\n| id | name | bold | code | link |\n|---|---|---|---|---|\n{rows}\n'
+
+    items = []
+    for i in range(2000):
+        depth = i % 8
+        marker = f'{i}.' if depth % 2 else '-'
+        items.append(f"{'  ' * depth}{marker} item {i} with *emphasis* and `code`")
+    nested = '# Nested lists\n\n' + '\n'.join(items) + '\n'
+
+    code = '\n'.join(f'    line_{i} = "<tag>" * {i}  # **not bold** | not | a table |'
+                     for i in range(100000))
+    fence = f'# Huge fence\n\n```python\n{code}\n```\n\nAfter the fence.\n'
+
+    documents = {'synthetic/table-10k-rows.md': table,
+                 'synthetic/nested-lists.md': nested,
+                 'synthetic/huge-code-fence.md': fence}
+    documents.update(adversarial_documents(100000))
+    return documents
+
+
+def adversarial_documents(size):
+    """One input of size characters per adversarial pattern"""
+    return {f'adversarial/{name}.md': (unit * (size // len(unit) + 1))[:size]
+            for name, unit in ADVERSARIAL_PATTERNS}
+
+
+def load_corpus(root=ROOT, synthetic=True):
+    """Return {name: markdown} for the repository corpus and synthetic inputs"""
+    documents = {}
+    for directory in CORPUS_DIRS:
+        for path in sorted((root / directory).rglob('*.md')):
+            documents[str(path.relative_to(root))] = path.read_text(errors='replace')
+    if synthetic:
+        documents.update(synthetic_documents())
+    return documents
+
+
+def load_converters():
+    """Return ({name: convert(markdown)}, {name: reason unavailable})"""
+    converters = {'wptools': markdown_to_html}
+    unavailable = {}
+    try:
+        spec = importlib.util.spec_from_file_location('wordpress_publisher', ARCHIVED_PUBLISHER)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except Exception as e:
+        unavailable['archive'] = str(e)
+    else:
+        # The uncached converter, on an instance that opens no caches or connections
+        publisher = object.__new__(module.WordPressPublisher)
+        converters['archive'] = publisher._convert_markdown
+    return converters, unavailable
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(per_document):
+    """Throughput, latency percentiles and peak memory over documents"""
+    latencies = [doc['seconds'] * 1000 for doc in per_document.values()]
+    total_bytes = sum(doc['bytes'] for doc in per_document.values())
+    total_seconds = sum(doc['seconds'] for doc in per_document.values())
+    return {
+        'documents': len(per_document),
+        'bytes': total_bytes,
+        'seconds': total_seconds,
+        'mb_per_s': total_bytes / total_seconds / 1e6 if total_seconds else 0.0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p90_ms': percentile(latencies, 0.90),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': max(latencies, default=0.0),
+        'peak_bytes': max((doc['peak_bytes'] for doc in per_document.values()), default=0),
+    }
+
+
+def measure(convert, documents, repeat=3):
+    """Time and trace convert() over every document"""
+    per_document = {}
+    for name, text in documents.items():
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            convert(text)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        # Memory is traced in a separate run, tracing slows conversion down
+        tracemalloc.start()
+        convert(text)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        per_document[name] = {'bytes': len(text.encode('utf-8')), 'seconds': best,
+                              'peak_bytes': peak}
+
+    return {'summary': summarize(per_document), 'documents': per_document}
+
+
+def run(names=None, repeat=3, synthetic=True):
+    """Benchmark the selected converters and return the results document"""
+    documents = load_corpus(synthetic=synthetic)
+    converters, unavailable = load_converters()
+    results = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'converter_version': CONVERTER_VERSION,
+            'repeat': repeat,
+        },
+        'converters': {},
+        'unavailable': unavailable,
+    }
+    for name, convert in converters.items():
+        if names and name not in names:
+            continue
+        print(f"⏱️  {name}: {len(documents)} documents")
+        results['converters'][name] = measure(convert, documents, repeat)
+    return results
+
+
+def check_linearity(convert, sizes=LINEARITY_SIZES, slack=LINEARITY_SLACK):
+    """Time convert() on each adversarial pattern at two sizes
+
+    Returns {pattern: (small seconds, large seconds, ok)}; ok is false when
+    the time grew more than slack times faster than the input did.
+    """
+    small, large = (adversarial_documents(size) for size in sizes)
+    growth = sizes[1] / sizes[0]
+    results = {}
+    for name, _ in ADVERSARIAL_PATTERNS:
+        key = f'adversarial/{name}.md'
+        timings = []
+        for text in (small[key], large[key]):
+            best = None
+            for _ in range(3):
+                started = time.perf_counter()
+                convert(text)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+        # Times under 10 ms are mostly noise
+        ok = timings[1] < 0.01 or timings[1] <= timings[0] * growth * slack
+        results[name] = (timings[0], timings[1], ok)
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return a list of regressions of results against baseline
+
+    Only documents present in both are compared.
+    """
+    regressions = []
+    for name, current in results['converters'].items():
+        previous = baseline.get('converters', {}).get(name)
+        if previous is None:
+            continue
+        common = current['documents'].keys() & previous['documents'].keys()
+        now = summarize({doc: current['documents'][doc] for doc in common})
+        then = summarize({doc: previous['documents'][doc] for doc in common})
+        if then['mb_per_s'] and now['mb_per_s'] < then['mb_per_s'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {now['mb_per_s']:.2f} MB/s "
+                               f"(baseline {then['mb_per_s']:.2f})")
+        for key in ('p50_ms', 'p90_ms', 'p99_ms'):
+            if then[key] and now[key] > then[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {now[key]:.2f} (baseline {then[key]:.2f})")
+        if then['peak_bytes'] and now['peak_bytes'] > then['peak_bytes'] * (1 + tolerance):
+            regressions.append(f"{name}: peak memory {now['peak_bytes']} B "
+                               f"(baseline {then['peak_bytes']} B)")
+        for doc, timing in current['documents'].items():
+            old = previous['documents'].get(doc)
+            # Short documents are too noisy to judge one by one
+            if old and old['seconds'] > 0.01 and \
+                    timing['seconds'] > old['seconds'] * (1 + 2 * tolerance):
+                regressions.append(f"{name}: {doc} {timing['seconds'] * 1000:.1f} ms "
+                                   f"(baseline {old['seconds'] * 1000:.1f} ms)")
+    return regressions
+
+
+def print_report(results):
+    print('\n📊 Converter benchmark')
+    for name, reason in results['unavailable'].items():
+        print(f"   ⚠️  {name} skipped: {reason}")
+    for name, result in results['converters'].items():
+        s = result['summary']
+        print(f"   {name:<8} {s['mb_per_s']:8.2f} MB/s   p50 {s['p50_ms']:.2f} ms   "
+              f"p90 {s['p90_ms']:.2f} ms   p99 {s['p99_ms']:.2f} ms   "
+              f"peak {s['peak_bytes'] / 1e6:.1f} MB")
+        slowest = sorted(result['documents'].items(), key=lambda item: -item[1]['seconds'])[:3]
+        for doc, timing in slowest:
+            print(f"            {timing['seconds'] * 1000:9.1f} ms  {doc}")
+
+
+def run_linearity(names=None):
+    """Print the linearity check for the selected converters, True if all pass"""
+    converters, unavailable = load_converters()
+    for name, reason in unavailable.items():
+        print(f"⚠️  {name} skipped: {reason}")
+    passed = True
+    for name, convert in converters.items():
+        if names and name not in names:
+            continue
+        print(f"\n📈 {name}: time at {LINEARITY_SIZES[0]} and {LINEARITY_SIZES[1]} characters")
+        for pattern, (small, large, ok) in check_linearity(convert).items():
+            passed = passed and ok
+            print(f"   {'✅' if ok else '❌'} {pattern:<22} {small * 1000:8.1f} ms  "
+                  f"{large * 1000:8.1f} ms  x{large / small if small else 0:.1f}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the markdown converters')
+    parser.add_argument('--converter', action='append', choices=('wptools', 'archive'),
+                        help='only run this converter (repeatable)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per document, the fastest counts (default: 3)')
+    parser.add_argument('--no-synthetic', action='store_true',
+                        help='only use the repository corpus')
+    parser.add_argument('--adversarial', action='store_true',
+                        help='only check that adversarial inputs convert in linear time')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='fail if results regress against this results file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'allowed slowdown before failing (default: {DEFAULT_TOLERANCE})')
+    args = parser.parse_args()
+
+    if args.adversarial:
+        sys.exit(0 if run_linearity(args.converter) else 1)
+
+    results = run(args.converter, args.repeat, synthetic=not args.no_synthetic)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regressions against {args.compare}:")
+            for regression in regressions:
+                print(f"   - {regression}")
+            sys.exit(1)
+        print(f"\n✅ No regressions against {args.compare}")
+
+
+if __name__ == '__main__':
+    main()
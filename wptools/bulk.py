@@ -0,0 +1,221 @@
+"""
+Bulk publishing: parallel conversion and a rate-limited upload pool
+
+Markdown files are converted in a process pool (conversion is CPU-bound)
+and handed to a bounded thread pool for upload.  Uploads share a
+token-bucket limiter, so the API sees a steady request rate without the
+fixed sleep between posts.
+"""
+
+import contextlib
+import glob
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from wptools.cache import RenderCache, markdown_hash, render_key
+from wptools.client import CircuitOpen
+from wptools.markdown import converter_version, document_title, markdown_to_html
+from wptools.metrics import METRICS
+from wptools.paginate import format_sizes
+
+
+class TokenBucket:
+    """Token-bucket rate limiter shared between worker threads
+
+    Allows bursts of up to `burst` calls, refilled at `rate` tokens per
+    second.  A rate of 0 or less disables limiting.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def find_markdown(target):
+    """Expand a file, directory or glob pattern into markdown paths"""
+    if os.path.isdir(target):
+        return sorted(str(p) for p in Path(target).rglob('*.md'))
+    if glob.has_magic(target):
+        return sorted(p for p in glob.glob(target, recursive=True) if os.path.isfile(p))
+    return [target] if os.path.isfile(target) else []
+
+
+def is_bulk_target(target):
+    """True when target names a directory or glob rather than one file"""
+    return os.path.isdir(target) or glob.has_magic(target)
+
+
+# Render caches opened by this (worker) process, by path
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def render_document(path, cache_path=None, budget=None, highlight=False):
+    """Read and convert one markdown file
+
+    Returns (title, html, cached, seconds): cached tells whether the HTML
+    came from the render cache at cache_path (None when no cache is used),
+    seconds is the time spent converting.  highlight turns on syntax
+    highlighting.  Raises BudgetExceeded when the document is over budget.
+    """
+    with open(path, 'r') as f:
+        content = f.read()
+    title, skip_first_h1 = document_title(path, content.split('\n', 1)[0])
+    cache = None
+    if cache_path is not None:
+        with _caches_lock:
+            if cache_path not in _caches:
+                _caches[cache_path] = RenderCache(cache_path)
+            cache = _caches[cache_path]
+        key = render_key(markdown_hash(content), converter_version(highlight),
+                         skip_first_h1=skip_first_h1)
+        html = cache.get(key)
+        if html is not None:
+            return title, html, True, 0.0
+    started = time.perf_counter()
+    html = markdown_to_html(content, skip_first_h1=skip_first_h1, budget=budget,
+                            highlight=highlight)
+    seconds = time.perf_counter() - started
+    if cache is not None:
+        cache.put(key, html)
+    return title, html, None if cache is None else False, seconds
+
+
+def _upload(publish, limiter, stopped, path, title, html, cached):
+    if stopped:
+        return {'path': path, 'title': title, 'ok': False, 'error': f'skipped, {stopped[0]}',
+                'cached': cached, 'seconds': 0.0}
+    limiter.acquire()
+    started = time.monotonic()
+    try:
+        post = publish(path, title, html)
+    except Exception as e:
+        if isinstance(e, CircuitOpen):
+            # The site is down: give up on the rest of the run
+            stopped.append(str(e))
+        return {'path': path, 'title': title, 'ok': False, 'error': str(e), 'cached': cached,
+                'seconds': time.monotonic() - started}
+    return {'path': path, 'title': title, 'ok': True, 'id': post.get('id'),
+            'link': post.get('link'), 'action': post.get('action', 'created'),
+            'pages': post.get('pages'), 'cached': cached, 'seconds': time.monotonic() - started}
+
+
+def publish_files(paths, publish, concurrency=4, rate=2.0, burst=None, convert_workers=None,
+                  skip=None, cache_path=None, budget=None, highlight=False, converters=None):
+    """Convert paths in parallel and upload them through a bounded pool
+
+    publish(path, title, html) must return the post (a dict with at least
+    'id' and 'link', and optionally 'action') or raise.  Paths for which
+    skip(path) is true are reported as unchanged without being converted.
+    cache_path names a render cache shared by the converter processes and
+    budget (a wptools.markdown.Budget) limits each conversion; documents
+    over budget are reported as failed; highlight turns on syntax
+    highlighting.  Conversions run in a process pool of convert_workers
+    started for the run, or in the converters executor when one is given:
+    threaded callers (the publisher service) pass a thread pool, since
+    forking a threaded process is unsafe.  Once publish raises
+    CircuitOpen the run stops: conversions not yet started are cancelled
+    and the remaining documents are reported as failed without being
+    sent.
+    Returns one result dict per path, in path order.
+    """
+    limiter = TokenBucket(rate, burst or concurrency)
+    stopped = []  # why the run was stopped early
+    results = []
+    uploads = []
+    if skip is not None:
+        pending = []
+        for path in paths:
+            if skip(path):
+                results.append({'path': path, 'title': None, 'ok': True,
+                                'action': 'unchanged', 'seconds': 0.0})
+            else:
+                pending.append(path)
+        paths = pending
+    if not paths:
+        return sorted(results, key=lambda result: result['path'])
+    if converters is None:
+        # Forked converter processes flush the stdio buffers they inherit
+        # when they exit: empty them first so buffered output is not repeated
+        sys.stdout.flush()
+        sys.stderr.flush()
+        converter_pool = ProcessPoolExecutor(convert_workers)
+    else:
+        converter_pool = contextlib.nullcontext(converters)
+    with converter_pool as converters, \
+            ThreadPoolExecutor(max_workers=concurrency) as uploaders:
+        conversions = {converters.submit(render_document, path, cache_path, budget,
+                                         highlight): path for path in paths}
+        # Start each upload as soon as its conversion finishes
+        for future in as_completed(conversions):
+            path = conversions[future]
+            if stopped:
+                for pending in conversions:
+                    pending.cancel()
+                results.append({'path': path, 'title': None, 'ok': False,
+                                'error': f'skipped, {stopped[0]}', 'seconds': 0.0})
+                continue
+            try:
+                title, html, cached, seconds = future.result()
+            except Exception as e:
+                results.append({'path': path, 'title': None, 'ok': False,
+                                'error': f'conversion failed: {e}', 'seconds': 0.0})
+                continue
+            if not cached:
+                # Converted in a worker: record it here
+                METRICS.observe('convert', seconds)
+            uploads.append(uploaders.submit(_upload, publish, limiter, stopped, path, title, html,
+                                            cached))
+        for future in uploads:
+            results.append(future.result())
+    return sorted(results, key=lambda result: result['path'])
+
+
+ACTION_ICONS = {'created': '✅', 'updated': '🔄', 'unchanged': '⏭️ '}
+
+
+def print_summary(results):
+    """Print one line per file and the totals"""
+    print('\n📊 Summary')
+    counts = {}
+    for result in results:
+        if result['ok']:
+            action = result.get('action', 'created')
+            counts[action] = counts.get(action, 0) + 1
+            detail = result.get('link') or ''
+            if result.get('pages'):
+                detail += f" [{format_sizes(result['pages'])}]"
+            print(f"   {ACTION_ICONS.get(action, '✅')} {result['path']} "
+                  f"({result['seconds']:.2f}s) {detail}".rstrip())
+        else:
+            print(f"   ❌ {result['path']}: {result.get('error', 'failed')}")
+    ok = sum(1 for result in results if result['ok'])
+    breakdown = ', '.join(f'{count} {action}' for action, count in sorted(counts.items()))
+    print(f'\n✅ Published {ok} of {len(results)} documents'
+          + (f' ({breakdown})' if breakdown else ''))
+    lookups = [result['cached'] for result in results if result.get('cached') is not None]
+    if lookups:
+        hits = sum(lookups)
+        print(f'🗃️  Render cache: {hits} hits, {len(lookups) - hits} misses')
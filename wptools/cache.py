@@ -0,0 +1,131 @@
+"""
+Render cache: converted HTML kept on disk between runs
+
+Entries are keyed by a hash of the markdown, the conversion options and
+the converter version, so a converter change never serves stale HTML.
+The cache is one SQLite file holding at most max_bytes of HTML; the
+least recently used entries are evicted first.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.path.expanduser('~/.cache/wp-publisher/render.sqlite')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Streamed documents up to this size are cached as they pass through tee();
+# larger ones are not, so that streaming never holds a whole document
+TEE_MAX_BYTES = 1024 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS renders (
+    key TEXT PRIMARY KEY,
+    html TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used_at REAL NOT NULL
+)
+'''
+
+
+def markdown_hash(markdown):
+    """SHA-256 of markdown text (equal to the hash of its UTF-8 file)"""
+    return hashlib.sha256(markdown.encode('utf-8')).hexdigest()
+
+
+def render_key(content_hash, converter_version, **options):
+    """Cache key for markdown with this hash rendered with these options"""
+    options_text = json.dumps(options, sort_keys=True)
+    return hashlib.sha256(
+        f'{converter_version}\0{options_text}\0{content_hash}'.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """Thread-safe, size-bounded LRU cache of rendered HTML
+
+    hits and misses count lookups made through this instance.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Several processes may share the file during a bulk run
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.db:
+            self.db.execute(SCHEMA)
+            self.db.execute('CREATE INDEX IF NOT EXISTS renders_used ON renders (used_at)')
+
+    def get(self, key):
+        """Return the cached HTML for key, or None"""
+        with self.lock:
+            row = self.db.execute('SELECT html FROM renders WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.db:
+                self.db.execute('UPDATE renders SET used_at = ? WHERE key = ?', (time.time(), key))
+            return row[0]
+
+    def put(self, key, html):
+        """Store HTML under key, evicting old entries beyond max_bytes"""
+        size = len(html.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO renders (key, html, size, used_at)'
+                            ' VALUES (?, ?, ?, ?)', (key, html, size, time.time()))
+            total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM renders').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evict = []
+            for old_key, old_size in self.db.execute(
+                    'SELECT key, size FROM renders WHERE key != ? ORDER BY used_at', (key,)):
+                evict.append((old_key,))
+                total -= old_size
+                if total <= self.max_bytes:
+                    break
+            self.db.executemany('DELETE FROM renders WHERE key = ?', evict)
+
+    def render(self, key, convert):
+        """Return the cached HTML for key, calling convert() on a miss"""
+        html = self.get(key)
+        if html is None:
+            html = convert()
+            self.put(key, html)
+        return html
+
+    def tee(self, key, chunks, max_bytes=TEE_MAX_BYTES):
+        """Pass HTML chunks through, caching the document once complete
+
+        Documents larger than max_bytes (or than the cache) are streamed
+        without being kept or cached.
+        """
+        limit = min(max_bytes, self.max_bytes)
+        kept = []
+        size = 0
+        for chunk in chunks:
+            if kept is not None:
+                size += len(chunk)
+                if size > limit:
+                    kept = None
+                else:
+                    kept.append(chunk)
+            yield chunk
+        if kept is not None:
+            self.put(key, ''.join(kept))
+
+    def summary(self):
+        """One-line hit/miss report"""
+        return f'{self.hits} hits, {self.misses} misses'
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,394 @@
+"""
+WordPress REST API client with pooled keep-alive connections
+
+One client is shared by every request a script makes: connections are
+kept open and reused between requests (and between threads), bodies are
+sent from memory or streamed with chunked transfer encoding, responses
+are requested gzip-compressed and trimmed to the fields the caller reads.
+Transient failures are retried with backoff, the requests in flight adapt
+to how fast the site answers, and a circuit breaker gives up quickly on a
+site that is down (see wptools.retry).  Works against any base URL,
+including a local http:// stand-in.
+"""
+
+import base64
+import gzip
+import http.client
+import json
+import queue
+import select
+import time
+import zlib
+from urllib.parse import quote, urlencode, urlsplit
+
+from wptools.metrics import METRICS
+from wptools.retry import ITEM_PATH_RE, AdaptiveLimiter, CircuitBreaker, RetryPolicy, is_idempotent
+
+# Errors that mean a pooled keep-alive connection was closed by the server
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                ConnectionResetError, BrokenPipeError)
+
+# Streamed bodies are sent in pieces of about this many bytes
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Most requests WordPress accepts in one /batch/v1 call
+BATCH_LIMIT = 25
+
+# Streamed bodies up to this many bytes are kept so that a failed attempt
+# can be sent again; longer ones are sent once, without retries
+REPLAY_LIMIT = 1024 * 1024
+
+
+class WordPressError(Exception):
+    """A request failed or WordPress answered with an error"""
+
+    def __init__(self, message, status=None, data=None):
+        super().__init__(message)
+        self.status = status
+        self.data = data
+
+
+class CircuitOpen(WordPressError):
+    """The request was not sent because the site keeps failing"""
+
+
+def iter_post_json(post_data, html_chunks):
+    """Yield post_data as JSON text with 'content' streamed from html_chunks"""
+    yield json.dumps(post_data)[:-1]
+    yield ', "content": "' if post_data else '"content": "'
+    for chunk in html_chunks:
+        # Encode each chunk as a JSON string and drop the surrounding quotes
+        yield json.dumps(chunk)[1:-1]
+    yield '"}'
+
+
+def _coalesce(pieces, size=STREAM_CHUNK_SIZE):
+    """Group many small text pieces into encoded chunks of about size bytes"""
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        data = piece.encode('utf-8') if isinstance(piece, str) else piece
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _counted(chunks):
+    sent = 0
+    for chunk in chunks:
+        sent += len(chunk)
+        yield chunk
+    METRICS.count('bytes_sent', sent)
+
+
+class _Replay:
+    """A one-shot stream that can be iterated again while it is small
+
+    Pieces are kept as they are sent; a later pass sends them again and
+    then carries on with whatever the first pass did not reach.  Once more
+    than limit bytes went out the kept pieces are dropped and replayable
+    turns False, so a large document is never held in memory whole.
+    """
+
+    def __init__(self, chunks, limit=REPLAY_LIMIT):
+        self.chunks = iter(chunks)
+        self.limit = limit
+        self.sent = []
+        self.size = 0
+        self.replayable = True
+
+    def __iter__(self):
+        if not self.replayable:
+            raise WordPressError('A streamed body over the replay limit cannot be sent again')
+        yield from self.sent[:]
+        for chunk in self.chunks:
+            if self.replayable:
+                self.size += len(chunk)
+                if self.size > self.limit:
+                    self.sent = []
+                    self.replayable = False
+                else:
+                    self.sent.append(chunk)
+            yield chunk
+
+
+def _replayable(payload, streamed):
+    """Whether payload can be sent again after an attempt"""
+    return not streamed or (isinstance(payload, _Replay) and payload.replayable)
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class WordPressClient:
+    """Thread-safe client for one WordPress site
+
+    base_url is the site root (e.g. https://wp.stringbits.com); requests
+    take paths relative to the wp/v2 API, such as '/posts'.  Set
+    gzip_requests to compress request bodies; the server must be set up to
+    inflate them (e.g. Apache's mod_deflate input filter).
+
+    Every attempt goes through retry (a wptools.retry.RetryPolicy), limiter
+    (an AdaptiveLimiter on requests in flight) and breaker (a
+    CircuitBreaker); each defaults to a fresh one with default settings.
+    """
+
+    def __init__(self, base_url, username=None, password=None, pool_size=8,
+                 timeout=60, gzip_requests=False, retry=None, limiter=None, breaker=None):
+        url = urlsplit(base_url)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.rest_path = url.path.rstrip('/') + '/wp-json'
+        self.api_path = self.rest_path + '/wp/v2'
+        self.timeout = timeout
+        self.gzip_requests = gzip_requests
+        self.headers = {
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip',
+            'User-Agent': 'wptools',
+        }
+        if username:
+            token = base64.b64encode(f'{username}:{password}'.encode()).decode()
+            self.headers['Authorization'] = f'Basic {token}'
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        self.retry = retry or RetryPolicy()
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
+
+    # -- connections ---------------------------------------------------------
+
+    def _connect(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self):
+        """Take an idle connection that is still open, or make a new one"""
+        while True:
+            try:
+                conn = self.pool.get_nowait()
+            except queue.Empty:
+                return self._connect(), False
+            # An idle keep-alive socket that is readable has been closed
+            if conn.sock is not None and not select.select([conn.sock], [], [], 0)[0]:
+                return conn, True
+            conn.close()
+
+    def _release(self, conn):
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        """Close every pooled connection"""
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    # -- requests ------------------------------------------------------------
+
+    def url(self, path, params=None, fields=None, namespace=None):
+        """Build the request target for an API path
+
+        Paths are relative to wp/v2 unless another namespace is given.
+        """
+        params = dict(params or {})
+        if fields:
+            params['_fields'] = ','.join(fields)
+        query = f'?{urlencode(params)}' if params else ''
+        base = f'{self.rest_path}/{namespace}' if namespace else self.api_path
+        return f'{base}{path}{query}'
+
+    def request(self, method, path, params=None, body=None, fields=None, headers=None,
+                namespace=None, idempotent=None):
+        """Send a request and return (status, headers, decoded JSON)
+
+        body may be a JSON-serialisable object (sent from memory) or an
+        iterable of str/bytes pieces (streamed with chunked encoding).
+        fields limits the response to those top-level keys.  Raises
+        WordPressError for transport failures, non-JSON answers and
+        non-2xx statuses, once retries are used up, and CircuitOpen while
+        the site is considered down.
+
+        429 and 503 answers are retried; 502, 504 and failures without an
+        answer (timeouts, refused connections) only for requests that are
+        safe to repeat: by default reads, deletes and updates of an
+        existing item, but not creating posts.  A streamed body is only
+        sent again while it is no longer than REPLAY_LIMIT.
+        """
+        target = self.url(path, params, fields, namespace)
+        send_headers = dict(self.headers)
+        if headers:
+            send_headers.update(headers)
+
+        streamed = body is not None and not isinstance(body, (dict, list, str, bytes))
+        if body is None:
+            payload = None
+        elif streamed:
+            # Building a streamed payload overlaps with sending it, so its
+            # time is part of the request stage
+            send_headers['Content-Type'] = 'application/json'
+            payload = _coalesce(body)
+            if self.gzip_requests:
+                send_headers['Content-Encoding'] = 'gzip'
+                payload = _gzip_stream(payload)
+            payload = _counted(payload)
+        else:
+            with METRICS.timer('payload'):
+                # bytes go out as they are, with the caller's Content-Type
+                send_headers.setdefault('Content-Type', 'application/json')
+                payload = body if isinstance(body, bytes) else (
+                    body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+                if self.gzip_requests and send_headers['Content-Type'] == 'application/json':
+                    send_headers['Content-Encoding'] = 'gzip'
+                    payload = gzip.compress(payload)
+            METRICS.count('bytes_sent', len(payload))
+
+        if idempotent is None:
+            idempotent = is_idempotent(method, path)
+        if streamed and self.retry.attempts > 1:
+            # Keep what was sent, up to REPLAY_LIMIT, so a retry can send it again
+            payload = _Replay(payload)
+        attempt = 0
+        while True:
+            attempt += 1
+            closed_for, probe = self.breaker.before()
+            if closed_for is not None:
+                METRICS.count('requests', method=method, status='circuit_open')
+                raise CircuitOpen(f'{self.host} is unavailable: {self.breaker.failures} requests '
+                                  f'failed in a row (next try in {closed_for:.0f}s)')
+            started = self.limiter.acquire()
+            outcome = None
+            try:
+                response, raw = self._send(method, target, payload, send_headers, streamed)
+                if response.status >= 500:
+                    outcome = 'failed'
+                elif response.status == 429:
+                    outcome = 'throttled'
+                else:
+                    outcome = 'ok'
+            except WordPressError:
+                outcome = 'failed'
+                if not (self.retry.retryable(None, idempotent)
+                        and _replayable(payload, streamed)):
+                    raise
+                wait = self.retry.delay(attempt)
+                if wait is None:
+                    raise
+                reason = 'error'
+            else:
+                if not (self.retry.retryable(response.status, idempotent)
+                        and _replayable(payload, streamed)):
+                    break
+                wait = self.retry.delay(attempt, response.getheader('Retry-After'))
+                if wait is None:
+                    break
+                reason = response.status
+            finally:
+                self.limiter.release(started, f'{method} {ITEM_PATH_RE.sub("/<id>", path)}',
+                                     outcome)
+                self.breaker.record(None if outcome is None else outcome != 'failed', probe)
+            METRICS.count('retries', reason=reason)
+            time.sleep(wait)
+
+        parse_started = time.perf_counter()
+        if response.getheader('Content-Encoding') == 'gzip':
+            raw = gzip.decompress(raw)
+        try:
+            data = json.loads(raw) if raw else None
+        except ValueError:
+            raise WordPressError(f'Invalid response: {raw[:500].decode("utf-8", "replace")}',
+                                 response.status)
+        finally:
+            METRICS.observe('parse', time.perf_counter() - parse_started)
+        if not 200 <= response.status < 300:
+            message = data.get('message') if isinstance(data, dict) else None
+            raise WordPressError(message or f'HTTP {response.status}', response.status, data)
+        return response.status, response.headers, data
+
+    def _send(self, method, target, payload, headers, streamed):
+        """Make one attempt; returns (response, raw body)"""
+        # A reused connection may have been closed by the server while idle;
+        # replay once on a fresh one unless the body can't be sent again
+        started = time.perf_counter()
+        for attempt in range(2):
+            conn, reused = self._acquire()
+            try:
+                conn.request(method, target, body=payload, headers=headers,
+                             encode_chunked=streamed)
+                response = conn.getresponse()
+                raw = response.read()
+            except STALE_ERRORS as e:
+                conn.close()
+                if reused and attempt == 0 and _replayable(payload, streamed):
+                    METRICS.count('retries', reason='stale_connection')
+                    continue
+                METRICS.count('requests', method=method, status='error')
+                raise WordPressError(f'{method} {target} failed: {e}') from e
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                METRICS.count('requests', method=method, status='error')
+                raise WordPressError(f'{method} {target} failed: {e}') from e
+            except Exception:
+                # A streamed body failed part way: the request can't be finished
+                conn.close()
+                METRICS.count('requests', method=method, status='error')
+                raise
+            break
+        METRICS.observe('request', time.perf_counter() - started, method=method)
+        METRICS.count('requests', method=method, status=response.status)
+        METRICS.count('bytes_received', len(raw))
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        return response, raw
+
+    def get(self, path, params=None, fields=None):
+        """GET an API path and return the decoded JSON"""
+        return self.request('GET', path, params=params, fields=fields)[2]
+
+    def post(self, path, body, params=None, fields=None):
+        """POST a body to an API path and return the decoded JSON"""
+        return self.request('POST', path, params=params, body=body, fields=fields)[2]
+
+    def upload(self, filename, data, content_type='application/octet-stream',
+               fields=('id', 'source_url')):
+        """Upload file data to the media library and return the media item"""
+        headers = {'Content-Type': content_type,
+                   'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}"}
+        return self.request('POST', '/media', body=data, headers=headers, fields=fields)[2]
+
+    def batch(self, requests):
+        """Send write requests through /batch/v1 in a single round trip
+
+        requests are (method, path, body) tuples with wp/v2 paths, at most
+        BATCH_LIMIT of them.  Returns one (status, body) pair per request;
+        raises WordPressError if the batch itself is refused (a 404 means
+        the site has no batch endpoint, WordPress < 5.6).
+        """
+        payload = {'requests': [
+            {'method': method, 'path': f'/wp/v2{path}', 'body': body}
+            for method, path, body in requests
+        ]}
+        data = self.request('POST', '/v1', body=payload, namespace='batch',
+                            idempotent=all(is_idempotent(method, path)
+                                           for method, path, _ in requests))[2]
+        return [(response.get('status'), response.get('body'))
+                for response in data.get('responses', [])]
@@ -0,0 +1,699 @@
+"""
+Local stand-in for the WordPress REST API
+
+Implements the subset of the API the scripts call (posts, categories,
+tags, media and /batch/v1) over plain HTTP, keeping everything in memory.
+Latency, server errors, 429 throttling and a concurrency limit can be
+injected, so the publisher, the fix-posts flow and the load driver
+(wptools.loadtest) can be exercised and tuned without touching the live
+site.
+
+    python3 -m wptools.fakewp --port 8080 --latency 0.05 --throttle-rate 0.1
+    WP_URL=http://127.0.0.1:8080 ./wp-publisher.py documentation/guides
+"""
+
+import argparse
+import base64
+import contextlib
+import gzip
+import json
+import math
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from wptools.client import BATCH_LIMIT
+from wptools.taxonomy import slugify
+
+API_PREFIX = '/wp-json'
+MAX_PER_PAGE = 100
+
+ROUTE_RE = re.compile(r'^/wp/v2/(posts|categories|tags|media)(?:/(\d+))?$')
+# Routes that may appear inside a /batch/v1 request, as in WordPress
+BATCH_ROUTES = ('posts', 'categories', 'tags')
+
+# Responses at least this large are gzipped for clients that accept it
+GZIP_MIN_SIZE = 1024
+
+
+class Faults:
+    """What the server does wrong, and how often
+
+    latency (plus up to jitter more) seconds are added to every request; a
+    fraction error_rate of requests fail with 500, throttle_rate with 429
+    and unavailable_rate with 503, both with a Retry-After of retry_after
+    seconds.  Requests beyond max_concurrency in flight are throttled as
+    well (0 for no limit).
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1, max_concurrency=0, seed=None, unavailable_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.unavailable_rate = unavailable_rate
+        self.retry_after = retry_after
+        self.max_concurrency = max_concurrency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def delay(self):
+        with self.lock:
+            return self.latency + self.random.uniform(0, self.jitter)
+
+    def roll(self):
+        """Return None, 'error', 'throttle' or 'unavailable' for one request"""
+        with self.lock:
+            value = self.random.random()
+        if value < self.error_rate:
+            return 'error'
+        value -= self.error_rate
+        if value < self.throttle_rate:
+            return 'throttle'
+        if value - self.throttle_rate < self.unavailable_rate:
+            return 'unavailable'
+        return None
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def _error(status, code, message, **data):
+    return status, {}, {'code': code, 'message': message, 'data': dict(data, status=status)}
+
+
+def _no_route():
+    return _error(404, 'rest_no_route', 'No route was found matching the URL and request method.')
+
+
+def select_fields(item, fields):
+    """Apply _fields, which may name nested keys such as title.rendered"""
+    selected = {}
+    for name in fields:
+        source, target = item, selected
+        parts = name.split('.')
+        for part in parts[:-1]:
+            if not isinstance(source, dict) or part not in source:
+                break
+            source = source[part]
+            target = target.setdefault(part, {})
+        else:
+            if isinstance(source, dict) and parts[-1] in source:
+                target[parts[-1]] = source[parts[-1]]
+    return selected
+
+
+class FakeWordPress:
+    """In-memory WordPress site answering REST requests
+
+    handle() takes one request for a path below /wp-json and returns
+    (status, headers, body); the HTTP server and /batch/v1 both dispatch
+    through it.  Writes, and reads in the edit context, need the given
+    credentials when there are any.
+    """
+
+    def __init__(self, base_url='http://127.0.0.1', username=None, password=None):
+        self.base_url = base_url
+        self.authorization = None
+        if username:
+            token = base64.b64encode(f'{username}:{password}'.encode()).decode()
+            self.authorization = f'Basic {token}'
+        self.lock = threading.RLock()
+        self.items = {'posts': {}, 'categories': {}, 'tags': {}, 'media': {}}
+        self.last_id = 0
+        self._add_term('categories', {'name': 'Uncategorized', 'slug': 'uncategorized'})
+
+    def _new_id(self):
+        self.last_id += 1
+        return self.last_id
+
+    # -- dispatch ------------------------------------------------------------
+
+    def handle(self, method, path, query=None, body=None, headers=None):
+        """Answer one request for a path below /wp-json"""
+        query = query or {}
+        headers = headers or {}
+        if self.authorization and (method != 'GET' or query.get('context') == 'edit') \
+                and headers.get('Authorization') != self.authorization:
+            return _error(401, 'rest_not_logged_in', 'You are not currently logged in.')
+        if path == '/batch/v1':
+            if method != 'POST':
+                return _no_route()
+            return self.batch(body, headers)
+        match = ROUTE_RE.match(path)
+        if match is None:
+            return _no_route()
+        collection, item_id = match.group(1), match.group(2)
+        with self.lock:
+            if item_id is None and method == 'GET':
+                status, response_headers, data = self.list(collection, query)
+            elif item_id is None and method == 'POST':
+                status, response_headers, data = self.create(collection, body, headers)
+            elif item_id is not None and method == 'GET':
+                status, response_headers, data = self.read(collection, int(item_id), query)
+            elif item_id is not None and method in ('POST', 'PUT', 'PATCH'):
+                status, response_headers, data = self.update(collection, int(item_id), body)
+            elif item_id is not None and method == 'DELETE':
+                status, response_headers, data = self.delete(collection, int(item_id), query)
+            else:
+                return _no_route()
+        if query.get('_fields') and 200 <= status < 300:
+            fields = [name.strip() for name in query['_fields'].split(',') if name.strip()]
+            if isinstance(data, list):
+                data = [select_fields(item, fields) for item in data]
+            elif isinstance(data, dict):
+                data = select_fields(data, fields)
+        return status, response_headers, data
+
+    def batch(self, body, headers):
+        """Run up to BATCH_LIMIT write requests, answering 207 Multi-Status"""
+        requests = body.get('requests') if isinstance(body, dict) else None
+        if not isinstance(requests, list):
+            return _error(400, 'rest_missing_callback_param', 'Missing parameter(s): requests',
+                          params=['requests'])
+        if len(requests) > BATCH_LIMIT:
+            message = f'requests must contain at most {BATCH_LIMIT} items.'
+            return _error(400, 'rest_invalid_param', 'Invalid parameter(s): requests',
+                          params={'requests': message})
+        responses = []
+        for request in requests:
+            url = urlsplit(request.get('path', ''))
+            match = ROUTE_RE.match(url.path)
+            if match is None or match.group(1) not in BATCH_ROUTES:
+                status, _, data = _error(400, 'rest_batch_not_allowed',
+                                         'The requested route does not support batch requests.')
+            else:
+                status, _, data = self.handle(request.get('method', 'POST').upper(), url.path,
+                                              dict(parse_qsl(url.query)), request.get('body'),
+                                              headers)
+            responses.append({'status': status, 'headers': {}, 'body': data})
+        return 207, {}, {'responses': responses}
+
+    # -- views ---------------------------------------------------------------
+
+    def view(self, collection, item, context='view'):
+        """The REST representation of a stored item"""
+        if collection == 'posts':
+            data = {
+                'id': item['id'],
+                'date': item['date'], 'date_gmt': item['date'],
+                'modified': item['modified'], 'modified_gmt': item['modified'],
+                'slug': item['slug'], 'status': item['status'], 'type': 'post',
+                'link': f"{self.base_url}/?p={item['id']}",
+                'title': {'rendered': item['title']},
+                'content': {'rendered': item['content'], 'protected': False},
+                'excerpt': {'rendered': item['excerpt'], 'protected': False},
+                'featured_media': item['featured_media'],
+                'format': item['format'],
+                'categories': list(item['categories']),
+                'tags': list(item['tags']),
+                'meta': dict(item['meta']),
+            }
+            if context == 'edit':
+                for name in ('title', 'content', 'excerpt'):
+                    data[name]['raw'] = item[name]
+            return data
+        if collection == 'media':
+            data = {
+                'id': item['id'], 'date': item['date'], 'modified': item['modified'],
+                'slug': item['slug'], 'status': 'inherit', 'type': 'attachment',
+                'link': f"{self.base_url}/?attachment_id={item['id']}",
+                'title': {'rendered': item['title']},
+                'alt_text': item['alt_text'],
+                'media_type': item['media_type'], 'mime_type': item['mime_type'],
+                'source_url': item['source_url'],
+                'media_details': {'filesize': item['filesize']},
+            }
+            if context == 'edit':
+                data['title']['raw'] = item['title']
+            return data
+        taxonomy = 'category' if collection == 'categories' else 'post_tag'
+        return {
+            'id': item['id'], 'count': item['count'], 'description': item['description'],
+            'link': f"{self.base_url}/?{'cat' if taxonomy == 'category' else 'tag'}={item['slug']}",
+            'name': item['name'], 'slug': item['slug'], 'taxonomy': taxonomy,
+            **({'parent': item['parent']} if collection == 'categories' else {}),
+        }
+
+    # -- collections ---------------------------------------------------------
+
+    def list(self, collection, query):
+        try:
+            page = int(query.get('page', 1))
+            per_page = int(query.get('per_page', 10))
+        except ValueError:
+            return _error(400, 'rest_invalid_param', 'Invalid parameter(s): page, per_page')
+        if not 1 <= per_page <= MAX_PER_PAGE or page < 1:
+            return _error(400, 'rest_invalid_param', 'Invalid parameter(s): per_page',
+                          params={'per_page': f'per_page must be between 1 ({per_page}) '
+                                              f'and {MAX_PER_PAGE}'})
+        items = list(self.items[collection].values())
+        items = [item for item in items if self._matches(collection, item, query)]
+        default_order = ('date', 'desc') if collection in ('posts', 'media') else ('name', 'asc')
+        orderby = query.get('orderby', default_order[0])
+        order = query.get('order', default_order[1])
+        if orderby not in ('id', 'date', 'modified', 'title', 'name', 'slug', 'include'):
+            return _error(400, 'rest_invalid_param', 'Invalid parameter(s): orderby')
+        key = 'id' if orderby == 'include' else orderby
+        items.sort(key=lambda item: (item.get(key, ''), item['id']), reverse=order == 'desc')
+        total = len(items)
+        total_pages = math.ceil(total / per_page)
+        if page > max(total_pages, 1):
+            return _error(400, 'rest_post_invalid_page_number',
+                          'The page number requested is larger than the number of pages '
+                          'available.')
+        context = query.get('context', 'view')
+        page_items = items[(page - 1) * per_page:page * per_page]
+        headers = {'X-WP-Total': str(total), 'X-WP-TotalPages': str(total_pages)}
+        return 200, headers, [self.view(collection, item, context) for item in page_items]
+
+    def _matches(self, collection, item, query):
+        if 'include' in query:
+            if item['id'] not in {int(i) for i in query['include'].split(',') if i.isdigit()}:
+                return False
+        if 'slug' in query and item['slug'] not in query['slug'].split(','):
+            return False
+        if 'search' in query:
+            needle = query['search'].lower()
+            haystack = (item.get('title') or item.get('name') or '') + item.get('content', '')
+            if needle not in haystack.lower():
+                return False
+        if collection == 'posts':
+            status = query.get('status', 'publish')
+            if status != 'any' and item['status'] not in status.split(','):
+                return False
+            for name, after in (('modified_after', True), ('modified_before', False),
+                                ('after', True), ('before', False)):
+                if name in query:
+                    field = 'modified' if name.startswith('modified') else 'date'
+                    bound = query[name][:19]
+                    if (item[field] <= bound) if after else (item[field] >= bound):
+                        return False
+            for taxonomy in ('categories', 'tags'):
+                if taxonomy in query:
+                    wanted = {int(i) for i in query[taxonomy].split(',') if i.isdigit()}
+                    if not wanted & set(item[taxonomy]):
+                        return False
+        if collection in ('categories', 'tags') and query.get('hide_empty') in ('true', '1'):
+            if not item['count']:
+                return False
+        return True
+
+    def create(self, collection, body, headers):
+        if collection == 'media':
+            return self._create_media(body, headers)
+        if not isinstance(body, dict):
+            return _error(400, 'rest_invalid_json', 'Invalid JSON body passed.')
+        if collection == 'posts':
+            post = {'id': self._new_id(), 'date': _now(), 'title': '', 'content': '',
+                    'excerpt': '', 'status': 'draft', 'format': 'standard',
+                    'categories': [1], 'tags': [], 'featured_media': 0, 'slug': '', 'meta': {}}
+            error = self._apply_post(post, body)
+            if error:
+                self.last_id -= 1
+                return error
+            post['modified'] = post['date']
+            self.items['posts'][post['id']] = post
+            self._count_terms(post, 1)
+            return 201, {'Location': f"{API_PREFIX}/wp/v2/posts/{post['id']}"}, \
+                self.view('posts', post, 'edit')
+        if not body.get('name'):
+            return _error(400, 'rest_missing_callback_param', 'Missing parameter(s): name',
+                          params=['name'])
+        slug = body.get('slug') or slugify(body['name'])
+        for term in self.items[collection].values():
+            if term['name'].lower() == body['name'].lower() or term['slug'] == slug:
+                return _error(400, 'term_exists',
+                              'A term with the name provided already exists with this parent.',
+                              term_id=term['id'])
+        term = self._add_term(collection, body)
+        return 201, {}, self.view(collection, term, 'edit')
+
+    def _add_term(self, collection, body):
+        term = {'id': self._new_id(), 'name': body['name'],
+                'slug': body.get('slug') or slugify(body['name']),
+                'description': body.get('description', ''), 'parent': body.get('parent', 0),
+                'count': 0}
+        self.items[collection][term['id']] = term
+        return term
+
+    def _apply_post(self, post, body):
+        """Copy writable fields from a request body, or return an error"""
+        for name in ('categories', 'tags'):
+            if name in body:
+                values = body[name]
+                if not isinstance(values, list) or not all(isinstance(v, int) for v in values):
+                    return _error(400, 'rest_invalid_param', f'Invalid parameter(s): {name}',
+                                  params={name: f'{name}[0] is not of type integer.'})
+        if 'meta' in body and not isinstance(body['meta'], dict):
+            return _error(400, 'rest_invalid_param', 'Invalid parameter(s): meta')
+        if 'status' in body and body['status'] not in ('publish', 'draft', 'pending',
+                                                         'private', 'future'):
+            return _error(400, 'rest_invalid_param', 'Invalid parameter(s): status')
+        for name in ('title', 'content', 'excerpt'):
+            if name in body:
+                value = body[name]
+                post[name] = value.get('raw', '') if isinstance(value, dict) else str(value)
+        for name in ('status', 'format', 'categories', 'tags', 'featured_media', 'slug'):
+            if name in body:
+                post[name] = body[name]
+        # Every meta key counts as registered with show_in_rest
+        post['meta'].update(body.get('meta') or {})
+        if not post['slug'] and post['title']:
+            post['slug'] = slugify(post['title'])
+        return None
+
+    def _count_terms(self, post, delta):
+        for collection in ('categories', 'tags'):
+            for term_id in post[collection]:
+                term = self.items[collection].get(term_id)
+                if term is not None:
+                    term['count'] += delta
+
+    def _create_media(self, body, headers):
+        disposition = headers.get('Content-Disposition', '')
+        match = re.search(r'filename(\*?)=(?:UTF-8\'\')?"?([^";]+)"?', disposition)
+        if not match:
+            return _error(400, 'rest_upload_no_content_disposition',
+                          'No Content-Disposition supplied.')
+        if not body:
+            return _error(400, 'rest_upload_no_data', 'No data supplied.')
+        filename = match.group(2).strip()
+        if match.group(1):
+            # filename*= values are percent-encoded
+            filename = unquote(filename)
+        filename = filename.replace('/', '-')
+        stem, dot, extension = filename.rpartition('.')
+        if not dot:
+            stem, extension = filename, ''
+        taken = {item['filename'] for item in self.items['media'].values()}
+        candidate, n = filename, 1
+        while candidate in taken:
+            candidate = f'{stem}-{n}.{extension}' if extension else f'{stem}-{n}'
+            n += 1
+        mime_type = headers.get('Content-Type', 'application/octet-stream').split(';')[0]
+        month = datetime.now(timezone.utc).strftime('%Y/%m')
+        item = {'id': self._new_id(), 'date': _now(), 'filename': candidate,
+                'title': stem or candidate, 'slug': slugify(stem or candidate), 'alt_text': '',
+                'mime_type': mime_type, 'media_type': 'image' if mime_type.startswith('image/')
+                else 'file', 'filesize': len(body),
+                'source_url': f'{self.base_url}/wp-content/uploads/{month}/{candidate}'}
+        item['modified'] = item['date']
+        self.items['media'][item['id']] = item
+        return 201, {}, self.view('media', item, 'edit')
+
+    # -- single items --------------------------------------------------------
+
+    def _missing(self, collection):
+        if collection in ('posts', 'media'):
+            return _error(404, 'rest_post_invalid_id', 'Invalid post ID.')
+        return _error(404, 'rest_term_invalid', 'Term does not exist.')
+
+    def read(self, collection, item_id, query):
+        item = self.items[collection].get(item_id)
+        if item is None:
+            return self._missing(collection)
+        return 200, {}, self.view(collection, item, query.get('context', 'view'))
+
+    def update(self, collection, item_id, body):
+        item = self.items[collection].get(item_id)
+        if item is None:
+            return self._missing(collection)
+        if not isinstance(body, dict):
+            return _error(400, 'rest_invalid_json', 'Invalid JSON body passed.')
+        if collection == 'posts':
+            self._count_terms(item, -1)
+            error = self._apply_post(item, body)
+            self._count_terms(item, 1)
+            if error:
+                return error
+        elif collection == 'media':
+            for name in ('title', 'alt_text'):
+                if name in body:
+                    item[name] = body[name]
+        else:
+            for name in ('name', 'slug', 'description', 'parent'):
+                if name in body:
+                    item[name] = body[name]
+        item['modified'] = _now()
+        return 200, {}, self.view(collection, item, 'edit')
+
+    def delete(self, collection, item_id, query):
+        item = self.items[collection].get(item_id)
+        if item is None:
+            return self._missing(collection)
+        force = query.get('force') in ('true', '1')
+        if collection == 'posts' and not force:
+            item['status'] = 'trash'
+            item['modified'] = _now()
+            return 200, {}, self.view(collection, item, 'edit')
+        if not force:
+            return _error(501, 'rest_trash_not_supported',
+                          'This item does not support trashing. Set "force=true" to delete.')
+        previous = self.view(collection, item, 'edit')
+        if collection == 'posts':
+            self._count_terms(item, -1)
+        del self.items[collection][item_id]
+        return 200, {}, {'deleted': True, 'previous': previous}
+
+    # -- seeding -------------------------------------------------------------
+
+    def seed_posts(self, count, escaped_every=0):
+        """Add count published posts; every escaped_every-th shows escaped HTML"""
+        with self.lock:
+            for i in range(1, count + 1):
+                content = f'<h2>Section {i}</h2>\n<p>Generated post {i}.</p>'
+                if escaped_every and i % escaped_every == 0:
+                    content = content.replace('<', '&lt;').replace('>', '&gt;')
+                self.create('posts', {'title': f'Seeded post {i}', 'content': content,
+                                      'status': 'publish'}, {})
+
+
+class ServerStats:
+    """Requests per route and status, and the most ever in flight"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statuses = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    @contextlib.contextmanager
+    def track(self):
+        """Count a request in flight; yields how many are, itself included"""
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            current = self.in_flight
+        try:
+            yield current
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def record(self, route, status):
+        with self.lock:
+            key = (route, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': sum(self.statuses.values()),
+                'statuses': {f'{route} {status}': count
+                             for (route, status), count in sorted(self.statuses.items())},
+                'peak_in_flight': self.peak_in_flight,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.statuses = {}
+            self.peak_in_flight = self.in_flight
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeWordPress/1.0'
+    # Headers and body go out as separate writes; with Nagle on, the body
+    # waits for the client's delayed ACK and every response gains ~40 ms
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    # Skip trailers up to the blank line
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+            data = b''.join(parts)
+        else:
+            data = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Encoding') == 'gzip' and data:
+            data = gzip.decompress(data)
+        return data
+
+    def _dispatch(self, method):
+        server = self.server
+        with server.stats.track() as in_flight:
+            # The body is always read, so the connection stays usable
+            raw = self._read_body()
+            url = urlsplit(self.path)
+            route = 'root'
+            if not url.path.startswith(API_PREFIX + '/'):
+                self._send(200, {}, b'<html><body>Fake WordPress</body></html>', 'text/html')
+                server.stats.record(route, 200)
+                return
+            path = url.path[len(API_PREFIX):]
+            match = ROUTE_RE.match(path)
+            route = match.group(1) if match else path.strip('/').split('/')[0] or 'index'
+            time.sleep(server.faults.delay())
+            over_limit = server.faults.max_concurrency and in_flight > server.faults.max_concurrency
+            fault = 'throttle' if over_limit else server.faults.roll()
+            if fault == 'throttle':
+                status, headers, data = _error(429, 'rest_too_many_requests',
+                                               'Too many requests, slow down.')
+                headers = {'Retry-After': str(server.faults.retry_after)}
+            elif fault == 'unavailable':
+                status, headers, data = _error(503, 'service_unavailable',
+                                               'Briefly unavailable for scheduled maintenance.')
+                headers = {'Retry-After': str(server.faults.retry_after)}
+            elif fault == 'error':
+                status, headers, data = _error(500, 'internal_server_error',
+                                               'There has been a critical error on this website.')
+            else:
+                status, headers, data = self._answer(method, path, url.query, raw)
+            # Counted before it is sent, so the client's next look sees it
+            server.stats.record(route, status)
+            self._send(status, headers, json.dumps(data).encode('utf-8'))
+
+    def _answer(self, method, path, query, raw):
+        headers = {name: self.headers[name] for name in
+                   ('Authorization', 'Content-Type', 'Content-Disposition') if name in self.headers}
+        if path == '/wp/v2/media' and method == 'POST':
+            body = raw
+        else:
+            try:
+                body = json.loads(raw) if raw else None
+            except ValueError:
+                return _error(400, 'rest_invalid_json', 'Invalid JSON body passed.')
+        return self.server.site.handle(method, path, dict(parse_qsl(query)), body, headers)
+
+    def _send(self, status, headers, data, content_type='application/json; charset=UTF-8'):
+        if len(data) >= GZIP_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data, compresslevel=1)
+            headers = dict(headers, **{'Content-Encoding': 'gzip'})
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        try:
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting; the request was still done
+            self.close_connection = True
+
+
+class FakeServer(ThreadingHTTPServer):
+    """HTTP server for a FakeWordPress site; url is its base URL"""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address=('127.0.0.1', 0), faults=None, username=None, password=None,
+                 verbose=False):
+        super().__init__(address, _Handler)
+        host, port = self.server_address[:2]
+        self.url = f'http://{host}:{port}'
+        self.site = FakeWordPress(self.url, username, password)
+        self.faults = faults or Faults()
+        self.stats = ServerStats()
+        self.verbose = verbose
+
+
+def start(port=0, host='127.0.0.1', faults=None, username=None, password=None):
+    """Serve a fresh fake site from a background thread; stop it with shutdown()"""
+    server = FakeServer((host, port), faults, username, password)
+    threading.Thread(target=server.serve_forever, name='fakewp', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve a local stand-in for the WordPress REST API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every request (default: 0)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='up to this many more seconds, at random (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests answered with 500 (default: 0)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='fraction of requests answered with 429 (default: 0)')
+    parser.add_argument('--unavailable-rate', type=float, default=0.0,
+                        help='fraction of requests answered with 503 (default: 0)')
+    parser.add_argument('--retry-after', type=int, default=1,
+                        help='Retry-After seconds sent with 429 and 503 (default: 1)')
+    parser.add_argument('--max-concurrency', type=int, default=0,
+                        help='throttle requests beyond this many in flight, 0 for no limit')
+    parser.add_argument('--user', help='require this user for writes (Basic auth)')
+    parser.add_argument('--password', help='password or application password for --user')
+    parser.add_argument('--seed-posts', type=int, default=0,
+                        help='start with this many published posts')
+    parser.add_argument('--escaped-every', type=int, default=0,
+                        help='every Nth seeded post shows escaped HTML (for fix-wordpress-posts)')
+    parser.add_argument('--seed', type=int, help='random seed for injected faults')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    faults = Faults(args.latency, args.jitter, args.error_rate, args.throttle_rate,
+                    args.retry_after, args.max_concurrency, args.seed, args.unavailable_rate)
+    server = FakeServer((args.host, args.port), faults, args.user, args.password, args.verbose)
+    server.site.seed_posts(args.seed_posts, args.escaped_every)
+    print(f"🧪 Fake WordPress at {server.url} (Ctrl-C to stop)")
+    print(f"   WP_URL={server.url} ./wp-publisher.py ...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        stats = server.stats.snapshot()
+        print(f"\n📊 {stats['requests']} requests, peak {stats['peak_in_flight']} in flight")
+        for key, count in stats['statuses'].items():
+            print(f"   {key:<24} {count}")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
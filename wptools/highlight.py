@@ -0,0 +1,129 @@
+"""
+Build-time syntax highlighting for fenced code blocks
+
+highlight_code() turns a block's code into Pygments token spans
+(<span class="k">...) so pages need a stylesheet instead of a JavaScript
+highlighter running on every view.  Results are memoized by a hash of the
+language and the code, so a snippet repeated across documents is only
+highlighted once per process.  Pygments is optional: without it, and for
+languages it does not know, code blocks are left plain.
+
+Print the stylesheet for a theme with:
+
+    python3 -m wptools.highlight [--style monokai] > highlight.css
+"""
+
+import argparse
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Selector the token classes are scoped to
+CSS_SCOPE = '.wp-block-code code'
+
+
+def version():
+    """Version of the highlighter, part of cache keys; None without Pygments"""
+    try:
+        import pygments
+    except ImportError:
+        return None
+    return f'pygments-{pygments.__version__}'
+
+
+class Highlighter:
+    """Memoizing Pygments highlighter, safe to share between threads"""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lexers = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.formatter = None
+
+    def lexer(self, lang):
+        """The Pygments lexer for a fence language, or None"""
+        with self.lock:
+            if lang in self.lexers:
+                return self.lexers[lang]
+        try:
+            from pygments.formatters import HtmlFormatter
+            from pygments.lexers import get_lexer_by_name
+            from pygments.util import ClassNotFound
+        except ImportError:
+            lexer = None
+        else:
+            try:
+                # Keep leading and trailing newlines exactly as written
+                lexer = get_lexer_by_name(lang, stripnl=False, ensurenl=False)
+            except ClassNotFound:
+                lexer = None
+            if self.formatter is None:
+                self.formatter = HtmlFormatter(nowrap=True)
+        with self.lock:
+            self.lexers[lang] = lexer
+        return lexer
+
+    def supports(self, lang):
+        return bool(lang) and self.lexer(lang) is not None
+
+    def highlight(self, lang, code):
+        """HTML for code in lang (escaped, with token spans), or None"""
+        lexer = self.lexer(lang) if lang else None
+        if lexer is None:
+            return None
+        key = hashlib.sha1(f'{lang}\0{code}'.encode('utf-8')).digest()
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return html
+            self.misses += 1
+        from pygments import highlight
+        html = highlight(code, lexer, self.formatter)
+        if html.endswith('\n') and not code.endswith('\n'):
+            # The formatter ends every line, the last one included
+            html = html[:-1]
+        with self.lock:
+            self.entries[key] = html
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return html
+
+
+HIGHLIGHTER = Highlighter()
+
+
+def highlight_code(lang, code):
+    """HIGHLIGHTER.highlight(): highlighted HTML for code, or None"""
+    return HIGHLIGHTER.highlight(lang, code)
+
+
+@functools.lru_cache(maxsize=None)
+def stylesheet(style='default'):
+    """CSS for the token classes in a Pygments style ('' without Pygments)"""
+    try:
+        from pygments.formatters import HtmlFormatter
+    except ImportError:
+        return ''
+    formatter = HtmlFormatter(style=style)
+    # Token rules only: the page's own pre and line-number rules stay
+    return '\n'.join(formatter.get_background_style_defs(CSS_SCOPE)
+                     + formatter.get_token_style_defs(CSS_SCOPE))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print the stylesheet for highlighted code')
+    parser.add_argument('--style', default='default', help='Pygments style (default: default)')
+    args = parser.parse_args()
+    if version() is None:
+        parser.error('Pygments is not installed (pip install Pygments)')
+    print(stylesheet(args.style))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""
+Durable publish jobs: a SQLite queue and a pool of workers
+
+A bulk run enqueues one job per document (or per post to fix) and workers
+claim them one at a time, so the queue on disk always knows which
+documents are done.  A job's key names what it works on, such as the
+source path of a document, so there is at most one job per document.
+Enqueueing a key that is queued only updates the job's payload, and a
+done job only runs again once its payload (say, with the hash of the
+content) changed: running the same command again, after a crash or on
+purpose, only sends what is left.
+
+Claimed jobs are leased to their worker.  Jobs left running by a process
+that died are handed out again as soon as a process on the same host
+notices (recover()), and by any process once the lease expires.  Handlers
+must be safe to repeat, since a worker can die after the site did the work
+and before the job was marked done; wp-publisher.py's manifest and post
+index make its publishes so.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from wptools.bulk import TokenBucket
+from wptools.client import CircuitOpen
+from wptools.metrics import METRICS
+
+DEFAULT_PATH = os.path.expanduser('~/.cache/wp-publisher/jobs.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    site TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL,
+    updated_at REAL,
+    UNIQUE (site, key)
+)
+'''
+
+JOB_STATES = ('queued', 'running', 'done', 'failed')
+
+INDEX = 'CREATE INDEX IF NOT EXISTS jobs_state ON jobs (site, state, id)'
+
+# Jobs that failed this many times are left alone by retry_failed()
+MAX_ATTEMPTS = 3
+
+# Seconds a claimed job stays with its worker before others may take it
+LEASE_SECONDS = 900
+
+
+def worker_name():
+    """host:pid of this process, as stored with the jobs it claims"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            # A zombie has died but was not reaped yet
+            return f.read().rpartition(')')[2].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+
+class JobQueue:
+    """Persistent queue of jobs for one site, safe to share between threads
+
+    Several processes can work on the same queue file: claims only
+    succeed for jobs still free when they are made.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, site='', lease=LEASE_SECONDS):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.site = site
+        self.lease = lease
+        self.worker = worker_name()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute(SCHEMA)
+            self.db.execute(INDEX)
+
+    def _job(self, job_id):
+        row = self.db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def enqueue(self, kind, key, payload, force=False):
+        """Add a job unless one with key is queued, running or done
+
+        A queued job takes the new kind and payload.  A done job is queued
+        again when force is set or its payload changed, and a failed one
+        always is.  Returns True when this call queued the job.
+        """
+        data = json.dumps(payload, sort_keys=True)
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute('SELECT id, state, payload FROM jobs WHERE site = ? AND key = ?',
+                                  (self.site, key)).fetchone()
+            if row is None:
+                self.db.execute(
+                    'INSERT INTO jobs (site, kind, key, payload, state, created_at, updated_at)'
+                    " VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                    (self.site, kind, key, data, now, now))
+                return True
+            if row['state'] == 'queued' and row['payload'] != data:
+                self.db.execute(
+                    'UPDATE jobs SET kind = ?, payload = ?, updated_at = ? WHERE id = ?',
+                    (kind, data, now, row['id']))
+            if row['state'] in ('queued', 'running'):
+                return False
+            if row['state'] == 'done' and not force and row['payload'] == data:
+                return False
+            self.db.execute(
+                "UPDATE jobs SET kind = ?, payload = ?, state = 'queued', attempts = 0,"
+                ' error = NULL, updated_at = ? WHERE id = ?', (kind, data, now, row['id']))
+            return True
+
+    def claim(self, kinds=None):
+        """Take the oldest free job of one of kinds (default: any); None when none is left
+
+        Free jobs are queued ones and running ones whose lease expired.
+        """
+        kind_filter = ''
+        params = []
+        if kinds is not None:
+            kind_filter = f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params = list(kinds)
+        free = "(state = 'queued' OR (state = 'running' AND lease_until < ?))"
+        while True:
+            now = time.time()
+            with self.lock, self.db:
+                row = self.db.execute(
+                    f'SELECT id FROM jobs WHERE site = ? AND {free}{kind_filter}'
+                    ' ORDER BY id LIMIT 1', [self.site, now] + params).fetchone()
+                if row is None:
+                    return None
+                claimed = self.db.execute(
+                    f"UPDATE jobs SET state = 'running', worker = ?, lease_until = ?,"
+                    f' attempts = attempts + 1, updated_at = ? WHERE id = ? AND {free}',
+                    (self.worker, now + self.lease, now, row['id'], now)).rowcount
+                if claimed:
+                    return self._job(row['id'])
+            # Another process took it first
+
+    def _finish(self, job, state, result=None, error=None):
+        with self.lock, self.db:
+            self.db.execute(
+                'UPDATE jobs SET state = ?, result = ?, error = ?, worker = NULL,'
+                ' lease_until = NULL, updated_at = ? WHERE id = ? AND worker = ?',
+                (state, None if result is None else json.dumps(result), error, time.time(),
+                 job['id'], self.worker))
+            return self._job(job['id'])
+
+    def complete(self, job, result=None):
+        """Mark a claimed job done, with its (JSON) result; returns the job"""
+        return self._finish(job, 'done', result=result)
+
+    def fail(self, job, error):
+        """Mark a claimed job failed; returns the job"""
+        return self._finish(job, 'failed', error=error)
+
+    def release(self, job):
+        """Put a claimed job back untried, as when the run stops before it"""
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE jobs SET state = 'queued', attempts = MAX(0, attempts - 1), worker = NULL,"
+                ' lease_until = NULL, updated_at = ? WHERE id = ? AND worker = ?',
+                (time.time(), job['id'], self.worker))
+
+    def recover(self):
+        """Queue again the running jobs of processes on this host that died
+
+        Returns how many there were.
+        """
+        host = socket.gethostname()
+        recovered = 0
+        with self.lock, self.db:
+            rows = self.db.execute(
+                "SELECT id, worker FROM jobs WHERE site = ? AND state = 'running'",
+                (self.site,)).fetchall()
+            for row in rows:
+                worker_host, _, pid = (row['worker'] or '').rpartition(':')
+                if worker_host != host or not pid.isdigit() or _alive(int(pid)):
+                    continue
+                recovered += self.db.execute(
+                    "UPDATE jobs SET state = 'queued', worker = NULL, lease_until = NULL,"
+                    " updated_at = ? WHERE id = ? AND state = 'running' AND worker = ?",
+                    (time.time(), row['id'], row['worker'])).rowcount
+        return recovered
+
+    def retry_failed(self, max_attempts=MAX_ATTEMPTS):
+        """Queue again the failed jobs tried fewer than max_attempts times"""
+        with self.lock, self.db:
+            return self.db.execute(
+                "UPDATE jobs SET state = 'queued', updated_at = ? WHERE site = ?"
+                " AND state = 'failed' AND attempts < ?",
+                (time.time(), self.site, max_attempts)).rowcount
+
+    def counts(self):
+        """Number of jobs per state"""
+        with self.lock:
+            rows = self.db.execute('SELECT state, COUNT(*) FROM jobs WHERE site = ? GROUP BY state',
+                                   (self.site,)).fetchall()
+        return {state: count for state, count in rows}
+
+    def summary(self):
+        """One-line count of jobs per state"""
+        counts = self.counts()
+        return ', '.join(f'{counts[state]} {state}' for state in JOB_STATES
+                         if counts.get(state)) or 'empty'
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def run_jobs(queue, handlers, workers=4, rate=0.0, on_finish=None):
+    """Run the queue's jobs on a pool of worker threads until none is left
+
+    handlers maps job kinds to functions taking a claimed job (a dict
+    with its 'payload' and 'attempts', over 1 when it was tried before)
+    and returning its (JSON) result, or raising to fail it; only jobs of
+    those kinds are claimed.  Workers start jobs at no more than rate per
+    second (0 for no limit) and call on_finish(job) after each one.  Once
+    a handler raises CircuitOpen, or on Ctrl-C, workers stop after their
+    current job and the rest stays queued for the next run.  Returns
+    (jobs finished in this run, why the run stopped early or None).
+    """
+    limiter = TokenBucket(rate, workers)
+    stopped = []
+    finished = []
+    lock = threading.Lock()
+
+    def work():
+        while not stopped:
+            job = queue.claim(list(handlers))
+            if job is None:
+                return
+            limiter.acquire()
+            started = time.monotonic()
+            try:
+                result = handlers[job['kind']](job)
+            except CircuitOpen as e:
+                # The site is down: leave this job and the rest for later
+                stopped.append(str(e))
+                queue.release(job)
+                return
+            except Exception as e:
+                job = queue.fail(job, str(e))
+            else:
+                job = queue.complete(job, result)
+            job['seconds'] = time.monotonic() - started
+            METRICS.count('jobs', kind=job['kind'], state=job['state'])
+            with lock:
+                finished.append(job)
+                if on_finish is not None:
+                    on_finish(job)
+
+    threads = [threading.Thread(target=work, name=f'job-worker-{number}')
+               for number in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        stopped.append('interrupted')
+        for thread in threads:
+            thread.join()
+    return finished, stopped[0] if stopped else None
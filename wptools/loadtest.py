@@ -0,0 +1,214 @@
+"""
+Load driver for the publishing flows
+
+Runs a flow end to end against a local wptools.fakewp server (or another
+site given with --url) at increasing concurrency, and reports documents
+per second, per-document latency percentiles, failures and what the
+server saw (throttled requests, peak requests in flight).  The level
+where throughput stops improving is the useful concurrency limit.
+
+    python3 -m wptools.loadtest --documents 200 --concurrency 1,2,4,8,16 --latency 0.05
+    python3 -m wptools.loadtest --flow fix --documents 500 --throttle-rate 0.05
+
+Flows:
+    publish  wp-publisher.py bulk mode: convert, then create one post per file
+    fix      fix-wordpress-posts.py: scan every post, batch-update the broken ones
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from wptools.bench import percentile
+from wptools.fakewp import Faults, start
+
+ROOT = Path(__file__).resolve().parents[1]
+PUBLISHER = ROOT / 'wp-publisher.py'
+FIX_POSTS = ROOT / 'archives' / 'wordpress' / 'fix-wordpress-posts.py'
+
+# A level counts as saturated once it reaches this share of the best throughput
+SATURATION = 0.9
+
+
+def load_script(path, name, url):
+    """Import a script with WP_URL pointing at url"""
+    previous = os.environ.get('WP_URL')
+    os.environ['WP_URL'] = url
+    try:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        if previous is None:
+            del os.environ['WP_URL']
+        else:
+            os.environ['WP_URL'] = previous
+    return module
+
+
+def write_documents(directory, count, size):
+    """Write count markdown files of about size bytes each"""
+    paragraph = ('Load test paragraph with **bold**, *italic*, `code` and a '
+                 '[link](https://example.com).\n\n')
+    table = '| key | value |\n|---|---|\n' + ''.join(f'| k{i} | v{i} |\n' for i in range(5))
+    for i in range(count):
+        body = []
+        while sum(len(part) for part in body) < size:
+            body.append(f'## Section {len(body)}\n\n{paragraph}{table}\n'
+                        f'```python\nprint({len(body)})\n```\n\n')
+        Path(directory, f'doc-{i:05d}.md').write_text(f'# Load test document {i}\n\n'
+                                                     + ''.join(body))
+
+
+def run_publish(url, directory, concurrency):
+    """Publish every file in directory; returns per-document results"""
+    publisher = load_script(PUBLISHER, 'wp_publisher', url)
+    # Every level converts and sends everything again
+    publisher.RENDER_CACHE_PATH = ''
+    publisher.POST_INDEX_PATH = ''
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = publisher.publish_directory(directory, concurrency=concurrency, rate=0)
+    return [{'ok': result['ok'], 'seconds': result['seconds'], 'error': result.get('error')}
+            for result in results]
+
+
+def run_fix(url, concurrency):
+    """Scan the site and fix every broken post; returns per-post results"""
+    fixer = load_script(FIX_POSTS, 'fix_wordpress_posts', url)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        posts = list(fixer.find_problematic_posts(concurrency, checkpoint=None))
+        fixed = fixer.fix_posts(posts, concurrency)
+    # Updates go out in batches, so per-post latency is the whole run's
+    seconds = time.perf_counter() - started
+    return [{'ok': ok, 'seconds': seconds, 'error': None if ok else 'not fixed'}
+            for ok in fixed.values()]
+
+
+def run_level(args, concurrency, directory):
+    """Run the flow once at one concurrency level"""
+    server = None
+    url = args.url
+    if url is None:
+        faults = Faults(args.latency, args.jitter, args.error_rate, args.throttle_rate,
+                        args.retry_after, args.max_concurrency, args.seed)
+        server = start(faults=faults)
+        url = server.url
+        if args.flow == 'fix':
+            server.site.seed_posts(args.documents, escaped_every=2)
+    try:
+        started = time.perf_counter()
+        if args.flow == 'publish':
+            results = run_publish(url, directory, concurrency)
+        else:
+            results = run_fix(url, concurrency)
+        elapsed = time.perf_counter() - started
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    latencies = [result['seconds'] * 1000 for result in results if result['ok']]
+    failed = [result for result in results if not result['ok']]
+    level = {
+        'concurrency': concurrency,
+        'documents': len(results),
+        'failed': len(failed),
+        'seconds': elapsed,
+        'docs_per_s': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'errors': sorted({result['error'] for result in failed if result['error']})[:5],
+    }
+    if server is not None:
+        level['server'] = server.stats.snapshot()
+    return level
+
+
+def saturation_point(levels):
+    """The lowest concurrency within SATURATION of the best throughput"""
+    best = max((level['docs_per_s'] for level in levels), default=0.0)
+    for level in levels:
+        if best and level['docs_per_s'] >= best * SATURATION:
+            return level['concurrency']
+    return None
+
+
+def print_report(args, levels):
+    print(f"\n📊 {args.flow}: {args.documents} documents"
+          + ('' if args.url else f", latency {args.latency * 1000:g}+{args.jitter * 1000:g} ms, "
+             f"errors {args.error_rate:g}, throttled {args.throttle_rate:g}"))
+    print(f"   {'workers':>7} {'docs/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'failed':>6} {'429s':>5} {'peak':>5}")
+    for level in levels:
+        server = level.get('server', {})
+        throttled = sum(count for key, count in server.get('statuses', {}).items()
+                        if key.endswith(' 429'))
+        print(f"   {level['concurrency']:>7} {level['docs_per_s']:8.1f} {level['p50_ms']:8.1f} "
+              f"{level['p95_ms']:8.1f} {level['p99_ms']:8.1f} {level['failed']:>6} "
+              f"{throttled if server else '-':>5} {server.get('peak_in_flight', '-'):>5}")
+        for error in level['errors']:
+            print(f"           ❌ {error}")
+    point = saturation_point(levels)
+    if point is not None:
+        print(f"\n📈 Throughput levels off at {point} workers "
+              f"(within {SATURATION:.0%} of the best level)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the publishing flows')
+    parser.add_argument('--flow', choices=('publish', 'fix'), default='publish')
+    parser.add_argument('--documents', type=int, default=100,
+                        help='documents to publish, or posts to scan (default: 100)')
+    parser.add_argument('--size', type=int, default=8192,
+                        help='approximate bytes of markdown per document (default: 8192)')
+    parser.add_argument('--concurrency', default='1,2,4,8,16',
+                        help='comma-separated worker counts to try (default: 1,2,4,8,16)')
+    parser.add_argument('--url', help='run against this site instead of a local fake server')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='fake server: seconds added per request (default: 0.02)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='fake server: up to this many more seconds (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fake server: fraction of 500 responses (default: 0)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='fake server: fraction of 429 responses (default: 0)')
+    parser.add_argument('--retry-after', type=int, default=1,
+                        help='fake server: Retry-After seconds on 429 (default: 1)')
+    parser.add_argument('--max-concurrency', type=int, default=0,
+                        help='fake server: throttle beyond this many requests in flight')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for injected faults')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    if args.url and args.flow == 'fix':
+        parser.error('the fix flow rewrites posts, it only runs against the local fake server')
+    levels = [int(value) for value in args.concurrency.split(',') if value.strip()]
+
+    with tempfile.TemporaryDirectory(prefix='wp-loadtest-') as directory:
+        if args.flow == 'publish':
+            write_documents(directory, args.documents, args.size)
+        results = []
+        for concurrency in levels:
+            print(f"⏱️  {args.flow} with {concurrency} workers...")
+            results.append(run_level(args, concurrency, directory))
+
+    print_report(args, results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'flow': args.flow, 'documents': args.documents, 'levels': results}, f,
+                      indent=2)
+        print(f"\n💾 Results written to {args.output}")
+    sys.exit(0 if all(level['failed'] == 0 for level in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Publish manifest: which source file became which WordPress post
+
+A small SQLite database records, per site and source file, the content
+hash and converter version last published, the post id, the source's
+mtime and size, and a fingerprint of every post field that was sent.
+Re-runs use it to skip files that have not changed, to update existing
+posts in place instead of creating duplicates, and to send only the
+fields whose fingerprint changed.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.path.expanduser('~/.cache/wp-publisher/manifest.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS published (
+    site TEXT NOT NULL,
+    source TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    converter_version TEXT NOT NULL,
+    post_id INTEGER,
+    fields TEXT NOT NULL DEFAULT '{}',
+    mtime REAL,
+    size INTEGER,
+    published_at REAL,
+    PRIMARY KEY (site, source)
+)
+'''
+
+
+def file_hash(path):
+    """SHA-256 of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(value):
+    """Stable short hash of a JSON-serialisable field value"""
+    data = json.dumps(value, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class Manifest:
+    """Thread-safe access to the publish manifest of one site"""
+
+    def __init__(self, path=DEFAULT_PATH, site=''):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.site = site
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute(SCHEMA)
+
+    @staticmethod
+    def key(source):
+        return os.path.abspath(source)
+
+    def lookup(self, source):
+        """Return the manifest entry for a source file, or None"""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT * FROM published WHERE site = ? AND source = ?',
+                (self.site, self.key(source))).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry['fields'] = json.loads(entry['fields'])
+        return entry
+
+    def source_for(self, post_id):
+        """Return the source file published as post_id, or None"""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT source FROM published WHERE site = ? AND post_id = ?',
+                (self.site, post_id)).fetchone()
+        return row[0] if row else None
+
+    def check(self, source, converter_version):
+        """Return (changed, content_hash, stat) for a source file
+
+        Files whose mtime and size match the manifest are not read at all
+        (content_hash is then None).  Otherwise the file is hashed; if only
+        its timestamp moved the entry is refreshed and it counts as
+        unchanged.  Pass stat on to record() so a file edited while it is
+        being published is picked up by the next run.
+        """
+        entry = self.lookup(source)
+        stat = os.stat(source)
+        if entry and entry['converter_version'] == converter_version:
+            if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                return False, None, stat
+        content_hash = file_hash(source)
+        if (entry is None or entry['content_hash'] != content_hash
+                or entry['converter_version'] != converter_version):
+            return True, content_hash, stat
+        with self.lock, self.db:
+            self.db.execute(
+                'UPDATE published SET mtime = ?, size = ? WHERE site = ? AND source = ?',
+                (stat.st_mtime, stat.st_size, self.site, self.key(source)))
+        return False, content_hash, stat
+
+    @staticmethod
+    def changed_fields(entry, post_data, fingerprints=None):
+        """Return the names of post_data fields that differ from the entry
+
+        fingerprints can supply precomputed fingerprints for fields whose
+        value is not at hand (such as streamed content).
+        """
+        fingerprints = fingerprints or {}
+        previous = entry['fields'] if entry else {}
+        changed = []
+        for name in set(post_data) | set(fingerprints):
+            current = fingerprints.get(name) or fingerprint(post_data[name])
+            if previous.get(name) != current:
+                changed.append(name)
+        return sorted(changed)
+
+    def record(self, source, content_hash, converter_version, post_id, post_data,
+               fingerprints=None, stat=None):
+        """Store what was just published for a source file"""
+        fields = {name: fingerprint(value) for name, value in post_data.items()}
+        fields.update(fingerprints or {})
+        stat = stat or os.stat(source)
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO published (site, source, content_hash, converter_version,'
+                ' post_id, fields, mtime, size, published_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.site, self.key(source), content_hash, converter_version, post_id,
+                 json.dumps(fields, sort_keys=True), stat.st_mtime, stat.st_size, time.time()))
+
+    def forget(self, source):
+        """Drop the entry for a source"""
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM published WHERE site = ? AND source = ?',
+                            (self.site, self.key(source)))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
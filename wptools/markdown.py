@@ -0,0 +1,814 @@
+"""
+Markdown to HTML converter engine
+
+The document is tokenized once, line by line: fenced code, headings, list
+items, blockquotes and tables are recognised as their lines arrive, inline
+spans (code, bold, italic, links, images) are rendered with a single scan per block
+of text, and paragraphs are emitted as soon as they are complete.  Every
+line is visited a constant number of times and no search backtracks over
+text it has already rejected, so conversion time grows linearly with
+document size, for malformed and adversarial input too (`python3 -m
+wptools.bench --adversarial` checks this).  A Budget caps the size of each
+document and the time spent converting it.
+
+The output matches the previous regex cascade in wp-publisher.py, except
+that text inside fenced code blocks and inline code spans is now kept
+literally instead of being run through the heading, list and emphasis rules.
+
+With highlight set, fenced code in a language Pygments knows is turned
+into token spans at conversion time (see wptools.highlight); such blocks
+are held until their closing fence instead of being streamed.
+
+render_blocks() re-renders edited documents incrementally: the document is
+cut into top-level blocks and each block's HTML is cached together with
+the converter state around it, so only changed blocks are converted again.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# Bump whenever the generated HTML changes for the same markdown
+CONVERTER_VERSION = '4'
+
+FENCE_RE = re.compile(r'^(\s*)```(\w*)\s*$')
+ORDERED_ITEM_RE = re.compile(r'^\d+\.\s+')
+SEPARATOR_CHARS = frozenset('-:| \t')
+
+# Default per-document budget: characters of markdown and seconds spent
+# converting, 0 for no limit
+MAX_DOCUMENT_SIZE = int(os.environ.get('WP_MAX_DOCUMENT_SIZE', 64 * 1024 * 1024))
+MAX_CONVERT_SECONDS = float(os.environ.get('WP_CONVERT_TIMEOUT', 60))
+
+# Characters that can open an inline span
+INLINE_START_RE = re.compile(r'[`*\[!]')
+
+HEADINGS = (('### ', 'h3'), ('## ', 'h2'), ('# ', 'h1'))
+
+
+def converter_version(highlight=False):
+    """CONVERTER_VERSION, plus the highlighter's version when highlighting"""
+    if highlight:
+        from wptools.highlight import version
+        if version():
+            return f'{CONVERTER_VERSION}+{version()}'
+    return CONVERTER_VERSION
+
+
+def escape_code(code):
+    """Escape HTML entities in code"""
+    return code.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def render_code_block(lang, code):
+    """Render a fenced code block"""
+    code = escape_code(code)
+    if lang:
+        return f'<pre class="wp-block-code"><code class="language-{lang}">{code}</code></pre>'
+    return f'<pre class="wp-block-code"><code>{code}</code></pre>'
+
+
+def render_inline(text):
+    """Render inline code, bold, italic, links and images"""
+    match = INLINE_START_RE.search(text)
+    if match is None:
+        return text
+    return _InlineScanner(text).render(match)
+
+
+class _InlineScanner:
+    """Find inline spans in one left-to-right scan
+
+    Spans are matched exactly as the earlier single-regex implementation
+    matched them, trying code, bold, italic and link at each position in
+    turn: code spans are kept literal and italic spans may contain whole
+    bold spans.  A regex engine rescans the rest of the text from every '['
+    or '*' that is never closed, which is quadratic on inputs like
+    '[[[[...'.  Here each search for a closing delimiter resumes where the
+    previous one stopped and italic run ends are memoized, so the work
+    stays linear in the length of the text.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.found = {}
+        self.run_ends = {}
+
+    def find(self, char, start):
+        """text.find(char, start), for starts that never decrease per char"""
+        previous = self.found.get(char)
+        if previous is not None:
+            searched, at = previous
+            if searched <= start and (at < 0 or at >= start):
+                return at
+        at = self.text.find(char, start)
+        self.found[char] = (start, at)
+        return at
+
+    def run_end(self, start):
+        """End of the run of plain characters and whole bold spans at start"""
+        text = self.text
+        path = []
+        star = text.find('*', start)
+        while True:
+            if star < 0:
+                end = len(text)
+                break
+            if star in self.run_ends:
+                end = self.run_ends[star]
+                break
+            path.append(star)
+            if text.startswith('**', star):
+                close = text.find('*', star + 2)
+                if close > star + 2 and text.startswith('**', close):
+                    star = text.find('*', close + 2)
+                    continue
+            end = star
+            break
+        for star in path:
+            self.run_ends[star] = end
+        return end
+
+    def span(self, i):
+        """Return (end, html) for the span starting at i, or None"""
+        text = self.text
+        char = text[i]
+        if char == '`':
+            close = self.find('`', i + 1)
+            if close > i + 1:
+                return close + 1, f'<code>{text[i + 1:close]}</code>'
+            return None
+        if char == '!':
+            # An image is a link with a '!' in front
+            link = self.span(i + 1) if text.startswith('[', i + 1) else None
+            if link is None or not link[1].startswith('<a '):
+                return None
+            close = text.index(']', i + 2)
+            alt = text[i + 2:close].replace('"', '&quot;')
+            return link[0], f'<img src="{text[close + 2:link[0] - 1]}" alt="{alt}" />'
+        if char == '[':
+            close = self.find(']', i + 1)
+            if close > i + 1 and text.startswith('(', close + 1):
+                end = self.find(')', close + 2)
+                if end > close + 2:
+                    return end + 1, (f'<a href="{text[close + 2:end]}">'
+                                     f'{render_inline(text[i + 1:close])}</a>')
+            return None
+        if text.startswith('**', i):
+            close = text.find('*', i + 2)
+            if close > i + 2 and text.startswith('**', close):
+                return close + 2, f'<strong>{render_inline(text[i + 2:close])}</strong>'
+        if i > 0 and text[i - 1] == '*':
+            return None
+        end = self.run_end(i + 1)
+        if i + 1 < end < len(text) and not text.startswith('**', end):
+            return end + 1, f'<em>{render_inline(text[i + 1:end])}</em>'
+        return None
+
+    def render(self, match):
+        text = self.text
+        out = []
+        done = 0
+        while match:
+            i = match.start()
+            span = self.span(i)
+            if span is None:
+                match = INLINE_START_RE.search(text, i + 1)
+                continue
+            end, html = span
+            out.append(text[done:i])
+            out.append(html)
+            done = end
+            match = INLINE_START_RE.search(text, end)
+        if not out:
+            return text
+        out.append(text[done:])
+        return ''.join(out)
+
+
+def render_heading(line):
+    """Wrap a '#', '##' or '###' line in its heading tag"""
+    for prefix, tag in HEADINGS:
+        if line.startswith(prefix) and len(line) > len(prefix):
+            return f'<{tag}>{line[len(prefix):]}</{tag}>'
+    return line
+
+
+def table_alignments(separator):
+    """Column alignments from a separator row like '|:---|:--:|---:|'"""
+    alignments = []
+    for cell in separator.split('|')[1:-1]:
+        cell = cell.strip()
+        if cell.startswith(':') and cell.endswith(':') and len(cell) > 1:
+            alignments.append('center')
+        elif cell.endswith(':'):
+            alignments.append('right')
+        elif cell.startswith(':'):
+            alignments.append('left')
+        else:
+            alignments.append(None)
+    return alignments if any(alignments) else None
+
+
+def render_table_row(line, tag='td', alignments=None):
+    """Render one pipe-delimited table line as a row of cells
+
+    alignments (from table_alignments()) adds the block editor's alignment
+    markup to each cell.
+    """
+    cells = line.split('|')[1:-1]
+    if not alignments:
+        return '<tr>' + ''.join(f'<{tag}>{cell.strip()}</{tag}>' for cell in cells) + '</tr>'
+    parts = ['<tr>']
+    for i, cell in enumerate(cells):
+        align = alignments[i] if i < len(alignments) else None
+        if align:
+            parts.append(f'<{tag} class="has-text-align-{align}" data-align="{align}">'
+                         f'{cell.strip()}</{tag}>')
+        else:
+            parts.append(f'<{tag}>{cell.strip()}</{tag}>')
+    parts.append('</tr>')
+    return ''.join(parts)
+
+
+def _table_start(line):
+    """Return the offset of a table header in line, or -1"""
+    start = line.find('|')
+    if start < 0 or not line.endswith('|') or len(line) - start < 3:
+        return -1
+    return start
+
+
+def _is_separator(line):
+    return (len(line) >= 3 and line[0] == '|' and line[-1] == '|'
+            and SEPARATOR_CHARS.issuperset(line))
+
+
+def _row_end(line):
+    """Return the index just past a table row in line, or -1"""
+    if not line.startswith('|'):
+        return -1
+    end = line.rfind('|')
+    return end + 1 if end >= 2 else -1
+
+
+class BudgetExceeded(Exception):
+    """Raised when a document is too large or too slow to convert"""
+
+
+class Budget:
+    """Size and time limits for converting one document
+
+    max_size counts characters of markdown, max_seconds the time spent in
+    the converter (not waiting for the consumer of the HTML); 0 or None
+    disables a limit.  Conversion stops with BudgetExceeded at the first
+    line over the limit.
+    """
+
+    def __init__(self, max_size=MAX_DOCUMENT_SIZE, max_seconds=MAX_CONVERT_SECONDS):
+        self.max_size = max_size
+        self.max_seconds = max_seconds
+
+    def check_size(self, size):
+        if self.max_size and size > self.max_size:
+            raise BudgetExceeded(f'document is larger than {self.max_size} characters')
+
+    def meter(self):
+        return _Meter(self)
+
+
+class _Meter:
+    """Tracks one conversion against its budget"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.seconds = 0.0
+        self.lines = 0
+
+    def add(self, lines, size, seconds):
+        self.lines += lines
+        self.size += size
+        self.seconds += seconds
+        self.budget.check_size(self.size)
+        if self.budget.max_seconds and self.seconds > self.budget.max_seconds:
+            raise BudgetExceeded(f'conversion took longer than {self.budget.max_seconds:g}s '
+                                 f'(stopped at line {self.lines})')
+
+
+def _highlighter():
+    # Imported on first use: converting without highlighting never loads it
+    from wptools.highlight import HIGHLIGHTER
+    return HIGHLIGHTER
+
+
+class _Raw(str):
+    """Rendered code: opaque to the list, table and paragraph stages"""
+
+
+class Converter:
+    """Incremental markdown converter
+
+    Feed source lines (without line terminators, as produced by
+    ``str.split('\\n')``) with feed() and call close() at the end.  Both
+    return the HTML pieces completed by that call; joining every returned
+    piece gives the full document.
+
+    Code blocks, table rows and paragraphs are passed on as soon as each of
+    their lines is seen, so memory use is bounded by the longest run of
+    text lines (capped at BLOCK_LIMIT characters), not by document size.
+    """
+
+    # Text runs longer than this are rendered early; inline spans do not
+    # cross the cut
+    BLOCK_LIMIT = 1 << 20
+    # Code lines are escaped and passed on in batches of this many
+    CODE_FLUSH_LINES = 512
+    # Code blocks longer than this many lines are not highlighted
+    HIGHLIGHT_LINES = 8 * CODE_FLUSH_LINES
+
+    def __init__(self, skip_first_h1=False, highlight=False):
+        self.skip_first_h1 = skip_first_h1
+        self.highlight = highlight
+        self.code_lang = None
+        self.started = False
+        self.held_title = None
+        self.fence = None
+        self.code = []
+        self.code_started = False
+        self.block = []
+        self.block_size = 0
+        self.list_type = None
+        self.table = None
+        self.table_state = None
+        self.table_prefix = ''
+        self.table_align = None
+        self.glue = False
+        self.first_output = True
+        self.need_newline = False
+        self.chunk_started = False
+        self.chunk_wrapped = False
+        self.held = ''
+        self.split_ready = False
+        self.out = []
+
+    # -- input ---------------------------------------------------------------
+
+    def feed(self, line):
+        """Consume one source line and return the finished HTML pieces"""
+        if not self.started:
+            self.started = True
+            if self.skip_first_h1 and line.startswith('# ') and len(line) > 2:
+                # Only dropped when another line follows, like '^# .+\n'
+                self.held_title = line
+                return self._drain()
+        elif self.held_title is not None:
+            self.held_title = None
+
+        if self.fence is not None:
+            if line.lstrip().startswith('```'):
+                self._close_fence()
+            else:
+                # Indented fences (inside list items) drop their indentation
+                indent = self.fence
+                if indent:
+                    line = line[indent:] if line[:indent].isspace() else line.lstrip()
+                self.code.append(line)
+                if self.code_lang and len(self.code) >= self.HIGHLIGHT_LINES:
+                    # Too long to hold back: stream the rest plainly
+                    self.code_lang = None
+                if not self.code_lang and len(self.code) >= self.CODE_FLUSH_LINES:
+                    self._flush_code()
+            return self._drain()
+
+        fence = FENCE_RE.match(line)
+        if fence:
+            self._flush_block()
+            self.fence = len(fence.group(1))
+            self.code_started = False
+            lang = fence.group(2)
+            self.code_lang = lang if self.highlight and _highlighter().supports(lang) else None
+            opening = f'<code class="language-{lang}">' if lang else '<code>'
+            self._emit_list_line(_Raw(f'<pre class="wp-block-code">{opening}'))
+        elif line.strip():
+            self.block.append(render_heading(line))
+            self.block_size += len(line)
+            if self.block_size > self.BLOCK_LIMIT:
+                self._flush_block()
+        else:
+            self._flush_block()
+            self._emit_list_line(line)
+        return self._drain()
+
+    def close(self):
+        """Flush everything still buffered and return the final pieces"""
+        if self.held_title is not None:
+            title, self.held_title = self.held_title, None
+            self.block.append(render_heading(title))
+        if self.fence is not None:
+            # Unclosed fence: the rest of the document is code
+            self._close_fence()
+        self._flush_block()
+        if self.list_type:
+            self._emit_block_line(f'</{self.list_type}>')
+            self.list_type = None
+        self._finish_table_input()
+        self._finish_chunk()
+        return self._drain()
+
+    def _flush_code(self):
+        code = '\n'.join(self.code)
+        code = (self.code_lang and _highlighter().highlight(self.code_lang, code)
+                or escape_code(code))
+        self.code = []
+        self._chunk_piece('\n' + code if self.code_started else code, raw=True)
+        self.code_started = True
+
+    def _close_fence(self):
+        if self.code:
+            self._flush_code()
+        self.fence = None
+        self.code_lang = None
+        self._chunk_piece('</code></pre>', raw=True)
+
+    def _drain(self):
+        out, self.out = self.out, []
+        return out
+
+    # -- state ---------------------------------------------------------------
+
+    def snapshot(self):
+        """Return the converter state between two lines as JSON text"""
+        state = dict(vars(self))
+        del state['out']
+        return json.dumps(state, sort_keys=True)
+
+    def restore(self, snapshot):
+        """Continue from a state returned by snapshot()"""
+        vars(self).update(json.loads(snapshot))
+        self.out = []
+
+    # -- inline spans --------------------------------------------------------
+
+    def _flush_block(self):
+        """Render inline spans for a run of text lines in one scan"""
+        if not self.block:
+            return
+        text = render_inline('\n'.join(self.block))
+        self.block = []
+        self.block_size = 0
+        for line in text.split('\n'):
+            self._emit_list_line(line)
+
+    # -- lists and blockquotes ----------------------------------------------
+
+    def _emit_list_line(self, line):
+        if isinstance(line, _Raw):
+            self._emit_block_line(line)
+            return
+        stripped = line.strip()
+        if stripped.startswith('- '):
+            self._open_list('ul')
+            self._emit_block_line(f'<li>{stripped[2:]}</li>')
+        elif ORDERED_ITEM_RE.match(stripped):
+            self._open_list('ol')
+            self._emit_block_line(f'<li>{stripped[line.find(".") + 2:]}</li>')
+        else:
+            if self.list_type and not stripped:
+                self._emit_block_line(f'</{self.list_type}>')
+                self.list_type = None
+            if line.startswith('> ') and len(line) > 2:
+                line = f'<blockquote>{line[2:]}</blockquote>'
+            self._emit_block_line(line)
+
+    def _open_list(self, list_type):
+        if self.list_type != list_type:
+            if self.list_type:
+                self._emit_block_line(f'</{self.list_type}>')
+            self._emit_block_line(f'<{list_type}>')
+            self.list_type = list_type
+
+    # -- tables --------------------------------------------------------------
+
+    def _emit_block_line(self, line):
+        if self.table_state is None:
+            start = -1 if isinstance(line, _Raw) else _table_start(line)
+            if start < 0:
+                self._emit_output_line(line)
+                return
+            self.table_prefix = line[:start]
+            self.table = [line[start:]]
+            self.table_state = 'header'
+            return
+
+        if self.table_state == 'rows':
+            if line == '':
+                # Blank lines between rows belong to the table
+                return
+            end = -1 if isinstance(line, _Raw) else _row_end(line)
+            if end < 0:
+                self._finish_table()
+                self._emit_output_line(line)
+                return
+            self._chunk_piece(render_table_row(line[:end], alignments=self.table_align))
+            if end < len(line):
+                self._finish_table()
+                self._emit_output_line(line[end:])
+            return
+
+        if line == '':
+            self.table.append(line)
+        elif not isinstance(line, _Raw) and self.table_state == 'header' and _is_separator(line):
+            self.table.append(line)
+            self.table_state = 'separator'
+        elif not isinstance(line, _Raw) and self.table_state == 'separator' and _row_end(line) > 0:
+            end = _row_end(line)
+            self.table.append(line[:end])
+            self._start_table()
+            if end < len(line):
+                self._finish_table()
+                self._emit_output_line(line[end:])
+        else:
+            self._abandon_table(line)
+
+    def _start_table(self):
+        """Header, separator and first row seen: from here rows stream out"""
+        lines, self.table = self.table, None
+        self.table_state = 'rows'
+        self.table_align = table_alignments(next(line for line in lines[1:] if line))
+        rows = ''.join(render_table_row(line, alignments=self.table_align)
+                       for line in lines[2:] if line.strip())
+        self._emit_output_line(
+            f'{self.table_prefix}<table class="wp-block-table"><thead>'
+            f'{render_table_row(lines[0], "th", self.table_align)}</thead><tbody>{rows}'
+        )
+
+    def _abandon_table(self, line=None):
+        """Not a table after all: replay the buffered lines as plain text"""
+        pending = self.table[1:]
+        self._emit_output_line(self.table_prefix + self.table[0])
+        self.table = None
+        self.table_state = None
+        for buffered in pending:
+            self._emit_block_line(buffered)
+        if line is not None:
+            self._emit_block_line(line)
+
+    def _finish_table(self):
+        # Trailing blank lines were consumed by the table, so whatever
+        # follows is joined straight onto it
+        self.table_state = None
+        self._chunk_piece('</tbody></table>')
+        self.glue = True
+
+    def _finish_table_input(self):
+        while self.table_state is not None:
+            if self.table_state == 'rows':
+                self._finish_table()
+            else:
+                self._abandon_table()
+
+    # -- paragraphs ----------------------------------------------------------
+
+    def _emit_output_line(self, line):
+        if self.first_output:
+            self.first_output = False
+        elif self.glue:
+            self.glue = False
+        else:
+            self._chunk_piece('\n')
+        self._chunk_piece(line, raw=isinstance(line, _Raw))
+
+    def _chunk_piece(self, text, raw=False):
+        """Split the output into paragraphs on blank lines"""
+        if not text:
+            return
+        if raw:
+            self._append(text)
+            self.split_ready = False
+            return
+        if self.split_ready and text[0] == '\n':
+            self.held = self.held[:-1]
+            self._finish_chunk()
+            text = text[1:]
+        parts = text.split('\n\n')
+        for part in parts[:-1]:
+            self._append(part)
+            self._finish_chunk()
+        self._append(parts[-1])
+        self.split_ready = parts[-1].endswith('\n')
+
+    def _append(self, text):
+        """Add text to the current paragraph, holding back its edge whitespace"""
+        body = text.rstrip()
+        if not body:
+            self.held += text
+            return
+        if self.chunk_started:
+            if self.held:
+                self.out.append(self.held)
+        else:
+            body = body.lstrip()
+            self.chunk_started = True
+            if self.need_newline:
+                self.out.append('\n')
+                self.need_newline = False
+            if body[0] not in '<|':
+                self.out.append('<p>')
+                self.chunk_wrapped = True
+        self.out.append(body)
+        self.held = text[len(text.rstrip()):]
+
+    def _finish_chunk(self):
+        if self.need_newline:
+            self.out.append('\n')
+        if self.chunk_wrapped:
+            self.out.append('</p>')
+        self.need_newline = True
+        self.chunk_started = False
+        self.chunk_wrapped = False
+        self.held = ''
+        self.split_ready = False
+
+
+class BlockCache:
+    """In-memory LRU cache of converted top-level blocks
+
+    An entry maps the converter state before a block plus the block's
+    source to the HTML it produced and the state after it, so replaying
+    cached blocks gives exactly the output of a full conversion.  Meant to
+    live as long as the process, e.g. across preview re-renders.
+    """
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, html, state):
+        with self.lock:
+            self.entries[key] = (html, state)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def iter_blocks(lines):
+    """Group markdown lines into top-level blocks
+
+    A block starts at the first text line after a blank line, at a heading
+    and at a code fence; a fenced code block (with its closing fence) is
+    one block.  Blank lines stay with the block before them.
+    """
+    block = []
+    in_fence = False
+    after_fence = False
+    previous_blank = False
+    for line in lines:
+        blank = not line.strip()
+        if in_fence:
+            block.append(line)
+            if line.lstrip().startswith('```'):
+                in_fence = False
+                after_fence = True
+            continue
+        opens_fence = FENCE_RE.match(line) is not None
+        if block and not blank and (previous_blank or after_fence or opens_fence
+                                    or line.startswith('#')):
+            yield block
+            block = []
+        block.append(line)
+        in_fence = opens_fence
+        after_fence = False
+        previous_blank = blank
+    if block:
+        yield block
+
+
+def render_blocks(lines, skip_first_h1=False, cache=None, budget=None, highlight=False):
+    """Yield HTML pieces for markdown lines, reusing cached blocks
+
+    The output is identical to iter_html(); only blocks whose source or
+    preceding converter state changed are converted again.
+    """
+    converter = Converter(skip_first_h1=skip_first_h1, highlight=highlight)
+    meter = (budget or Budget()).meter()
+    if cache is None:
+        cache = BlockCache()
+    state = converter.snapshot()
+    # The converter is only brought up to date when a block has to be
+    # converted; runs of cache hits just follow the recorded states
+    current = True
+    for block in iter_blocks(lines):
+        # JSON text never contains a raw NUL, so the key is unambiguous
+        key = hashlib.sha1('\0'.join([state] + block).encode('utf-8')).digest()
+        entry = cache.get(key)
+        if entry is not None:
+            html, state = entry
+            current = False
+            meter.add(len(block), sum(len(line) + 1 for line in block), 0.0)
+            yield html
+            continue
+        started = time.perf_counter()
+        if not current:
+            converter.restore(state)
+            current = True
+        pieces = []
+        for line in block:
+            pieces.extend(converter.feed(line))
+        html = ''.join(pieces)
+        state = converter.snapshot()
+        meter.add(len(block), sum(len(line) + 1 for line in block),
+                  time.perf_counter() - started)
+        cache.put(key, html, state)
+        yield html
+    if not current:
+        converter.restore(state)
+    yield from converter.close()
+
+
+def iter_lines(stream):
+    """Yield the lines of a text stream as str.split('\\n') would, lazily"""
+    ended_with_newline = True
+    for line in stream:
+        ended_with_newline = line.endswith('\n')
+        yield line[:-1] if ended_with_newline else line
+    if ended_with_newline:
+        yield ''
+
+
+def iter_html(lines, skip_first_h1=False, budget=None, highlight=False):
+    """Yield HTML pieces for an iterable of markdown lines
+
+    Raises BudgetExceeded once the document goes over budget (by default
+    Budget(), the module-wide limits).  highlight turns on syntax
+    highlighting of fenced code.
+    """
+    converter = Converter(skip_first_h1=skip_first_h1, highlight=highlight)
+    meter = (budget or Budget()).meter()
+    for line in lines:
+        started = time.perf_counter()
+        pieces = converter.feed(line)
+        meter.add(1, len(line) + 1, time.perf_counter() - started)
+        yield from pieces
+    yield from converter.close()
+
+
+def iter_markdown_file(path, skip_first_h1=False, budget=None, highlight=False):
+    """Convert a markdown file incrementally, yielding HTML as blocks finish"""
+    with open(path, 'r') as f:
+        yield from iter_html(iter_lines(f), skip_first_h1=skip_first_h1, budget=budget,
+                             highlight=highlight)
+
+
+def document_title(path, first_line, title=None):
+    """Pick the post title for a markdown file
+
+    Uses title when given, else the first heading, else the file name.
+    Also returns whether the first line is a heading repeating the title,
+    in which case it is left out of the body.
+    """
+    first_line = first_line.strip()
+    if title is None:
+        if first_line.startswith('#'):
+            title = first_line.lstrip('#').strip()
+        else:
+            title = Path(path).stem.replace('-', ' ').title()
+    skip_first_h1 = first_line.startswith('#') and first_line.lstrip('#').strip() == title
+    return title, skip_first_h1
+
+
+def markdown_to_html(content, skip_first_h1=False, block_cache=None, budget=None,
+                     highlight=False):
+    """Convert markdown to HTML with proper formatting
+
+    With a BlockCache, unchanged blocks from earlier renders are reused.
+    highlight turns on syntax highlighting of fenced code.
+    Raises BudgetExceeded for documents over budget.
+    """
+    budget = budget or Budget()
+    # Oversized documents are refused before any work is done
+    budget.check_size(len(content))
+    lines = content.split('\n')
+    if block_cache is not None:
+        return ''.join(render_blocks(lines, skip_first_h1=skip_first_h1, cache=block_cache,
+                                     budget=budget, highlight=highlight))
+    return ''.join(iter_html(lines, skip_first_h1=skip_first_h1, budget=budget,
+                             highlight=highlight))
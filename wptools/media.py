@@ -0,0 +1,280 @@
+"""
+Local images referenced from markdown, uploaded to the media library
+
+find_images() lists the local files that a document's ![alt](src)
+references point at, and image_hashes() their content, so that a document
+counts as changed when one of its images is replaced.  MediaUploader
+uploads them on a thread pool while the document is being converted, once
+per content: a SQLite index maps the hash of each file (with the resize
+settings) to the media item it became, and uploads of the same content
+already running are shared, so an image used by twenty documents is
+uploaded once.  rewrite_sources() then points the <img> tags at the
+uploaded URLs.
+
+With Pillow installed, images wider than max_width are scaled down and
+re-encoded before they are uploaded (kept as they are if that does not
+make them smaller).
+"""
+
+import functools
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+from wptools.manifest import file_hash
+from wptools.markdown import FENCE_RE
+from wptools.metrics import METRICS
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DEFAULT_PATH = os.path.expanduser('~/.cache/wp-publisher/media.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media (
+    site TEXT NOT NULL,
+    key TEXT NOT NULL,
+    media_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    uploaded_at REAL,
+    PRIMARY KEY (site, key)
+)
+'''
+
+# ![alt](src) as the converter reads it: src runs to the first ')'
+IMAGE_RE = re.compile(r'!\[[^\]]*\]\(([^)]+)\)')
+
+IMG_SRC_RE = re.compile(r'(<img src=")([^"]*)(")')
+
+# Formats Pillow re-encodes, and the options it saves them with
+REENCODE_OPTIONS = {'JPEG': {'optimize': True}, 'PNG': {'optimize': True},
+                    'WEBP': {'method': 6}}
+
+
+def is_local(src):
+    """True for references to files rather than URLs (http:, data:, //host)"""
+    return not (urlsplit(src).scheme or src.startswith('//'))
+
+
+def find_images(md_file):
+    """Return {src: path} for the local images md_file references
+
+    Relative paths are taken from the file's directory; references in
+    fenced code and to files that do not exist are left out.
+    """
+    directory = os.path.dirname(os.path.abspath(md_file))
+    images = {}
+    in_fence = False
+    with open(md_file, 'r') as f:
+        for line in f:
+            if FENCE_RE.match(line):
+                in_fence = not in_fence
+                continue
+            if in_fence or '![' not in line:
+                continue
+            for match in IMAGE_RE.finditer(line):
+                src = match.group(1)
+                if src in images or not is_local(src):
+                    continue
+                path = os.path.join(directory, unquote(urlsplit(src).path))
+                if os.path.isfile(path):
+                    images[src] = os.path.normpath(path)
+                else:
+                    METRICS.log('image_missing', source=md_file, src=src)
+    return images
+
+
+# Content hashes of image files by (path, mtime, size), for this process
+_hashes = {}
+
+
+def image_hashes(md_file):
+    """Return {src: SHA-256 of the file} for the local images md_file references
+
+    Each file is hashed once per process for as long as its mtime and size
+    stay the same.
+    """
+    hashes = {}
+    for src, path in find_images(md_file).items():
+        stat = os.stat(path)
+        path_key = (path, stat.st_mtime, stat.st_size)
+        if path_key not in _hashes:
+            _hashes[path_key] = file_hash(path)
+        hashes[src] = _hashes[path_key]
+    return hashes
+
+
+def rewrite_sources(html, urls):
+    """Replace the src of <img> tags found in urls ({src: url})"""
+    if not urls:
+        return html
+    return IMG_SRC_RE.sub(lambda m: m.group(1) + urls.get(m.group(2), m.group(2)) + m.group(3),
+                          html)
+
+
+def shrink(data, max_width, quality=85):
+    """Scale an image down to max_width and re-encode it; returns bytes
+
+    The original data is returned when Pillow is missing or cannot read
+    it, the format is not one it re-encodes, or the result would not be
+    smaller.
+    """
+    if Image is None or not max_width:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+            if image_format not in REENCODE_OPTIONS:
+                return data
+            if image.width > max_width:
+                height = max(1, round(image.height * max_width / image.width))
+                image = image.resize((max_width, height), Image.LANCZOS)
+            options = dict(REENCODE_OPTIONS[image_format])
+            if image_format in ('JPEG', 'WEBP'):
+                options['quality'] = quality
+            out = io.BytesIO()
+            image.save(out, image_format, **options)
+    except (OSError, ValueError):
+        # Not an image Pillow can read: upload it as it is
+        return data
+    smaller = out.getvalue()
+    return smaller if len(smaller) < len(data) else data
+
+
+class MediaIndex:
+    """Thread-safe map from image content to the media item of one site"""
+
+    def __init__(self, path=DEFAULT_PATH, site=''):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.site = site
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute(SCHEMA)
+
+    def get(self, key):
+        """Return (media_id, url) uploaded for key, or None"""
+        with self.lock:
+            row = self.db.execute('SELECT media_id, url FROM media WHERE site = ? AND key = ?',
+                                  (self.site, key)).fetchone()
+        return tuple(row) if row else None
+
+    def record(self, key, media_id, url):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?)',
+                            (self.site, key, media_id, url, time.time()))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class MediaUploader:
+    """Upload the images of documents in the background, each content once
+
+    index (a MediaIndex, or None to remember uploads for this process
+    only) survives between runs.  max_width and quality are passed to
+    shrink(); 0 uploads files as they are.
+    """
+
+    def __init__(self, client, index=None, concurrency=4, max_width=0, quality=85):
+        self.client = client
+        self.index = index
+        self.max_width = max_width
+        self.quality = quality
+        self.pool = ThreadPoolExecutor(concurrency, thread_name_prefix='media')
+        self.lock = threading.Lock()
+        self.by_path = {}
+        self.by_key = {}
+        self.uploaded = 0
+        self.reused = 0
+
+    def submit(self, md_file):
+        """Start uploading md_file's local images; returns {src: future url}"""
+        futures = {}
+        for src, path in find_images(md_file).items():
+            stat = os.stat(path)
+            path_key = (path, stat.st_mtime, stat.st_size)
+            with self.lock:
+                future = self.by_path.get(path_key)
+                started = future is None
+                if started:
+                    future = self.by_path[path_key] = self.pool.submit(self._publish, path)
+            if started:
+                future.add_done_callback(functools.partial(self._failed, path_key))
+            futures[src] = future
+        return futures
+
+    def _failed(self, path_key, future):
+        # Try failed uploads again the next time the image is needed
+        if future.exception() is not None:
+            with self.lock:
+                if self.by_path.get(path_key) is future:
+                    del self.by_path[path_key]
+
+    def urls(self, futures):
+        """Wait for submit()'s uploads; returns {src: url}
+
+        Raises the first upload error (a WordPressError or OSError).
+        """
+        return {src: future.result() for src, future in futures.items()}
+
+    def _publish(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        options = f'{self.max_width}:{self.quality}' if self.max_width and Image else ''
+        key = f'{hashlib.sha256(data).hexdigest()}:{options}'
+        with self.lock:
+            future = self.by_key.get(key)
+            owner = future is None
+            if owner:
+                future = self.by_key[key] = Future()
+        if not owner:
+            # The same content under another name is on its way
+            return future.result()
+        try:
+            url = self._upload(key, path, data)
+        except BaseException as e:
+            with self.lock:
+                del self.by_key[key]
+            future.set_exception(e)
+            raise
+        future.set_result(url)
+        return url
+
+    def _upload(self, key, path, data):
+        known = self.index.get(key) if self.index is not None else None
+        if known is not None:
+            with self.lock:
+                self.reused += 1
+            METRICS.count('media', action='reused')
+            return known[1]
+        with METRICS.timer('media_upload'):
+            body = shrink(data, self.max_width, self.quality)
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            item = self.client.upload(os.path.basename(path), body, content_type)
+        if self.index is not None:
+            self.index.record(key, item['id'], item['source_url'])
+        with self.lock:
+            self.uploaded += 1
+        METRICS.count('media', action='uploaded')
+        METRICS.log('media_uploaded', source=path, media_id=item['id'], bytes=len(body),
+                    original_bytes=len(data))
+        return item['source_url']
+
+    def summary(self):
+        """One-line upload report"""
+        return f'{self.uploaded} uploaded, {self.reused} already on the site'
+
+    def close(self):
+        self.pool.shutdown(wait=True)
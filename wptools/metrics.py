@@ -0,0 +1,211 @@
+"""
+Per-stage timings and counters for the publish pipeline
+
+Stages (conversion, payload build, request, response parse, ...) are
+timed into histograms and counters track bytes, requests and retries.
+The collected data can be printed, appended to a JSON-lines log as each
+event happens, and written as a Prometheus textfile for node_exporter's
+textfile collector.
+
+Environment:
+    WP_METRICS_LOG       JSON-lines event log (a path, or '-' for stderr)
+    WP_METRICS_TEXTFILE  Prometheus textfile written when the run ends
+    WP_PROFILE           'cprofile', 'tracemalloc' or both, comma-separated
+    WP_PROFILE_OUTPUT    where cProfile stats are saved (default wp-publisher.prof)
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+# Histogram buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PREFIX = 'wptools'
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    inner = ','.join(f'{name}="{str(value).replace(chr(34), chr(39))}"'
+                     for name, value in sorted(labels))
+    return '{' + inner + '}'
+
+
+class Metrics:
+    """Thread-safe registry of stage histograms and counters"""
+
+    def __init__(self, log_path=None):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.log_file = None
+        if log_path == '-':
+            self.log_file = sys.stderr
+        elif log_path:
+            self.log_file = open(log_path, 'a')
+
+    # -- recording -----------------------------------------------------------
+
+    def observe(self, stage, seconds, **labels):
+        """Record one duration for a stage"""
+        key = (stage, tuple(sorted(labels.items())))
+        with self.lock:
+            entry = self.stages.get(key)
+            if entry is None:
+                entry = self.stages[key] = {'count': 0, 'sum': 0.0, 'max': 0.0,
+                                            'buckets': [0] * len(BUCKETS)}
+            entry['count'] += 1
+            entry['sum'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry['buckets'][i] += 1
+        self.log('stage', stage=stage, seconds=round(seconds, 6), **labels)
+
+    def count(self, name, value=1, **labels):
+        """Add value to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, stage, **labels):
+        """Time the body of a with block as one stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, **labels)
+
+    def timed_iter(self, stage, iterable, **labels):
+        """Pass items through, timing only the work of producing them
+
+        Useful for generators consumed by a streaming request, where
+        production and sending interleave.
+        """
+        spent = 0.0
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                spent += time.perf_counter() - started
+                break
+            spent += time.perf_counter() - started
+            yield item
+        self.observe(stage, spent, **labels)
+
+    def log(self, event, **fields):
+        """Append one structured event to the JSON log, if enabled"""
+        if self.log_file is None:
+            return
+        record = dict(ts=round(time.time(), 6), event=event, **fields)
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.log_file.write(line + '\n')
+            self.log_file.flush()
+
+    # -- output --------------------------------------------------------------
+
+    def snapshot(self):
+        """Return all stages and counters as plain data"""
+        with self.lock:
+            stages = [dict(stage=stage, labels=dict(labels), count=entry['count'],
+                           sum=entry['sum'], max=entry['max'])
+                      for (stage, labels), entry in sorted(self.stages.items())]
+            counters = [dict(name=name, labels=dict(labels), value=value)
+                        for (name, labels), value in sorted(self.counters.items())]
+        return {'stages': stages, 'counters': counters}
+
+    def prometheus(self):
+        """Render the metrics in the Prometheus text exposition format"""
+        lines = [f'# HELP {PREFIX}_stage_seconds Time spent per publish pipeline stage',
+                 f'# TYPE {PREFIX}_stage_seconds histogram']
+        with self.lock:
+            for (stage, labels), entry in sorted(self.stages.items()):
+                labels = (('stage', stage),) + labels
+                for bound, count in zip(BUCKETS, entry['buckets']):
+                    lines.append(f'{PREFIX}_stage_seconds_bucket'
+                                 f'{_label_text(labels + (("le", bound),))} {count}')
+                lines.append(f'{PREFIX}_stage_seconds_bucket'
+                             f'{_label_text(labels + (("le", "+Inf"),))} {entry["count"]}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{_label_text(labels)} {entry["sum"]:.6f}')
+                lines.append(f'{PREFIX}_stage_seconds_count{_label_text(labels)} {entry["count"]}')
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f'{PREFIX}_{name}_total{_label_text(labels)} {value}')
+        lines.append(f'# TYPE {PREFIX}_last_run_timestamp_seconds gauge')
+        lines.append(f'{PREFIX}_last_run_timestamp_seconds {time.time():.0f}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Write the Prometheus textfile atomically"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(temp, path)
+
+    def summary(self):
+        """One line per stage: count, total and slowest duration"""
+        lines = []
+        for stage in self.snapshot()['stages']:
+            labels = ','.join(f'{k}={v}' for k, v in sorted(stage['labels'].items()))
+            name = f"{stage['stage']}[{labels}]" if labels else stage['stage']
+            lines.append(f"{name:<24} {stage['count']:>5}x  {stage['sum']:8.3f}s total  "
+                         f"{stage['max']:7.3f}s max")
+        for counter in self.snapshot()['counters']:
+            labels = ','.join(f'{k}={v}' for k, v in sorted(counter['labels'].items()))
+            name = f"{counter['name']}[{labels}]" if labels else counter['name']
+            lines.append(f"{name:<24} {counter['value']:>14}")
+        return lines
+
+
+# Shared by the client, the converter callers and the scripts
+METRICS = Metrics(os.environ.get('WP_METRICS_LOG'))
+
+
+@contextlib.contextmanager
+def profiling(modes=None, output=None):
+    """Profile the body with cProfile and/or tracemalloc
+
+    modes defaults to $WP_PROFILE; nothing happens when it is empty.
+    """
+    modes = {mode.strip() for mode in (modes if modes is not None
+                                       else os.environ.get('WP_PROFILE', '')).split(',')
+             if mode.strip()}
+    output = output or os.environ.get('WP_PROFILE_OUTPUT', 'wp-publisher.prof')
+    profiler = None
+    if 'cprofile' in modes:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if 'tracemalloc' in modes:
+        import tracemalloc
+        tracemalloc.start(25)
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            import pstats
+            profiler.disable()
+            profiler.dump_stats(output)
+            print(f"\n🔬 cProfile stats saved to {output}", file=sys.stderr)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(15)
+        if 'tracemalloc' in modes:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"\n🔬 tracemalloc peak: {peak / 1e6:.1f} MB, top allocations:",
+                  file=sys.stderr)
+            for stat in snapshot.statistics('lineno')[:10]:
+                print(f"   {stat}", file=sys.stderr)
@@ -0,0 +1,113 @@
+"""
+Pagination of oversized posts
+
+paginate() cuts converted HTML into pages of at most max_bytes (UTF-8)
+and max_blocks top-level blocks.  Pages only ever start at a top-level
+<h2>, never inside code blocks, tables, lists, quotes or paragraphs (the
+converter leaves a heading that directly follows a line of text inside
+its <p>).  Sections are packed greedily, and a single section over
+budget becomes a page of its own.  The pages are then either joined
+with WordPress's <!--nextpage--> marker into one post (join_pages) or
+published as a series of posts linked by series_nav().
+"""
+
+import re
+from html import escape
+
+NEXTPAGE = '<!--nextpage-->'
+
+# Elements that can contain other blocks: no page starts inside them
+CONTAINER_TAGS = ('pre', 'table', 'ul', 'ol', 'blockquote', 'p')
+
+BLOCK_TAGS = CONTAINER_TAGS + ('h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'div')
+
+TAG_RE = re.compile(r'<(/?)(%s)\b[^>]*>' % '|'.join(BLOCK_TAGS))
+
+
+def sections(html):
+    """Split HTML before every top-level <h2>; returns [(html, blocks)]
+
+    blocks counts the top-level block elements of each section.  The
+    lead-in before the first <h2> stays with that section, so no page is
+    only an introduction.
+    """
+    found = []
+    start = 0
+    blocks = 0
+    headed = False
+    depth = 0
+    for match in TAG_RE.finditer(html):
+        closing, tag = match.group(1), match.group(2)
+        if tag in CONTAINER_TAGS:
+            if closing:
+                depth = max(0, depth - 1)
+                continue
+            depth += 1
+            if depth > 1:
+                continue
+        elif closing or depth:
+            continue
+        if tag == 'h2':
+            if headed and match.start() > start:
+                found.append((html[start:match.start()], blocks))
+                start, blocks = match.start(), 0
+            headed = True
+        blocks += 1
+    found.append((html[start:], blocks))
+    return found
+
+
+def paginate(html, max_bytes=0, max_blocks=0):
+    """Cut HTML into pages within the budget (0: no limit); returns a list
+
+    A document within budget comes back as a single page.
+    """
+    if not max_bytes and not max_blocks:
+        return [html]
+    pages = []
+    page, size, blocks = [], 0, 0
+    for section, count in sections(html):
+        section_size = len(section.encode('utf-8'))
+        over = ((max_bytes and size + section_size > max_bytes)
+                or (max_blocks and blocks + count > max_blocks))
+        if page and over:
+            pages.append(''.join(page))
+            page, size, blocks = [], 0, 0
+        page.append(section)
+        size += section_size
+        blocks += count
+    pages.append(''.join(page))
+    return pages
+
+
+def join_pages(pages):
+    """One post body with a page break between the pages"""
+    return f'\n{NEXTPAGE}\n'.join(page.strip('\n') for page in pages)
+
+
+def page_sizes(pages):
+    """UTF-8 size of each page in bytes"""
+    return [len(page.encode('utf-8')) for page in pages]
+
+
+def format_sizes(sizes):
+    """'3 pages: 180.2, 190.0, 60.5 KB'"""
+    return f"{len(sizes)} pages: {', '.join(f'{size / 1024:.1f}' for size in sizes)} KB"
+
+
+def series_nav(links, current):
+    """Links between the parts of a series; links are the parts' URLs in order"""
+    parts = []
+    for number, link in enumerate(links, 1):
+        if number == current:
+            parts.append(f'<strong>Part {number}</strong>')
+        else:
+            parts.append(f'<a href="{escape(link)}">Part {number}</a>')
+    return f'<p class="wp-series-nav">{" · ".join(parts)}</p>'
+
+
+def series_page(page, links, current):
+    """A part of a series with the navigation above and below it"""
+    nav = series_nav(links, current)
+    body = page.strip('\n')
+    return f'{nav}\n{body}\n{nav}'
@@ -0,0 +1,221 @@
+"""
+Local index of a site's posts
+
+A SQLite table mirrors every post's id, slug, title, status, modified
+time, link and a hash of its content.  sync() only asks for posts
+modified since the newest one already indexed (modified_after), so an
+up-to-date index costs one request; a full sweep every FULL_SYNC_AGE
+seconds drops posts that were deleted or trashed since.  Lookups by slug
+or title are then local queries, and checks over every post (such as
+fix-wordpress-posts.py) can limit themselves to posts whose content
+changed since they last looked.
+"""
+
+import hashlib
+import html
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from wptools.scan import fetch_all
+
+DEFAULT_PATH = os.path.expanduser('~/.cache/wp-publisher/posts.sqlite')
+
+# Seconds between full sweeps
+FULL_SYNC_AGE = 7 * 24 * 3600
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS posts (
+    site TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    slug TEXT,
+    title TEXT,
+    title_key TEXT,
+    status TEXT,
+    modified TEXT,
+    link TEXT,
+    content_hash TEXT,
+    PRIMARY KEY (site, id)
+);
+CREATE INDEX IF NOT EXISTS posts_slug ON posts (site, slug);
+CREATE INDEX IF NOT EXISTS posts_title ON posts (site, title_key);
+CREATE TABLE IF NOT EXISTS syncs (
+    site TEXT PRIMARY KEY,
+    watermark TEXT,
+    synced_at REAL,
+    full_at REAL
+);
+CREATE TABLE IF NOT EXISTS checks (
+    site TEXT NOT NULL,
+    name TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    content_hash TEXT,
+    flagged INTEGER NOT NULL,
+    PRIMARY KEY (site, name, id)
+);
+'''
+
+COLUMNS = ('id', 'slug', 'title', 'status', 'modified', 'link', 'content_hash')
+
+
+def title_key(title):
+    """Case- and whitespace-insensitive form of a title for lookups"""
+    return ' '.join(html.unescape(title or '').split()).casefold()
+
+
+def post_title(post):
+    """A post's title as text: raw when fetched in the edit context"""
+    title = post.get('title') or {}
+    return title['raw'] if 'raw' in title else html.unescape(title.get('rendered', ''))
+
+
+def content_hash(post):
+    """SHA-256 of a post's content as returned by the API (raw if fetched)"""
+    content = post.get('content') or {}
+    text = content['raw'] if 'raw' in content else content.get('rendered', '')
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class PostIndex:
+    """Thread-safe index of the posts of one site
+
+    With edit set (the client must be authenticated) drafts and private
+    posts are indexed too and titles and content are compared raw.
+    """
+
+    def __init__(self, client, path=DEFAULT_PATH, site='', edit=True, full_sync_age=FULL_SYNC_AGE):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.client = client
+        self.site = site
+        self.edit = edit
+        self.full_sync_age = full_sync_age
+        self.lock = threading.Lock()
+        # One sync at a time; the others wait and find the index fresh
+        self.sync_lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.executescript(SCHEMA)
+
+    @property
+    def fields(self):
+        part = 'raw' if self.edit else 'rendered'
+        return ('id', 'slug', 'status', 'modified', 'link', f'title.{part}', f'content.{part}')
+
+    # -- sync ----------------------------------------------------------------
+
+    def state(self):
+        """The last sync of this site: watermark, synced_at, full_at (or None)"""
+        with self.lock:
+            row = self.db.execute('SELECT * FROM syncs WHERE site = ?', (self.site,)).fetchone()
+        return dict(row) if row else None
+
+    def sync(self, full=False, max_age=0, fields=(), concurrency=4):
+        """Fetch the posts changed since the last sync; returns the changed ones
+
+        Posts modified in the same second as the newest one indexed are
+        fetched again (modified_after is exclusive and has one-second
+        resolution) but only returned if they differ.  Nothing is fetched
+        if the last sync is less than max_age seconds old.  fields are
+        extra fields to fetch for the caller's own use.
+        A full sweep replaces the index when full is set, on the first
+        sync and when the last one is older than full_sync_age.
+        """
+        with self.sync_lock:
+            state = self.state()
+            now = time.time()
+            if not full and state and max_age and now - state['synced_at'] < max_age:
+                return []
+            full = full or state is None or now - state['full_at'] > self.full_sync_age
+            params = {'status': 'any', 'context': 'edit'} if self.edit else {}
+            if not full and state['watermark']:
+                # Exclusive bound: step back a second for posts saved in the
+                # same second as the newest one indexed
+                since = datetime.fromisoformat(state['watermark']) - timedelta(seconds=1)
+                params['modified_after'] = since.isoformat(timespec='seconds')
+            wanted = tuple(dict.fromkeys(self.fields + tuple(fields)))
+            posts = fetch_all(self.client, '/posts', fields=wanted, params=params,
+                              concurrency=concurrency)
+            rows = [(self.site, post['id'], post.get('slug'), post_title(post),
+                     title_key(post_title(post)), post.get('status'), post.get('modified'),
+                     post.get('link'), content_hash(post)) for post in posts]
+            with self.lock:
+                known = {row[0]: (row[1], row[2]) for row in self.db.execute(
+                    'SELECT id, modified, content_hash FROM posts WHERE site = ?', (self.site,))}
+            changed = [post for post, row in zip(posts, rows)
+                       if known.get(post['id']) != (row[6], row[8])]
+            modified = [post['modified'] for post in posts if post.get('modified')]
+            watermark = max(modified + ([state['watermark']] if state and not full
+                                        and state['watermark'] else []), default=None)
+            with self.lock, self.db:
+                if full:
+                    self.db.execute('DELETE FROM posts WHERE site = ?', (self.site,))
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self.db.execute(
+                    'INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?)',
+                    (self.site, watermark, now, now if full else state['full_at']))
+            return changed
+
+    def remember(self, post_id, title=None, slug=None, link=None):
+        """Add a post just created here, until the next sync fills it in"""
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR IGNORE INTO posts (site, id, slug, title, title_key, link)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (self.site, post_id, slug, title, title_key(title), link))
+
+    # -- lookup --------------------------------------------------------------
+
+    def _rows(self, where, args):
+        with self.lock:
+            rows = self.db.execute(f'SELECT {", ".join(COLUMNS)} FROM posts WHERE site = ? AND '
+                                   f'{where} ORDER BY id', (self.site,) + args).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, post_id):
+        rows = self._rows('id = ?', (post_id,))
+        return rows[0] if rows else None
+
+    def find(self, title=None, slug=None):
+        """Posts whose title (ignoring case and spacing) or slug matches"""
+        if slug is not None:
+            return self._rows('slug = ?', (slug,))
+        return self._rows('title_key = ?', (title_key(title),))
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM posts WHERE site = ?',
+                                   (self.site,)).fetchone()[0]
+
+    # -- checks --------------------------------------------------------------
+
+    def pending(self, name):
+        """Ids of posts a check has to look at again
+
+        Those never checked, those whose content changed since, and those
+        it flagged last time.
+        """
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT p.id FROM posts p LEFT JOIN checks c ON c.site = p.site AND c.id = p.id'
+                ' AND c.name = ? WHERE p.site = ? AND (c.id IS NULL OR c.flagged'
+                ' OR c.content_hash IS NOT p.content_hash) ORDER BY p.id',
+                (name, self.site)).fetchall()
+        return [row[0] for row in rows]
+
+    def record_checks(self, name, results):
+        """Store a check's verdicts, {post id: flagged}, against the current content"""
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO checks VALUES (?, ?, ?,'
+                ' (SELECT content_hash FROM posts WHERE site = ? AND id = ?), ?)',
+                [(self.site, name, post_id, self.site, post_id, int(flagged))
+                 for post_id, flagged in results.items()])
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,218 @@
+"""
+Retries, adaptive concurrency and a circuit breaker for API requests
+
+WordPressClient runs every request attempt through these:
+
+- RetryPolicy decides whether a failed attempt is tried again and how
+  long to wait first: jittered exponential backoff, or the server's
+  Retry-After when it sends one.
+- AdaptiveLimiter caps the requests in flight with AIMD: the limit grows
+  by one per round of quick answers and is cut when the server throttles,
+  fails or slows down, so a bulk run finds the rate a site can take.
+- CircuitBreaker makes the client fail every request at once after a
+  run of failed attempts, so a bulk run stops quickly while the site is
+  down, and lets a single probe through after a cool-down.
+"""
+
+import email.utils
+import random
+import re
+import threading
+import time
+
+from wptools.metrics import METRICS
+
+# The server refused the request without doing it: always safe to resend
+RETRY_STATUSES = (429, 503)
+
+# The request may have been done: only resent when repeating it is harmless
+IDEMPOTENT_RETRY_STATUSES = (502, 504)
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+# POSTs to an existing item update it in place, so repeating them is harmless
+ITEM_PATH_RE = re.compile(r'/\d+$')
+
+
+def is_idempotent(method, path):
+    """True when sending the request twice has the same effect as once"""
+    return method in IDEMPOTENT_METHODS or (method == 'POST' and bool(ITEM_PATH_RE.search(path)))
+
+
+def retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header (seconds or an HTTP date)"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - (time.time() if now is None else now))
+
+
+class RetryPolicy:
+    """When to retry a request attempt, and how long to wait before it
+
+    Backoff is "full jitter": a random wait up to base * 2**attempt,
+    capped at max_delay.  A Retry-After header replaces the backoff; one
+    longer than max_wait ends the retries instead.  attempts counts the
+    first try, so 1 disables retrying.
+    """
+
+    def __init__(self, attempts=5, base=0.5, max_delay=30.0, max_wait=120.0, seed=None):
+        self.attempts = max(1, attempts)
+        self.base = base
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.random = random.Random(seed)
+
+    def retryable(self, status, idempotent):
+        """Whether an attempt that got status (None: no answer) may be retried"""
+        if status in RETRY_STATUSES:
+            return True
+        return idempotent and (status is None or status in IDEMPOTENT_RETRY_STATUSES)
+
+    def delay(self, attempt, retry_after_value=None):
+        """Seconds to wait before retry number attempt (1-based), or None to give up"""
+        if attempt >= self.attempts:
+            return None
+        wait = retry_after(retry_after_value)
+        if wait is not None:
+            if wait > self.max_wait:
+                return None
+            # Spread the clients that were all told the same time
+            return wait + self.random.uniform(0, self.base)
+        return self.random.uniform(0, min(self.max_delay, self.base * 2 ** (attempt - 1)))
+
+
+class AdaptiveLimiter:
+    """AIMD limit on the requests in flight
+
+    Each answer in good time adds 1/limit (one per round); a throttled or
+    failed attempt multiplies the limit by backoff, and an answer slower
+    than tolerance times the usual latency for that kind of request by
+    slowdown.  Only attempts started after the last cut can cut again, so
+    one burst of bad answers counts once.  The usual latency is the
+    fastest seen, drifting slowly towards recent answers.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, backoff=0.5, slowdown=0.9,
+                 tolerance=2.0, drift=0.01):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.slowdown = slowdown
+        self.tolerance = tolerance
+        self.drift = drift
+        self.in_flight = 0
+        self.baselines = {}
+        self.last_cut = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot; returns the time the attempt started"""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, key, outcome):
+        """Free a slot and adjust the limit
+
+        outcome is 'ok' (answered; its latency is compared with the usual
+        one for key), 'throttled', 'failed', or None when the attempt was
+        abandoned for a reason of its own and says nothing about the site.
+        """
+        latency = time.monotonic() - started
+        with self.condition:
+            self.in_flight -= 1
+            if outcome is None:
+                pass
+            elif outcome == 'ok':
+                baseline = self.baselines.get(key)
+                if baseline is None or latency < baseline:
+                    self.baselines[key] = latency
+                else:
+                    self.baselines[key] = baseline + (latency - baseline) * self.drift
+                if baseline is not None and latency > baseline * self.tolerance:
+                    self._cut(started, self.slowdown, 'slow')
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                self._cut(started, self.backoff, outcome)
+            self.condition.notify_all()
+
+    def _cut(self, started, factor, reason):
+        if started < self.last_cut:
+            return
+        self.last_cut = time.monotonic()
+        self.limit = max(self.minimum, self.limit * factor)
+        METRICS.count('concurrency_cuts', reason=reason)
+        METRICS.log('concurrency', limit=round(self.limit, 2), reason=reason)
+
+
+class CircuitBreaker:
+    """Refuse requests for cooldown seconds after threshold failures in a row
+
+    Once the cool-down is over one request is let through as a probe: an
+    answer closes the circuit again, a failure reopens it.  While the
+    circuit is open only the probe's result counts; attempts that were
+    already in flight when it opened say nothing about the site now.
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before(self):
+        """Return (wait, probe) for a request about to go out
+
+        wait is None if it may go out now, else seconds until it may;
+        probe is True when it is the one request let through after the
+        cool-down, and must be passed back to record with its result.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return None, False
+            waited = time.monotonic() - self.opened_at
+            if waited >= self.cooldown and not self.probing:
+                self.probing = True
+                return None, True
+            return max(0.0, self.cooldown - waited), False
+
+    def record(self, ok, probe=False):
+        """Record whether an attempt got an answer from a working site
+
+        None means the attempt was abandoned and says nothing either way;
+        an abandoned probe lets the next request probe instead.
+        """
+        with self.lock:
+            if probe:
+                self.probing = False
+            elif self.opened_at is not None:
+                return
+            if ok is None:
+                return
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    METRICS.count('circuit_opened')
+                    METRICS.log('circuit', state='open', failures=self.failures)
+                self.opened_at = time.monotonic()
@@ -0,0 +1,154 @@
+"""
+Paginated post scanner
+
+Reads the page count from X-WP-TotalPages, fetches the remaining pages
+concurrently and runs detection on each page as it arrives.  Progress is
+appended to a JSON-lines checkpoint after every page, so an interrupted
+scan resumes with the pages it has not seen yet.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from wptools.client import WordPressError
+
+# Stable order, so concurrent page requests do not shift under each other
+SCAN_PARAMS = {'orderby': 'id', 'order': 'asc'}
+
+
+def fetch_page(client, page, per_page=100, params=None, fields=None, path='/posts'):
+    """Return (items, total_pages) for one page of a collection"""
+    query = dict(SCAN_PARAMS, **(params or {}), page=page, per_page=per_page)
+    try:
+        _, headers, posts = client.request('GET', path, params=query, fields=fields)
+    except WordPressError as e:
+        # Posts deleted since the first page can leave later pages empty
+        if page > 1 and isinstance(e.data, dict) and \
+                e.data.get('code') == 'rest_post_invalid_page_number':
+            return [], page - 1
+        raise
+    return posts or [], int(headers.get('X-WP-TotalPages') or 1)
+
+
+def fetch_all(client, path, fields=None, params=None, per_page=100, concurrency=4):
+    """Return every item of a collection, fetching pages after the first in parallel"""
+    items, total_pages = fetch_page(client, 1, per_page, params, fields, path)
+    if total_pages > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            pages = pool.map(
+                lambda page: fetch_page(client, page, per_page, params, fields, path)[0],
+                range(2, total_pages + 1))
+            for page_items in pages:
+                items.extend(page_items)
+    return items
+
+
+class ScanCheckpoint:
+    """Append-only record of scanned pages and the posts they matched
+
+    The first line identifies the scan; each further line holds one page.
+    A line cut short by a crash is dropped before new pages are appended,
+    and a checkpoint written for different scan settings is discarded.
+    """
+
+    def __init__(self, path, scan):
+        self.path = path
+        self.scan = scan
+        self.total_pages = None
+        self.pages = {}
+        self._load()
+        self.file = open(path, 'a')
+        if os.path.getsize(path) == 0:
+            self._write({'scan': scan})
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if not data.endswith(b'\n'):
+                # Cut the unfinished line, so the next record starts a line
+                # of its own instead of running on from it
+                data = data[:data.rfind(b'\n') + 1]
+                f.truncate(len(data))
+        lines = data.decode('utf-8', 'replace').split('\n')
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get('scan') != self.scan:
+            os.remove(self.path)
+            return
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            self.total_pages = record['total_pages']
+            self.pages[record['page']] = record['matches']
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def add(self, page, total_pages, matches):
+        self.total_pages = total_pages
+        self.pages[page] = matches
+        self._write({'page': page, 'total_pages': total_pages, 'matches': matches})
+
+    def remove(self):
+        """Drop the checkpoint once the scan is complete"""
+        self.file.close()
+        os.remove(self.path)
+
+    def close(self):
+        self.file.close()
+
+
+def scan_posts(client, detect, fields=None, per_page=100, concurrency=4, params=None,
+               checkpoint_path=None):
+    """Yield every post for which detect(post) is true
+
+    Matches are yielded page by page as pages arrive (not in id order).
+    With checkpoint_path, matches from pages scanned by an interrupted run
+    are yielded first and those pages are not fetched again; the
+    checkpoint is removed when the scan completes.
+    """
+    checkpoint = None
+    if checkpoint_path:
+        scan = {'params': params or {}, 'fields': list(fields or ()), 'per_page': per_page}
+        checkpoint = ScanCheckpoint(checkpoint_path, scan)
+        for matches in checkpoint.pages.values():
+            yield from matches
+
+    def scan_page(page):
+        posts, total_pages = fetch_page(client, page, per_page, params, fields)
+        return page, total_pages, [post for post in posts if detect(post)]
+
+    try:
+        total_pages = checkpoint.total_pages if checkpoint else None
+        done = set(checkpoint.pages) if checkpoint else set()
+        if total_pages is None:
+            # The first page tells how many there are
+            page, total_pages, matches = scan_page(1)
+            if checkpoint:
+                checkpoint.add(page, total_pages, matches)
+            done.add(page)
+            yield from matches
+
+        pending = [page for page in range(1, total_pages + 1) if page not in done]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(scan_page, page) for page in pending]
+            for future in as_completed(futures):
+                page, pages_now, matches = future.result()
+                if checkpoint:
+                    checkpoint.add(page, pages_now, matches)
+                yield from matches
+    except BaseException:
+        if checkpoint:
+            checkpoint.close()
+        raise
+    if checkpoint:
+        checkpoint.remove()
@@ -0,0 +1,243 @@
+"""
+Resident publisher service
+
+Keeps one process running so callers skip interpreter start-up, imports
+and TLS handshakes: the API connections, render caches and compiled
+converter stay warm between requests, and requests are served
+concurrently, one thread each.  The service speaks JSON over HTTP on a
+Unix socket (the default, owner-only) or a loopback TCP port:
+
+    POST /publish   {"path": "doc.md", "title": ..., "force": ..., ...}
+    POST /render    {"markdown": "# Text"} or {"path": "doc.md"}
+    GET  /status
+
+Paths are taken relative to the service's working directory, so callers
+send absolute ones.  Every answer is a JSON object with "ok"; failures
+add "error".  The actions themselves are supplied by the caller of
+make_server() (wp-publisher.py --serve); wp-client.py is the matching
+thin client.
+"""
+
+import contextlib
+import inspect
+import json
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+DEFAULT_SOCKET = os.environ.get('WP_PUBLISHER_SOCKET',
+                                os.path.expanduser('~/.cache/wp-publisher/publisher.sock'))
+
+# Refuse request bodies larger than this
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost')
+
+
+class RequestError(Exception):
+    """A request the service cannot act on; answered with status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_address(address):
+    """Split an address into ('unix', path) or ('tcp', (host, port))
+
+    A bare port or host:port is TCP, anything else a socket path.
+    """
+    host, _, port = address.rpartition(':')
+    if port.isdigit() and '/' not in address:
+        return 'tcp', (host or '127.0.0.1', int(port))
+    return 'unix', address
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'wp-publisher'
+
+    def do_GET(self):
+        self._dispatch(None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_SIZE:
+            self.close_connection = True
+            return self._reply(413, {'ok': False, 'error': 'request too large'})
+        self._dispatch(self.rfile.read(length))
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _dispatch(self, raw):
+        started = time.perf_counter()
+        name = self.path.split('?', 1)[0].strip('/')
+        action = self.server.actions.get(name)
+        status = 200
+        try:
+            if action is None:
+                raise RequestError(f'unknown action {name!r}, expected one of: '
+                                   f'{", ".join(sorted(self.server.actions))}', 404)
+            try:
+                params = json.loads(raw) if raw else {}
+            except ValueError as e:
+                raise RequestError(f'invalid JSON: {e}')
+            if not isinstance(params, dict):
+                raise RequestError('the request body must be a JSON object')
+            try:
+                inspect.signature(action).bind(**params)
+            except TypeError as e:
+                # Unknown or missing parameters
+                raise RequestError(str(e))
+            with self.server.stats.track(name):
+                result = action(**params)
+        except RequestError as e:
+            status = e.status
+            result = {'ok': False, 'error': str(e)}
+        except Exception as e:
+            status = 500
+            result = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+        self._reply(status, result)
+        self.server.stats.record(name, status, time.perf_counter() - started)
+
+    def _reply(self, status, result):
+        data = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _TCPHandler(_Handler):
+    disable_nagle_algorithm = True
+
+
+class ServiceStats:
+    """Requests served per action and status, and how many are running"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.in_flight = {}
+        self.served = {}
+
+    @contextlib.contextmanager
+    def track(self, action):
+        """Count a running request for the body of a with block"""
+        with self.lock:
+            self.in_flight[action] = self.in_flight.get(action, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight[action] -= 1
+
+    def record(self, action, status, seconds):
+        with self.lock:
+            entry = self.served.setdefault(f'{action} {status}', {'count': 0, 'seconds': 0.0})
+            entry['count'] += 1
+            entry['seconds'] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'uptime': round(time.time() - self.started, 1),
+                'pid': os.getpid(),
+                'in_flight': {action: count for action, count in self.in_flight.items() if count},
+                'served': {key: {'count': entry['count'],
+                                 'mean_ms': round(entry['seconds'] / entry['count'] * 1000, 2)}
+                           for key, entry in sorted(self.served.items())},
+            }
+
+
+class _ServiceMixin:
+    daemon_threads = True
+    request_queue_size = 128
+
+    def setup_service(self, actions, verbose):
+        self.actions = actions
+        self.stats = ServiceStats()
+        self.verbose = verbose
+
+
+class TCPService(_ServiceMixin, ThreadingHTTPServer):
+    """The service on a loopback TCP port"""
+
+
+class UnixService(_ServiceMixin, ThreadingMixIn, UnixStreamServer):
+    """The service on a Unix socket, readable by its owner only"""
+
+    def server_bind(self):
+        directory = os.path.dirname(os.path.abspath(self.server_address))
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.server_address):
+            probe = socket.socket(socket.AF_UNIX)
+            try:
+                probe.connect(self.server_address)
+            except OSError:
+                # Left behind by a service that did not shut down cleanly
+                os.remove(self.server_address)
+            else:
+                raise OSError(f'a service is already listening on {self.server_address}')
+            finally:
+                probe.close()
+        old_mask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_mask)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+
+def make_server(actions, address=DEFAULT_SOCKET, verbose=False):
+    """Bind the service for actions ({name: function(**params) -> dict})
+
+    A 'status' action is added that reports the requests served, merged
+    with the result of actions['status'] when there is one.  Only
+    loopback TCP addresses are accepted: the service publishes with the
+    credentials it was started with and has no authentication of its own.
+    """
+    kind, where = parse_address(address)
+    if kind == 'tcp':
+        if where[0] not in LOOPBACK_HOSTS:
+            raise ValueError(f'refusing to listen on {where[0]}: only loopback addresses '
+                             'are allowed')
+        server = TCPService(where, _TCPHandler)
+    else:
+        server = UnixService(where, _Handler)
+    actions = dict(actions)
+    extra_status = actions.get('status')
+
+    def status():
+        result = dict(server.stats.snapshot(), ok=True)
+        if extra_status is not None:
+            result.update(extra_status())
+        return result
+
+    actions['status'] = status
+    server.setup_service(actions, verbose)
+    return server
+
+
+def describe(server):
+    """The address a client should use for server"""
+    if isinstance(server, UnixService):
+        return server.server_address
+    host, port = server.server_address[:2]
+    return f'{host}:{port}'
@@ -0,0 +1,261 @@
+"""
+Static HTML build of a markdown tree
+
+build_site() renders every markdown file under a directory to a matching
+.html file under an output directory, converting in a process pool.  A
+small SQLite table remembers, per output directory and source, the
+source's mtime, size and content hash and the converter version and page
+template it was built with, so a rebuild only stats the sources and
+converts the ones that changed.  Pages are written to a temporary file and
+renamed into place, so a reader never sees a half-written page, and pages
+whose source was deleted are removed.  Relative links to .md files are
+pointed at the matching .html pages.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from html import escape
+from pathlib import Path
+from string import Template
+
+from wptools.bulk import render_document
+from wptools.manifest import file_hash
+from wptools.highlight import stylesheet
+from wptools.markdown import converter_version
+from wptools.metrics import METRICS
+
+DEFAULT_STATE_PATH = os.path.expanduser('~/.cache/wp-publisher/build.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS built (
+    output_dir TEXT NOT NULL,
+    source TEXT NOT NULL,
+    output TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    options TEXT NOT NULL,
+    mtime REAL,
+    size INTEGER,
+    built_at REAL,
+    PRIMARY KEY (output_dir, source)
+)
+'''
+
+# $title, $content and $styles (the highlighting stylesheet, empty
+# without --highlight) are filled in; the rest is copied as is
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>$title</title>
+<style>
+body { max-width: 52rem; margin: 2rem auto; padding: 0 1rem; line-height: 1.6;
+       font-family: system-ui, sans-serif; color: #222; }
+pre { background: #f5f5f5; padding: 0.75rem 1rem; overflow-x: auto; }
+code { font-family: ui-monospace, monospace; font-size: 0.9em; }
+table { border-collapse: collapse; }
+th, td { border: 1px solid #ccc; padding: 0.3rem 0.6rem; }
+$styles
+</style>
+</head>
+<body>
+<h1>$title</h1>
+$content
+</body>
+</html>
+'''
+
+# Relative links to markdown files (not absolute paths, anchors or URLs)
+MARKDOWN_LINK_RE = re.compile(r'href="(?![a-zA-Z][a-zA-Z0-9+.-]*:|/|#)([^"#]*?)\.md(#[^"]*)?"')
+
+
+def link_pages(html):
+    """Point relative links to .md files at the built .html pages"""
+    return MARKDOWN_LINK_RE.sub(lambda m: f'href="{m.group(1)}.html{m.group(2) or ""}"', html)
+
+
+def write_atomic(path, text):
+    """Write text to path through a temporary file renamed into place"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def build_page(source, output, template, cache_path=None, budget=None, highlight=False):
+    """Convert one markdown file and write its page (run in a worker)
+
+    Returns (title, cached, seconds) as render_document() does.
+    """
+    title, html, cached, seconds = render_document(source, cache_path, budget, highlight)
+    page = Template(template).safe_substitute(title=escape(title, quote=False),
+                                              content=link_pages(html),
+                                              styles=stylesheet() if highlight else '')
+    write_atomic(output, page)
+    return title, cached, seconds
+
+
+class BuildState:
+    """What was last built into one output directory, per source file"""
+
+    def __init__(self, path=DEFAULT_STATE_PATH, output_dir=''):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.output_dir = os.path.abspath(output_dir)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute(SCHEMA)
+
+    def entries(self):
+        """All entries of the output directory, by source path"""
+        with self.lock:
+            rows = self.db.execute('SELECT * FROM built WHERE output_dir = ?',
+                                   (self.output_dir,)).fetchall()
+        return {row['source']: dict(row) for row in rows}
+
+    def record(self, source, output, content_hash, options, stat):
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO built VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.output_dir, source, output, content_hash, options, stat.st_mtime,
+                 stat.st_size, time.time()))
+
+    def forget(self, source):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM built WHERE output_dir = ? AND source = ?',
+                            (self.output_dir, source))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def build_options(template, highlight=False):
+    """Fingerprint of everything besides the source that shapes a page"""
+    digest = hashlib.sha256(template.encode('utf-8')).hexdigest()[:16]
+    return f'{converter_version(highlight)}:{digest}'
+
+
+def _check(entry, source, output, options):
+    """Return (changed, content_hash, stat) for a source, like Manifest.check"""
+    stat = os.stat(source)
+    if entry is None or entry['options'] != options or not os.path.exists(output):
+        return True, None, stat
+    if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+        return False, entry['content_hash'], stat
+    content_hash = file_hash(source)
+    return content_hash != entry['content_hash'], content_hash, stat
+
+
+def build_site(root, output_dir, template=PAGE_TEMPLATE, workers=None, force=False,
+               state_path=DEFAULT_STATE_PATH, cache_path=None, budget=None, highlight=False):
+    """Render every markdown file under root to output_dir
+
+    Unchanged sources (by mtime and size, then by content hash) whose page
+    still exists are skipped unless force is set.  Pages are converted in
+    a pool of workers processes (default: one per CPU) sharing the render
+    cache at cache_path; budget limits each conversion and highlight turns
+    on syntax highlighting.  Returns one result dict per source, and per
+    removed page, in path order: 'action' is 'built', 'unchanged' or
+    'removed', and failures have ok false and an 'error'.
+    """
+    root = os.path.abspath(root)
+    output_dir = os.path.abspath(output_dir)
+    options = build_options(template, highlight)
+    state = BuildState(state_path, output_dir)
+    try:
+        entries = state.entries()
+        results = []
+        pending = {}
+        for path in sorted(Path(root).rglob('*.md')):
+            source = str(path)
+            # Never read back pages built into a directory inside root
+            if source.startswith(output_dir + os.sep):
+                continue
+            output = os.path.join(output_dir, str(path.relative_to(root).with_suffix('.html')))
+            entry = entries.pop(source, None)
+            changed, content_hash, stat = _check(entry, source, output, options)
+            if changed or force:
+                pending[source] = (output, content_hash, stat)
+                continue
+            if entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                # Touched but not edited: remember the new timestamp
+                state.record(source, output, content_hash, options, stat)
+            results.append({'source': source, 'output': output, 'ok': True,
+                            'action': 'unchanged', 'seconds': 0.0})
+        for source, entry in entries.items():
+            # Sources deleted since the last build
+            try:
+                os.remove(entry['output'])
+            except FileNotFoundError:
+                pass
+            state.forget(source)
+            results.append({'source': source, 'output': entry['output'], 'ok': True,
+                            'action': 'removed', 'seconds': 0.0})
+        results.extend(_build(pending, template, workers, state, options, cache_path, budget,
+                              highlight))
+    finally:
+        state.close()
+    return sorted(results, key=lambda result: result['source'])
+
+
+def _build(pending, template, workers, state, options, cache_path, budget, highlight):
+    if not pending:
+        return []
+
+    def finish(source, build):
+        output, content_hash, stat = pending[source]
+        try:
+            title, cached, seconds = build()
+        except Exception as e:
+            return {'source': source, 'output': output, 'ok': False, 'error': str(e),
+                    'seconds': 0.0}
+        if not cached:
+            METRICS.observe('convert', seconds)
+        state.record(source, output, content_hash or file_hash(source), options, stat)
+        return {'source': source, 'output': output, 'ok': True, 'action': 'built',
+                'title': title, 'cached': cached, 'seconds': seconds}
+
+    if len(pending) == 1:
+        # Not worth starting a pool for
+        source, (output, _, _) = next(iter(pending.items()))
+        return [finish(source, lambda: build_page(source, output, template, cache_path, budget,
+                                                  highlight))]
+    # Forked workers flush the stdio buffers they inherit when they exit
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(build_page, source, output, template, cache_path, budget,
+                               highlight): source for source, (output, _, _) in pending.items()}
+        return [finish(futures[future], future.result) for future in as_completed(futures)]
+
+
+def print_summary(results, elapsed):
+    """Print failures and the totals of a build"""
+    counts = {}
+    for result in results:
+        if result['ok']:
+            counts[result['action']] = counts.get(result['action'], 0) + 1
+        else:
+            counts['failed'] = counts.get('failed', 0) + 1
+            print(f"   ❌ {result['source']}: {result.get('error', 'failed')}")
+    others = ', '.join(f'{count} {action}' for action, count in sorted(counts.items())
+                       if action != 'built')
+    print(f"{'❌' if 'failed' in counts else '✅'} Built {counts.get('built', 0)} pages in "
+          f"{elapsed:.2f}s" + (f' ({others})' if others else ''))
@@ -0,0 +1,175 @@
+"""
+Publishing to several WordPress sites at once
+
+A target file lists the sites a run can publish to, by name:
+
+    {
+      "staging": {"url": "https://staging.example.com", "user": "editor",
+                  "password_env": "WP_STAGING_PASSWORD", "rate": 5},
+      "production": {"url": "https://wp.stringbits.com", "user": "itservice",
+                     "password": "...", "concurrency": 2}
+    }
+
+password_env names an environment variable holding the (application)
+password, so the file need not contain it.  rate (posts per second) and
+concurrency default to the command line's --rate and --concurrency.
+
+Fanout sends each converted document to every target concurrently.  Each
+target has its own thread pool and token bucket, so a slow or throttled
+site does not hold the others back, and stops on its own when its
+circuit breaker opens.  The outcome and latency of every send are kept
+per target for print_report().
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from wptools.bulk import TokenBucket
+from wptools.client import CircuitOpen
+
+DEFAULT_PATH = os.path.expanduser('~/.config/wp-publisher/targets.json')
+
+
+class Target:
+    """One WordPress site to publish to"""
+
+    def __init__(self, name, url, username=None, password=None, rate=2.0, concurrency=4):
+        self.name = name
+        self.url = url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.rate = rate
+        self.concurrency = max(1, concurrency)
+
+    def __repr__(self):
+        return f'Target({self.name!r}, {self.url!r})'
+
+
+def load_targets(path=DEFAULT_PATH, names=None, rate=2.0, concurrency=4):
+    """Read the targets in path; returns the ones named (all for None) in order
+
+    Raises OSError when the file cannot be read and ValueError when it is
+    not valid or names an unknown target.
+    """
+    with open(path, 'r') as f:
+        try:
+            config = json.load(f)
+        except ValueError as e:
+            raise ValueError(f'{path}: {e}') from None
+    if not isinstance(config, dict) or not config:
+        raise ValueError(f'{path}: expected an object of targets by name')
+    targets = {}
+    for name, options in config.items():
+        if not isinstance(options, dict) or not options.get('url'):
+            raise ValueError(f'{path}: target {name!r} needs a url')
+        password = options.get('password')
+        if options.get('password_env'):
+            password = os.environ.get(options['password_env'])
+            if password is None:
+                raise ValueError(f"target {name!r}: ${options['password_env']} is not set")
+        try:
+            target_rate = float(options.get('rate', rate))
+            target_concurrency = int(options.get('concurrency', concurrency))
+        except (TypeError, ValueError):
+            raise ValueError(f'{path}: target {name!r} has a bad rate or concurrency') from None
+        targets[name] = Target(name, options['url'], options.get('user'), password, target_rate,
+                               target_concurrency)
+    if names is None:
+        return list(targets.values())
+    unknown = [name for name in names if name not in targets]
+    if unknown:
+        raise ValueError(f"unknown target{'s' if len(unknown) > 1 else ''}: "
+                         f"{', '.join(unknown)} (known: {', '.join(targets)})")
+    return [targets[name] for name in dict.fromkeys(names)]
+
+
+class Fanout:
+    """Send documents to several targets, each through its own pool and rate"""
+
+    def __init__(self, targets):
+        self.targets = list(targets)
+        self.pools = {target.name: ThreadPoolExecutor(target.concurrency,
+                                                      thread_name_prefix=f'target-{target.name}')
+                      for target in self.targets}
+        self.limiters = {target.name: TokenBucket(target.rate, target.concurrency)
+                         for target in self.targets}
+        # Why each target was stopped early, once it was
+        self.stopped = {target.name: [] for target in self.targets}
+        self.outcomes = {target.name: [] for target in self.targets}
+        self.lock = threading.Lock()
+
+    def send(self, item, send, targets=None):
+        """Run send(target) for item on each of targets (default: all)
+
+        send returns a dict (such as the post's 'action', 'id' and
+        'link') or raises.  Returns {target name: future outcome}.
+        """
+        return {target.name: self.pools[target.name].submit(self._send, target, item, send)
+                for target in (self.targets if targets is None else targets)}
+
+    def _send(self, target, item, send):
+        stopped = self.stopped[target.name]
+        if stopped:
+            return self.record(target, item, {'ok': False, 'error': f'skipped, {stopped[0]}',
+                                              'skipped': True, 'seconds': 0.0})
+        self.limiters[target.name].acquire()
+        started = time.monotonic()
+        try:
+            result = send(target)
+        except Exception as e:
+            if isinstance(e, CircuitOpen):
+                # The site is down: send it nothing more this run
+                stopped.append(str(e))
+            return self.record(target, item, {'ok': False, 'error': str(e),
+                                              'seconds': time.monotonic() - started})
+        return self.record(target, item, dict(result, ok=True,
+                                              seconds=time.monotonic() - started))
+
+    def record(self, target, item, outcome):
+        """Add the outcome of item on target to the report; returns it"""
+        outcome = dict(outcome, item=item)
+        with self.lock:
+            self.outcomes[target.name].append(outcome)
+        return outcome
+
+    def close(self):
+        """Wait for every send to finish"""
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+
+
+ACTION_ICONS = {'created': '✅', 'updated': '🔄', 'unchanged': '⏭️ '}
+
+
+def print_report(fanout, elapsed):
+    """Print each target's outcomes and latency, with its failures"""
+    print('\n📡 Targets')
+    for target in fanout.targets:
+        outcomes = sorted(fanout.outcomes[target.name], key=lambda outcome: outcome['item'])
+        counts = {}
+        for outcome in outcomes:
+            action = outcome.get('action', 'created') if outcome['ok'] else 'failed'
+            counts[action] = counts.get(action, 0) + 1
+        sent = [outcome['seconds'] for outcome in outcomes
+                if outcome['ok'] and outcome.get('action') != 'unchanged']
+        latency = (f', {sum(sent) / len(sent):.2f}s avg, {max(sent):.2f}s max' if sent else '')
+        breakdown = ', '.join(f'{count} {action}' for action, count in sorted(counts.items()))
+        print(f"   {'❌' if 'failed' in counts else '✅'} {target.name} ({target.url}): "
+              f"{breakdown or 'nothing sent'}{latency}")
+        skipped = 0
+        for outcome in outcomes:
+            if outcome.get('skipped'):
+                skipped += 1
+            elif not outcome['ok']:
+                print(f"      ❌ {outcome['item']}: {outcome.get('error', 'failed')}")
+            elif len(outcomes) == 1 and outcome.get('link'):
+                print(f"      {ACTION_ICONS.get(outcome.get('action'), '✅')} {outcome['link']}")
+        if skipped:
+            print(f"      ⛔ {skipped} not sent: {fanout.stopped[target.name][0]}")
+    ok = sum(1 for target in fanout.targets
+             if all(outcome['ok'] for outcome in fanout.outcomes[target.name]))
+    print(f"\n{'✅' if ok == len(fanout.targets) else '❌'} Published to {ok} of "
+          f"{len(fanout.targets)} targets without errors in {elapsed:.2f}s")
@@ -0,0 +1,144 @@
+"""
+Category and tag resolution
+
+Maps term names or slugs to ids.  All terms of a taxonomy are fetched in
+one paginated sweep and kept in a local JSON cache for ttl seconds; terms
+that do not exist yet are created together through the batch endpoint.
+Publishing a batch of documents then needs no per-post lookups.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+from wptools.client import BATCH_LIMIT, WordPressError
+from wptools.scan import fetch_all
+
+DEFAULT_PATH = os.path.expanduser('~/.cache/wp-publisher/taxonomy.json')
+DEFAULT_TTL = 3600
+
+TERM_FIELDS = ('id', 'name', 'slug')
+
+
+def slugify(name):
+    """Approximate WordPress' sanitize_title for plain names"""
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+class TaxonomyResolver:
+    """Resolve category and tag names to ids for one site
+
+    Terms may be given as ids (returned as they are), names or slugs
+    (matched case-insensitively), or dicts with 'name' and optionally
+    'slug' and 'description' used when the term has to be created.
+    """
+
+    def __init__(self, client, site='', path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+        self.client = client
+        self.site = site
+        self.path = path
+        self.ttl = ttl
+        self.terms = {}
+        self.lock = threading.Lock()
+
+    # -- cache ---------------------------------------------------------------
+
+    def _load(self, taxonomy):
+        try:
+            with open(self.path) as f:
+                cached = json.load(f).get(self.site, {}).get(taxonomy)
+        except (OSError, ValueError):
+            return None
+        if not cached or time.time() - cached['fetched_at'] > self.ttl:
+            return None
+        return cached['terms']
+
+    def _save(self, taxonomy, terms):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data.setdefault(self.site, {})[taxonomy] = {'fetched_at': time.time(), 'terms': terms}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp, self.path)
+
+    # -- lookup --------------------------------------------------------------
+
+    def prefetch(self, taxonomy, refresh=False):
+        """Load every term of a taxonomy ('categories' or 'tags')"""
+        with self.lock:
+            if taxonomy in self.terms and not refresh:
+                return self.terms[taxonomy]
+            terms = None if refresh else self._load(taxonomy)
+            if terms is None:
+                terms = fetch_all(self.client, f'/{taxonomy}', fields=TERM_FIELDS,
+                                  params={'hide_empty': 'false'})
+                terms = [{name: term[name] for name in TERM_FIELDS} for term in terms]
+                self._save(taxonomy, terms)
+            self.terms[taxonomy] = terms
+            return terms
+
+    def _find(self, taxonomy, term):
+        wanted = {term['name'].lower(), term.get('slug') or slugify(term['name'])}
+        for known in self.terms[taxonomy]:
+            if known['name'].lower() in wanted or known['slug'] in wanted:
+                return known['id']
+        return None
+
+    def resolve(self, taxonomy, terms):
+        """Return the ids for terms, creating the missing ones"""
+        self.prefetch(taxonomy)
+        specs = [term if isinstance(term, (int, dict)) else {'name': term} for term in terms]
+        missing = []
+        for spec in specs:
+            if isinstance(spec, dict) and self._find(taxonomy, spec) is None \
+                    and spec['name'].lower() not in {m['name'].lower() for m in missing}:
+                missing.append(spec)
+        if missing:
+            self.create(taxonomy, missing)
+        return [spec if isinstance(spec, int) else self._find(taxonomy, spec) for spec in specs]
+
+    # -- creation ------------------------------------------------------------
+
+    def create(self, taxonomy, specs):
+        """Create terms BATCH_LIMIT at a time and add them to the cache"""
+        created = []
+        for start in range(0, len(specs), BATCH_LIMIT):
+            group = specs[start:start + BATCH_LIMIT]
+            try:
+                responses = self.client.batch([('POST', f'/{taxonomy}', spec) for spec in group])
+            except WordPressError as e:
+                if e.status not in (404, 405):
+                    raise
+                responses = [self._create_one(taxonomy, spec) for spec in group]
+            for spec, (status, body) in zip(group, responses):
+                created.append(self._created_term(spec, status, body))
+        with self.lock:
+            self.terms[taxonomy].extend(created)
+            self._save(taxonomy, self.terms[taxonomy])
+        return created
+
+    def _create_one(self, taxonomy, spec):
+        try:
+            return 201, self.client.post(f'/{taxonomy}', spec, fields=TERM_FIELDS)
+        except WordPressError as e:
+            return e.status, e.data
+
+    @staticmethod
+    def _created_term(spec, status, body):
+        if status is not None and 200 <= status < 300:
+            return {name: body[name] for name in TERM_FIELDS}
+        data = body.get('data') if isinstance(body, dict) else None
+        if isinstance(data, dict) and data.get('term_id'):
+            # Created by someone else since the prefetch
+            return {'id': data['term_id'], 'name': spec['name'],
+                    'slug': spec.get('slug') or slugify(spec['name'])}
+        message = body.get('message') if isinstance(body, dict) else None
+        raise WordPressError(f"Could not create term {spec['name']!r}: {message or status}",
+                             status, body)
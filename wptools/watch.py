@@ -0,0 +1,166 @@
+"""
+Watch a directory tree for edited markdown files
+
+On Linux the kernel reports changes through inotify (via ctypes, no extra
+dependencies); elsewhere the tree is polled.  watch_changes() debounces
+bursts of saves and coalesces repeated edits of the same file, yielding
+each settled set of changed paths once.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_markdown(path):
+    """True for markdown files, but not editor backups and lock files"""
+    name = os.path.basename(path)
+    return name.endswith('.md') and not name.startswith(('.#', '.~'))
+
+
+def _walk_dirs(root):
+    yield root
+    for path, dirs, _ in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for d in dirs:
+            yield os.path.join(path, d)
+
+
+def _walk_markdown(root):
+    for path, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if is_markdown(name):
+                yield os.path.join(path, name)
+
+
+class InotifyWatcher:
+    """Report files written under root, using Linux inotify"""
+
+    def __init__(self, root):
+        self.root = root
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}
+        for path in _walk_dirs(root):
+            self._add(path)
+
+    def _add(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd >= 0:
+            self.dirs[wd] = path
+
+    def read(self, timeout=None):
+        """Wait up to timeout seconds and return the paths written since"""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped: report everything
+                paths.extend(_walk_markdown(self.root))
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if wd not in self.dirs:
+                continue
+            path = os.path.join(self.dirs[wd], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not name.startswith('.'):
+                    # New directories are watched too, and files already
+                    # moved into them count as changed
+                    for directory in _walk_dirs(path):
+                        self._add(directory)
+                    paths.extend(_walk_markdown(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Report files written under root by comparing mtimes"""
+
+    def __init__(self, root, interval=1.0):
+        self.root = root
+        self.interval = interval
+        self.mtimes = self._scan()
+
+    def _scan(self):
+        mtimes = {}
+        for path in _walk_markdown(self.root):
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+        return mtimes
+
+    def read(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        mtimes = self._scan()
+        paths = [path for path, mtime in mtimes.items() if self.mtimes.get(path) != mtime]
+        self.mtimes = mtimes
+        return paths
+
+    def close(self):
+        pass
+
+
+def make_watcher(root):
+    """inotify on Linux, polling elsewhere"""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(root)
+
+
+def watch_changes(root, debounce=0.5, accept=is_markdown, watcher=None):
+    """Yield sorted lists of changed files once edits have settled
+
+    A batch is yielded when no further change arrived for debounce seconds;
+    a file saved several times within that window appears once.
+    """
+    watcher = watcher or make_watcher(root)
+    pending = set()
+    deadline = None
+    try:
+        while True:
+            timeout = None if not pending else max(0.0, deadline - time.monotonic())
+            changed = [path for path in watcher.read(timeout) if accept(path)]
+            if changed:
+                pending.update(changed)
+                deadline = time.monotonic() + debounce
+            elif pending and time.monotonic() >= deadline:
+                batch = sorted(path for path in pending if os.path.isfile(path))
+                pending = set()
+                if batch:
+                    yield batch
+    finally:
+        watcher.close()